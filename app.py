@@ -74,6 +74,21 @@ def initialize_database_tables():
 # 执行数据库表初始化
 initialize_database_tables()
 
+def attachment_disposition(filename):
+    """
+    流式下载的 Content-Disposition 头（与 send_file(download_name=...) 相同的编码方式）
+
+    文件名含用户输入的任务ID：特殊字符加引号，非ASCII字符用 RFC 5987 的 filename* 编码
+    """
+    from unicodedata import normalize
+    from urllib.parse import quote
+    from werkzeug.http import dump_options_header
+    
+    options = {'filename': normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')}
+    if options['filename'] != filename:
+        options['filename*'] = f"UTF-8''{quote(filename, safe='')}"
+    return dump_options_header('attachment', options)
+
 @app.route("/")
 def index():
     """首页"""
@@ -898,6 +913,7 @@ def download_solana_data(data_type):
 def holder_snapshots():
     """基于定时采集数据的持仓快照分析"""
     from modules.holder import list_collection_tasks, analyze_holder_patterns
+    from services.stream_export import parquet_available
     
     # 获取所有采集任务
     tasks = list_collection_tasks()
@@ -909,7 +925,7 @@ def holder_snapshots():
         
         if not task_id:
             flash("请选择一个采集任务", "danger")
-            return render_template("holder_snapshots.html", tasks=tasks)
+            return render_template("holder_snapshots.html", tasks=tasks, parquet_available=parquet_available())
         
         try:
             # 分析持仓模式
@@ -921,162 +937,45 @@ def holder_snapshots():
                 analysis_result=analysis_result,
                 task_id=task_id,
                 top_n=top_n,
-                min_snapshots=min_snapshots
+                min_snapshots=min_snapshots,
+                parquet_available=parquet_available()
             )
             
         except Exception as e:
             flash(f"分析失败: {e}", "danger")
-            return render_template("holder_snapshots.html", tasks=tasks)
-    
-    return render_template("holder_snapshots.html", tasks=tasks)
-
-def cleanup_old_snapshot_files():
-    """清理过期的快照临时文件"""
-    import tempfile
-    import os
-    import glob
-    import time
-    
-    # 获取临时目录
-    temp_dir = os.path.join(tempfile.gettempdir(), 'okx_pnl_tool')
+            return render_template("holder_snapshots.html", tasks=tasks, parquet_available=parquet_available())
     
-    # 确保目录存在
-    if not os.path.exists(temp_dir):
-        return
-        
-    # 寻找所有快照文件
-    snapshot_files = glob.glob(os.path.join(temp_dir, 'snapshot_*.pkl'))
-    
-    # 检查每个文件
-    now = time.time()
-    for file_path in snapshot_files:
-        # 如果文件超过12小时未修改，则删除
-        if os.path.exists(file_path) and (now - os.path.getmtime(file_path)) > 12 * 3600:
-            try:
-                os.remove(file_path)
-                logger.info(f"已清理过期快照文件: {file_path}")
-            except Exception as e:
-                logger.error(f"清理快照文件失败: {file_path}, 错误: {str(e)}")
+    return render_template("holder_snapshots.html", tasks=tasks, parquet_available=parquet_available())
 
 @app.route('/download_holder_snapshots', methods=["POST"])
 def download_holder_snapshots():
-    """下载持仓快照数据"""
-    # 清理老旧文件
-    cleanup_old_snapshot_files()
-    if 'holder_snapshots' not in session:
-        flash("没有可导出的快照数据", "warning")
+    """下载持仓快照（流式响应）：exportType=merged 长表 / timeseries 宽表 / all 打包，format=csv|parquet"""
+    task_id = request.form.get("task_id")
+    if not task_id:
+        flash("请选择一个采集任务", "warning")
         return redirect(url_for('holder_snapshots'))
     
     try:
-        # 获取临时文件路径与当前请求的代币地址
-        snapshot_info = session['holder_snapshots']
-        temp_file = snapshot_info.get('temp_file')
-        session_token_address = snapshot_info.get('token_address')
-        current_token_address = request.form.get('tokenAddress')  # 从表单获取当前查询的代币地址
-        
-        # 日志记录
-        if current_token_address:
-            logger.info(f"当前请求导出代币: {current_token_address}")
-            logger.info(f"Session中保存的代币: {session_token_address}")
-            
-            # 如果表单中提供了代币地址，且与session中不一致，说明用户已经查询了新的代币
-            if session_token_address != current_token_address:
-                flash(f"检测到代币地址变更，请先查询新代币的快照数据后再导出", "warning")
-                return redirect(url_for('holder_snapshots'))
-        
-        if not temp_file or not os.path.exists(temp_file):
-            flash("快照数据已过期或不存在，请重新生成", "warning")
-            return redirect(url_for('holder_snapshots'))
-        
-        # 从临时文件加载数据
-        import pickle
-        with open(temp_file, 'rb') as f:
-            try:
-                snapshot_data = pickle.load(f)
-                historical_data = snapshot_data['data']
-                token_address = snapshot_data['token_address']
-            except Exception as e:
-                flash(f"无法加载快照数据: {str(e)}", "danger")
-                return redirect(url_for('holder_snapshots'))
-        
-        export_type = request.form.get("exportType", "merged")  # merged, timeseries, all
-        
-        # 调用导出函数
+        from flask import Response, stream_with_context
         from modules.holder import export_holder_snapshots
-                # 添加更多日志
-        logger.info(f"正在导出快照数据，类型: {export_type}, 快照数量: {len(historical_data)}")
-        logger.info(f"导出代币地址: {token_address}")
-        
-        # 对每个快照时间点记录数据量
-        for label, df in historical_data.items():
-            if isinstance(df, pd.DataFrame):
-                logger.info(f"时间点 {label}: {len(df)} 条记录")
-            else:
-                logger.info(f"时间点 {label}: 非DataFrame类型 ({type(df)})")
         
-        # 调用导出函数
-        merged_path, timeseries_path = export_holder_snapshots(historical_data, token_address)        # 记录导出结果
-        if merged_path:
-            logger.info(f"合并CSV导出成功: {merged_path}")
-        else:
-            logger.warning("合并CSV导出失败")
-            
-        if timeseries_path:
-            logger.info(f"时序CSV导出成功: {timeseries_path}")
-        else:
-            logger.warning("时序CSV导出失败")
-        
-        if export_type == "timeseries" and timeseries_path:
-            # 返回时间序列格式
-            try:
-                return send_file(
-                    timeseries_path,
-                    as_attachment=True,
-                    download_name=os.path.basename(timeseries_path),
-                    mimetype="text/csv"
-                )
-            except Exception as e:
-                logger.error(f"文件发送失败: {str(e)}")
-                flash(f"文件下载失败: {str(e)}", "danger")
-                return redirect(url_for('holder_snapshots'))
-        elif export_type == "all":
-            # 打包两个文件
-            import zipfile
-            from io import BytesIO
-            
-            memory_file = BytesIO()
-            with zipfile.ZipFile(memory_file, 'w') as zf:
-                if merged_path:
-                    zf.write(merged_path, os.path.basename(merged_path))
-                if timeseries_path:
-                    zf.write(timeseries_path, os.path.basename(timeseries_path))
-            
-            memory_file.seek(0)
-            return send_file(
-                memory_file,
-                as_attachment=True,
-                download_name=f"holder_snapshots_{token_address[:8]}_{int(time.time())}.zip",
-                mimetype="application/zip"
-            )
-        else:
-            # 默认返回合并格式
-            if merged_path:
-                try:
-                    return send_file(
-                        merged_path,
-                        as_attachment=True,
-                        download_name=os.path.basename(merged_path),
-                        mimetype="text/csv"
-                    )
-                except Exception as e:
-                    logger.error(f"文件发送失败: {str(e)}")
-                    flash(f"文件下载失败: {str(e)}", "danger")
-                    return redirect(url_for('holder_snapshots'))
+        export_type = request.form.get("exportType", "merged")  # merged, timeseries, all
+        fmt = request.form.get("format", "csv")
+        logger.info(f"正在导出快照数据，任务: {task_id}，类型: {export_type}，格式: {fmt}")
         
-        flash("导出失败: 未生成可下载的文件", "danger")
-        logger.error("导出失败: 未生成可下载的文件")
+        stream, mimetype, filename = export_holder_snapshots(
+            task_id, export_type, fmt,
+            request.form.get("start") or None, request.form.get("end") or None
+        )
+        return Response(
+            stream_with_context(stream),
+            mimetype=mimetype,
+            headers={"Content-Disposition": attachment_disposition(filename)}
+        )
+    
+    except ImportError:
+        flash("Parquet导出需要安装 pyarrow", "danger")
         return redirect(url_for('holder_snapshots'))
-        
     except Exception as e:
         flash(f"导出失败: {str(e)}", "danger")
         return redirect(url_for('holder_snapshots'))
@@ -1350,6 +1249,13 @@ def system_status():
         import psutil
         import os
         from services.database_service import get_connection_pool_status
+        from config.http_client import get_http_client
+        from services.rate_limiter import get_rate_limiter
+        from services.response_cache import get_response_cache
+        from services.single_flight import get_single_flight
+        from services.concurrency_controller import get_concurrency_controller
+        from services.circuit_breaker import get_circuit_breakers
+        from modules.holder import get_collector
         
         # 获取内存使用情况
         process = psutil.Process(os.getpid())
@@ -1366,6 +1272,13 @@ def system_status():
             'memory_percent': process.memory_percent(),
             'database_status': db_status,
             'connection_pool': pool_status,  # 新增连接池信息
+            'http_pools': get_http_client().get_pool_info(),
+            'rate_limits': get_rate_limiter().get_status(),
+            'response_cache': get_response_cache().get_stats(),
+            'single_flight': get_single_flight().get_stats(),
+            'adaptive_concurrency': get_concurrency_controller().get_status(),
+            'circuit_breakers': get_circuit_breakers().get_status(),
+            'holder_scheduler': get_collector().get_scheduler_status(),
             'status': 'healthy'
         })
     except Exception as e:
@@ -1374,6 +1287,17 @@ def system_status():
             'error': str(e)
         })
 
+@app.route('/metrics')
+def upstream_metrics():
+    """上游调用统计 - JSON，或 ?format=prometheus 供抓取"""
+    from flask import Response
+    from services.metrics import get_metrics
+    
+    metrics = get_metrics()
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify(metrics.snapshot())
+
 @app.route('/db_test')
 def db_test():
     """数据库连接测试"""
@@ -1608,6 +1532,8 @@ def add_holder_task():
         interval_hours = int(request.form.get('interval_hours', 24))
         max_records = int(request.form.get('max_records', 1000))
         description = request.form.get('description', '').strip()
+        retention_policy = request.form.get('retention_policy', '').strip() or None
+        backfill_days = float(request.form.get('backfill_days') or 0)
         
         if not all([task_id, token_address, token_symbol, chain]):
             flash("请填写所有必需字段", "warning")
@@ -1620,11 +1546,16 @@ def add_holder_task():
             chain=chain,
             interval_hours=interval_hours,
             max_records=max_records,
-            description=description
+            description=description,
+            retention_policy=retention_policy
         )
         
         if success:
             flash(f"成功创建采集任务: {task_id}", "success")
+            if backfill_days > 0:
+                from modules.holder import backfill_collection_task
+                backfill_collection_task(task_id, days=backfill_days)
+                flash(f"已开始回填最近 {backfill_days:g} 天的历史快照", "info")
         else:
             flash(f"创建采集任务失败，任务可能已存在", "danger")
             
@@ -1683,22 +1614,38 @@ def run_holder_task_now(task_id):
     """立即执行采集任务"""
     try:
         from modules.holder import run_task_now
-        
-        # 在后台线程中执行，避免阻塞
-        import threading
-        def run_task():
-            run_task_now(task_id)
-        
-        thread = threading.Thread(target=run_task)
-        thread.daemon = True
-        thread.start()
-        
-        flash(f"任务 {task_id} 已开始执行", "info")
+        # 提交到采集调度器的有界线程池（队列模式下写入采集队列），避免阻塞请求
+        status = run_task_now(task_id)
+        if status == 'missing':
+            flash(f"任务 {task_id} 不存在", "warning")
+        elif status == 'running':
+            flash(f"任务 {task_id} 仍在执行中，本次未重复执行", "warning")
+        elif status == 'queued':
+            flash(f"任务 {task_id} 已加入采集队列", "info")
+        else:
+            flash(f"任务 {task_id} 已开始执行", "info")
     except Exception as e:
         flash(f"执行任务失败: {e}", "danger")
     
     return redirect(url_for('holder_collection'))
 
+@app.route("/holder_collection/backfill/<task_id>", methods=["POST"])
+def backfill_holder_task(task_id):
+    """回填历史快照（后台执行）"""
+    try:
+        from modules.holder import backfill_collection_task
+        
+        days = float(request.form.get('days') or 0) or None
+        step_hours = float(request.form.get('step_hours') or 0) or None
+        if backfill_collection_task(task_id, days=days, step_hours=step_hours):
+            flash(f"任务 {task_id} 已开始回填历史快照", "info")
+        else:
+            flash(f"任务 {task_id} 不存在", "warning")
+    except Exception as e:
+        flash(f"回填失败: {e}", "danger")
+    
+    return redirect(url_for('holder_collection'))
+
 @app.route("/holder_collection/data")
 def view_all_holder_data():
     """查看所有采集数据概览"""
@@ -1719,6 +1666,7 @@ def view_holder_data(task_id):
     """查看采集数据"""
     try:
         from modules.holder import get_task_data
+        from services.stream_export import parquet_available
         
         limit = int(request.args.get('limit', 200))
         data = get_task_data(task_id, limit)
@@ -1734,26 +1682,81 @@ def view_holder_data(task_id):
         return render_template("holder_data.html", 
                              task_id=task_id, 
                              snapshots_by_time=snapshots_by_time,
-                             total_records=len(data))
+                             total_records=len(data),
+                             parquet_available=parquet_available())
     
     except Exception as e:
         flash(f"获取数据失败: {e}", "danger")
         return redirect(url_for('holder_collection'))
 
+@app.route("/holder_collection/diff/<task_id>")
+def diff_holder_snapshots(task_id):
+    """两个快照之间的持仓变化（JSON）：?t1=...&t2=...&top=20，时间为空时比较最新两次"""
+    try:
+        from modules.holder import diff_snapshots
+        
+        top_k = min(max(int(request.args.get('top', 20)), 1), 500)
+        result = diff_snapshots(task_id, request.args.get('t1') or None, request.args.get('t2') or None, top_k)
+        if result is None:
+            return jsonify({'success': False, 'error': '快照不足，无法比较'}), 404
+        return jsonify({'success': True, 'data': result})
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'参数错误: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route("/holder_collection/history/<task_id>")
+def holder_address_history(task_id):
+    """
+    地址持仓历史（JSON）：?address=A&address=B（或逗号分隔）&start=...&end=...
+    &points=500&method=lttb|minmax&field=balance，points=0 返回全部点
+    """
+    try:
+        from modules.holder import get_address_history
+        
+        addresses = [
+            address.strip()
+            for value in request.args.getlist('address')
+            for address in value.split(',') if address.strip()
+        ]
+        points = min(max(int(request.args.get('points', 500)), 0), 10000)
+        result = get_address_history(
+            task_id, addresses,
+            request.args.get('start') or None, request.args.get('end') or None,
+            points or None, request.args.get('method', 'lttb'), request.args.get('field', 'balance')
+        )
+        if result is None:
+            return jsonify({'success': False, 'error': '区间内没有快照'}), 404
+        return jsonify({'success': True, 'data': result})
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'参数错误: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route("/holder_collection/export/<task_id>")
 def export_holder_data(task_id):
-    """导出采集数据"""
+    """导出采集数据（流式响应：?format=csv|parquet）"""
     try:
-        from modules.holder import export_task_data_csv
+        from flask import Response, stream_with_context
+        from modules.holder import stream_task_data
         
-        csv_path = export_task_data_csv(task_id)
-        if csv_path and os.path.exists(csv_path):
-            return send_file(csv_path, as_attachment=True, 
-                           download_name=f"holder_data_{task_id}.csv")
-        else:
-            flash("导出失败，请稍后重试", "danger")
+        fmt = request.args.get('format', 'csv')
+        if fmt not in ('csv', 'parquet'):
+            flash(f"不支持的导出格式: {fmt}", "warning")
             return redirect(url_for('holder_collection'))
+        
+        stream, mimetype, filename = stream_task_data(task_id, fmt)
+        return Response(
+            stream_with_context(stream),
+            mimetype=mimetype,
+            headers={"Content-Disposition": attachment_disposition(filename)}
+        )
     
+    except ImportError:
+        flash("Parquet导出需要安装 pyarrow", "danger")
+        return redirect(url_for('holder_collection'))
     except Exception as e:
         flash(f"导出失败: {e}", "danger")
         return redirect(url_for('holder_collection'))
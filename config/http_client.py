@@ -0,0 +1,227 @@
+"""
+HTTP客户端配置和连接池管理
+为各上游API（OKX、Helius、CoinGecko）维护进程级共享的连接池，复用TCP/TLS连接
+"""
+
+import os
+import time
+import threading
+import logging
+from urllib.parse import urlparse
+
+import certifi
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from services.rate_limiter import get_rate_limiter
+from services.upstream_simulator import get_upstream_simulator
+from services.concurrency_controller import get_concurrency_controller, is_overloaded_response
+from services.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# 默认请求头（原 utils.create_robust_session 中的配置）
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-site'
+}
+
+# 已知上游主机（可通过环境变量单独配置连接池大小）
+KNOWN_HOSTS = [
+    'www.okx.com',
+    'web3.okx.com',
+    'api.helius.xyz',
+    'api.coingecko.com',
+]
+
+
+def _host_env_key(prefix, host):
+    """主机名转换为环境变量名，例如 web3.okx.com -> HTTP_POOL_MAXSIZE_WEB3_OKX_COM"""
+    return f"{prefix}_{host.upper().replace('.', '_').replace('-', '_')}"
+
+
+class HttpClientConfig:
+    """HTTP客户端配置类 - 每个上游主机一个独立连接池"""
+
+    def __init__(self):
+        # 每个主机连接池的默认大小（Render免费版实例并发不高，16足够）
+        self.pool_maxsize = int(os.getenv('HTTP_POOL_MAXSIZE', 16))
+        # 连接池满时是否阻塞等待空闲连接（否则临时新建连接，用完即丢弃）
+        self.pool_block = os.getenv('HTTP_POOL_BLOCK', 'False').lower() == 'true'
+        # 适配器层面的重试策略
+        self.max_retries = int(os.getenv('HTTP_ADAPTER_RETRIES', 3))
+        self.backoff_factor = float(os.getenv('HTTP_BACKOFF_FACTOR', 1))
+
+        # 单个主机的连接池大小，可用 HTTP_POOL_MAXSIZE_<HOST> 覆盖
+        self.host_pool_sizes = {}
+        for host in KNOWN_HOSTS:
+            size = os.getenv(_host_env_key('HTTP_POOL_MAXSIZE', host))
+            if size:
+                self.host_pool_sizes[host] = int(size)
+
+    def get_pool_size(self, host):
+        """获取指定主机的连接池大小"""
+        return self.host_pool_sizes.get(host, self.pool_maxsize)
+
+
+class HttpClientRegistry:
+    """进程级HTTP客户端注册表 - 按主机复用Session和连接池（线程安全）"""
+
+    def __init__(self, config=None):
+        self.config = config or HttpClientConfig()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _create_session(self, host):
+        """为指定主机创建带连接池的Session"""
+        session = requests.Session()
+
+        retry_strategy = Retry(
+            total=self.config.max_retries,
+            backoff_factor=self.config.backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["HEAD", "GET", "OPTIONS"]
+        )
+
+        pool_size = self.config.get_pool_size(host)
+        adapter = HTTPAdapter(
+            pool_connections=1,  # 每个Session只服务一个主机
+            pool_maxsize=pool_size,
+            pool_block=self.config.pool_block,
+            max_retries=retry_strategy
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        # 使用最新的 certifi 证书
+        session.verify = certifi.where()
+        session.headers.update(DEFAULT_HEADERS)
+
+        logger.info(f"🔌 创建HTTP连接池: {host} (maxsize={pool_size})")
+        return session
+
+    def get_session(self, url):
+        """获取URL所属主机的共享Session"""
+        host = urlparse(url).netloc.lower()
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._create_session(host)
+                self._sessions[host] = session
+            return session
+
+    def get(self, url, params=None, headers=None, timeout=15, **kwargs):
+        """通过共享连接池发送GET请求（先按上游配额限流，再受主机级AIMD并发上限约束），返回 requests.Response"""
+        session = self.get_session(url)
+        get_rate_limiter().acquire(url)
+
+        controller = get_concurrency_controller()
+        if not controller.enabled:
+            return self._send(session, url, params, headers, timeout, **kwargs)
+
+        limiter = controller.get_limiter(url)
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = self._send(session, url, params, headers, timeout, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                requests.exceptions.RetryError):
+            # 超时、连接失败、适配器重试耗尽（持续429/5xx）均为过载信号
+            limiter.release(time.monotonic() - start, overloaded=True)
+            raise
+        except Exception:
+            limiter.release(time.monotonic() - start, success=False)
+            raise
+        limiter.release(time.monotonic() - start, overloaded=is_overloaded_response(response))
+        return response
+
+    def _send(self, session, url, params, headers, timeout, **kwargs):
+        """实际发送请求并记录统计；录制/回放模式见 services/upstream_simulator.py"""
+        simulator = get_upstream_simulator()
+        start = time.monotonic()
+        try:
+            if simulator.active:
+                response = session.get(simulator.route(url), params=params, headers=headers, timeout=timeout, **kwargs)
+                simulator.record(url, params, response, (time.monotonic() - start) * 1000)
+            else:
+                response = session.get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+        except Exception as e:
+            get_metrics().observe_request(url, time.monotonic() - start, error=e)
+            raise
+        get_metrics().observe_request(url, time.monotonic() - start, response=response)
+        return response
+
+    def reset_host(self, url):
+        """丢弃某主机的Session（例如SSL错误后重建连接池）"""
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            session = self._sessions.pop(host, None)
+        if session is not None:
+            session.close()
+            logger.info(f"♻️ 已重置HTTP连接池: {host}")
+
+    def get_pool_info(self):
+        """获取各主机连接池信息"""
+        info = {}
+        with self._lock:
+            sessions = dict(self._sessions)
+
+        for host, session in sessions.items():
+            adapter = session.get_adapter(f"https://{host}")
+            pools = adapter.poolmanager.pools
+            connections, requests_sent = 0, 0
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+            info[host] = {
+                'pool_maxsize': self.config.get_pool_size(host),
+                'connections_created': connections,  # 新建TCP/TLS连接数
+                'requests_sent': requests_sent       # 复用率 = 1 - connections/requests
+            }
+        return info
+
+    def close(self):
+        """关闭所有Session"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+        logger.info("✅ HTTP连接池已全部关闭")
+
+
+# 全局HTTP客户端实例
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """获取全局HTTP客户端实例（单例模式）"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HttpClientRegistry()
+    return _http_client
+
+
+def close_http_client():
+    """关闭全局HTTP客户端的所有连接"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
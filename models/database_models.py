@@ -51,6 +51,8 @@ class TopTrader(Base):
         Index('idx_token_chain', 'token_address', 'chain_id'),
         Index('idx_wallet_token', 'wallet_address', 'token_address'),
         Index('idx_pnl_desc', 'total_pnl'),
+        # 批量 upsert 的冲突键
+        Index('uq_trader_wallet_token_chain', 'wallet_address', 'token_address', 'chain_id', unique=True),
     )
 
 class TokenHolder(Base):
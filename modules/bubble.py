@@ -5,100 +5,75 @@ from trans import get_okx_transaction_df
 from holder import get_all_holders
 from datetime import datetime, timezone
 import requests
-import time
 from tqdm import tqdm
 from collections import defaultdict
-import random
+from services.async_fetcher import map_concurrently
+from services.concurrency_controller import get_concurrency_controller
+
+def _fetch_relevant_transactions(address, addresses, chain_id, start_time, end_time):
+    """获取单个地址与持仓地址相关的交易记录"""
+    # 429/5xx 由共享HTTP客户端的适配器重试和AIMD并发控制处理，这里不再手动退避
+    try:
+        df_tx = get_okx_transaction_df(
+            address, 
+            chain=chain_id,
+            begin=start_time,
+            end=end_time
+        )
+    except requests.exceptions.HTTPError as e:
+        print(f"地址 {address[:8]}... HTTP错误: {e.response.status_code}, 跳过")
+        return []
+    except Exception as e:
+        print(f"地址 {address[:8]}... 请求失败: {str(e)}，跳过")
+        return []
+    
+    # 如果DataFrame为空，跳过
+    if df_tx.empty:
+        return []
+        
+    # 确保列存在 - 使用英文字段名
+    if 'sender_address' in df_tx.columns and 'receiver_address' in df_tx.columns:
+        # 筛选与持仓地址相关的交易
+        mask = (
+            (df_tx['sender_address'].isin(addresses)) | 
+            (df_tx['receiver_address'].isin(addresses))
+        )
+        relevant_tx = df_tx[mask]
+    else:
+        # 如果列不存在，保留所有交易
+        relevant_tx = df_tx
+    
+    # 过滤交易数量
+    if 'coin_amount' in relevant_tx.columns:
+        # 转换为数值类型
+        relevant_tx.loc[:, 'coin_amount'] = pd.to_numeric(relevant_tx['coin_amount'], errors='coerce')
+        # 过滤掉数量小于0.1的交易
+        relevant_tx = relevant_tx.dropna(subset=['coin_amount'])
+        relevant_tx = relevant_tx[relevant_tx['coin_amount'] >= 0.1]
+    
+    return relevant_tx.to_dict("records")
 
 # 修复字段命名问题并优化交易处理
 def get_batch_transactions(addresses, chain_id, start_time, end_time):
-    """批量获取地址交易记录（优化版）"""
+    """批量获取地址交易记录（并发版，在途请求数由AIMD控制器按上游响应自动调节）"""
     all_transactions = []
     
-    # 随机打乱地址顺序
-    random.shuffle(addresses)
-    
     # 添加进度条
     with tqdm(total=len(addresses), desc="获取交易记录") as pbar:
-        for idx, address in enumerate(addresses):
-            # 指数退避重试机制
-            max_retries = 5
-            for attempt in range(max_retries):
-                try:
-                    # 随机延迟
-                    delay = random.uniform(0.8, 1.5)
-                    time.sleep(delay)
-                    
-                    # 获取地址交易记录
-                    df_tx = get_okx_transaction_df(
-                        address, 
-                        chain=chain_id,
-                        begin=start_time,
-                        end=end_time
-                    )
-                    
-                    # 如果DataFrame为空，跳过
-                    if df_tx.empty:
-                        break
-                        
-                    # 确保列存在 - 使用英文字段名
-                    if 'sender_address' in df_tx.columns and 'receiver_address' in df_tx.columns:
-                        # 筛选与持仓地址相关的交易
-                        mask = (
-                            (df_tx['sender_address'].isin(addresses)) | 
-                            (df_tx['receiver_address'].isin(addresses))
-                        )
-                        relevant_tx = df_tx[mask]
-                    else:
-                        # 如果列不存在，保留所有交易
-                        relevant_tx = df_tx
-                    
-                    # 过滤交易数量
-                    if 'coin_amount' in relevant_tx.columns:
-                        # 转换为数值类型
-                        relevant_tx.loc[:, 'coin_amount'] = pd.to_numeric(relevant_tx['coin_amount'], errors='coerce')
-                        # 过滤掉数量小于0.1的交易
-                        relevant_tx = relevant_tx.dropna(subset=['coin_amount'])
-                        relevant_tx = relevant_tx[relevant_tx['coin_amount'] >= 0.1]
-                    
-                    # 添加到结果集
-                    if not relevant_tx.empty:
-                        all_transactions.extend(relevant_tx.to_dict("records"))
-                    
-                    # 成功处理，跳出重试循环
-                    break
-                    
-                except requests.exceptions.HTTPError as e:
-                    # 处理429限流错误
-                    if e.response.status_code == 429:
-                        if attempt < max_retries - 1:
-                            # 指数退避
-                            backoff = attempt
-                            pbar.write(f"地址 {address[:8]}... 请求过多，等待 {backoff} 秒后重试 ({attempt+1}/{max_retries})")
-                            time.sleep(backoff)
-                        else:
-                            pbar.write(f"地址 {address[:8]}... 请求失败（已尝试 {max_retries} 次），跳过")
-                            break
-                    else:
-                        # 其他HTTP错误
-                        pbar.write(f"地址 {address[:8]}... HTTP错误: {e.response.status_code}, 跳过")
-                        break
-                except Exception as e:
-                    # 其他异常
-                    if attempt < max_retries - 1:
-                        pbar.write(f"地址 {address[:8]}... 错误: {str(e)}，等待后重试 ({attempt+1}/{max_retries})")
-                        time.sleep(2)
-                    else:
-                        pbar.write(f"地址 {address[:8]}... 请求失败（已尝试 {max_retries} 次），跳过")
-                        break
-            
+        def fetch_one(address):
+            records = _fetch_relevant_transactions(address, addresses, chain_id, start_time, end_time)
             pbar.update(1)
-            
-            # 每处理10个地址增加一次长延迟
-            if idx > 0 and idx % 10 == 0:
-                long_delay = random.uniform(5, 10)
-                pbar.write(f"已完成 {idx+1} 个地址，暂停 {long_delay:.1f} 秒释放压力")
-                time.sleep(long_delay)
+            return records
+        
+        # 线程数按AIMD上限准备，实际并发由控制器决定
+        results = map_concurrently(
+            fetch_one, addresses,
+            max_concurrency=get_concurrency_controller().max_limit
+        )
+    
+    for records in results:
+        if records:
+            all_transactions.extend(records)
     
     # 将交易记录转换为DataFrame
     if not all_transactions:
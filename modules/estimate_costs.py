@@ -1,8 +1,7 @@
 # estimate_costs.py
-import requests
 import pandas as pd
 from datetime import datetime, timedelta
-import time
+from config.http_client import get_http_client
 
 def get_price_at_timestamp(token_id, timestamp):
     """获取指定时间点的价格"""
@@ -18,7 +17,7 @@ def get_price_at_timestamp(token_id, timestamp):
         url = f"https://api.coingecko.com/api/v3/coins/{token_id}/history"
         params = {"date": date_str}
         
-        resp = requests.get(url, params=params, timeout=30)
+        resp = get_http_client().get(url, params=params, timeout=30)
         resp.raise_for_status()
         data = resp.json()
         
@@ -33,7 +32,7 @@ def get_current_price(token_id):
         url = f"https://api.coingecko.com/api/v3/simple/price"
         params = {"ids": token_id, "vs_currencies": "usd"}
         
-        resp = requests.get(url, params=params, timeout=30)
+        resp = get_http_client().get(url, params=params, timeout=30)
         resp.raise_for_status()
         data = resp.json()
         
@@ -83,8 +82,6 @@ def estimate_transaction_costs(events_df, token_id):
                     cost = amount * price
                     total_cost += cost
                     total_amount += amount
-                
-                time.sleep(0.1)  # 避免请求过快
         
         avg_cost = total_cost / total_amount if total_amount > 0 else 0
         
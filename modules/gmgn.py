@@ -1,7 +1,8 @@
-import requests
 import time
 from datetime import datetime, timedelta
 from utils import fetch_data_robust
+from services.async_fetcher import fetch_many, map_concurrently
+from services.paginator import fetch_offset_pages
 
 def fetch_top_holders(chain_id, token_address, limit=100):
     """获取Top Holders - 支持多链"""
@@ -19,34 +20,25 @@ def fetch_top_holders(chain_id, token_address, limit=100):
         params["currentUserWalletAddress"] = "0x63291f7d06ea0a17306c5e48779baae289865e99"
         print("🔧 ETH链: 添加currentUserWalletAddress参数")
     
-    all_holders = []
+    def fetch_page(offset):
+        print(f"🔍 获取 Holders 第 {offset // params['limit'] + 1} 页...")
+        
+        # 同一代币的并发查询会合并为一次上游请求
+        data = fetch_data_robust(url, dict(params, offset=offset), max_retries=1, timeout=10)
+        
+        # 🔧 修复None类型检查
+        if not data or "data" not in data or not data["data"] or "holderRankingList" not in data["data"]:
+            print(f"❌ Holders API 响应异常: {data}")
+            return None
+            
+        holder_list = data["data"]["holderRankingList"]
+        if not holder_list:
+            print("✅ Holders 数据获取完毕")
+        return holder_list
     
     try:
-        while len(all_holders) < limit:
-            print(f"🔍 获取 Holders 第 {params['offset']//params['limit'] + 1} 页...")
-            
-            resp = requests.get(url, params=params, timeout=10)
-            data = resp.json()
-            
-            # 🔧 修复None类型检查
-            if not data or "data" not in data or not data["data"] or "holderRankingList" not in data["data"]:
-                print(f"❌ Holders API 响应异常: {data}")
-                break
-                
-            holder_list = data["data"]["holderRankingList"]
-            if not holder_list:
-                print("✅ Holders 数据获取完毕")
-                break
-            
-            all_holders.extend(holder_list)
-            
-            # 如果已够数量或本页不足，停止
-            if len(all_holders) >= limit or len(holder_list) < params['limit']:
-                break
-                
-            # 下一页
-            params['offset'] += params['limit']
-            time.sleep(0.5)
+        # 多页并发获取（请求节奏由全局限流器控制），本页不足即停止
+        all_holders = fetch_offset_pages(fetch_page, params['limit'], max_items=limit)
         
         # 处理数据
         holders = []
@@ -106,31 +98,23 @@ def fetch_top_traders(chain_id, token_address, limit=100):
         params["currentUserWalletAddress"] = "0x63291f7d06ea0a17306c5e48779baae289865e99"
         print("🔧 ETH链: 添加currentUserWalletAddress参数")
     
-    all_traders = []
+    def fetch_page(offset):
+        print(f"🔍 获取 Traders 第 {offset // params['limit'] + 1} 页...")
+        
+        # 同一代币的并发查询会合并为一次上游请求
+        data = fetch_data_robust(url, dict(params, offset=offset), max_retries=1, timeout=10)
+        
+        if not data or data.get('code') != 0:
+            print(f"❌ Traders API 响应异常: {data}")
+            return None
+            
+        trader_list = data.get('data', {}).get('list', [])
+        if not trader_list:
+            print("✅ Traders 数据获取完毕")
+        return trader_list
     
     try:
-        while len(all_traders) < limit:
-            print(f"🔍 获取 Traders 第 {params['offset']//params['limit'] + 1} 页...")
-            
-            resp = requests.get(url, params=params, timeout=10)
-            data = resp.json()
-            
-            if not data or data.get('code') != 0:
-                print(f"❌ Traders API 响应异常: {data}")
-                break
-                
-            trader_list = data.get('data', {}).get('list', [])
-            if not trader_list:
-                print("✅ Traders 数据获取完毕")
-                break
-            
-            all_traders.extend(trader_list)
-            
-            if len(all_traders) >= limit or len(trader_list) < params['limit']:
-                break
-                
-            params['offset'] += params['limit']
-            time.sleep(0.5)
+        all_traders = fetch_offset_pages(fetch_page, params['limit'], max_items=limit)
         
         # 处理数据
         traders = []
@@ -178,8 +162,8 @@ def fetch_top_traders(chain_id, token_address, limit=100):
         return []
 
 
-def fetch_wallet_profile(chain_id, wallet_address, period_type=5):
-    """获取钱包profile信息 - 支持多链"""
+def _wallet_profile_request(chain_id, wallet_address, period_type=5):
+    """构建钱包profile请求"""
     url = "https://web3.okx.com/priapi/v1/dx/market/v2/pnl/wallet-profile/summary"
     
     params = {
@@ -194,28 +178,50 @@ def fetch_wallet_profile(chain_id, wallet_address, period_type=5):
         params["currentUserWalletAddress"] = "0x63291f7d06ea0a17306c5e48779baae289865e99"
         print(f"🔧 ETH链: 钱包 {wallet_address[:8]}... 添加currentUserWalletAddress参数")
     
+    return {"url": url, "params": params, "max_retries": 3, "timeout": 20}
+
+
+def _parse_wallet_profile(wallet_address, response):
+    """解析钱包profile响应"""
+    if response and response.get('code') == 0:
+        print(f"✅ 钱包 {wallet_address[:8]}... profile获取成功")
+        return response.get('data', {})
+    else:
+        print(f"❌ 钱包 {wallet_address[:8]}... profile获取失败: {response}")
+        return None
+
+
+def fetch_wallet_profile(chain_id, wallet_address, period_type=5):
+    """获取钱包profile信息 - 支持多链"""
+    req = _wallet_profile_request(chain_id, wallet_address, period_type)
+    
     try:
-        response = fetch_data_robust(url, params, max_retries=3, timeout=20)
-        
-        if response and response.get('code') == 0:
-            print(f"✅ 钱包 {wallet_address[:8]}... profile获取成功")
-            return response.get('data', {})
-        else:
-            print(f"❌ 钱包 {wallet_address[:8]}... profile获取失败: {response}")
-            return None
+        response = fetch_data_robust(req["url"], req["params"], max_retries=req["max_retries"], timeout=req["timeout"])
+        return _parse_wallet_profile(wallet_address, response)
             
     except Exception as e:
         print(f"❌ 钱包 {wallet_address[:8]}... 请求异常: {e}")
         return None
 
 
-def check_conspiracy_wallet(wallet_address, chain_id="501", days_before=10):
+def fetch_wallet_profiles(chain_id, wallet_addresses, period_type=5):
+    """并发获取多个钱包的profile信息，返回 {address: profile或None}"""
+    requests_list = [_wallet_profile_request(chain_id, addr, period_type) for addr in wallet_addresses]
+    responses = fetch_many(requests_list)
+    return {
+        addr: _parse_wallet_profile(addr, response)
+        for addr, response in zip(wallet_addresses, responses)
+    }
+
+
+def check_conspiracy_wallet(wallet_address, chain_id="501", days_before=10, wallet_data=None):
     """检查是否为阴谋钱包 - 支持多链
     
     Args:
         wallet_address: 钱包地址
         chain_id: 链ID，支持501(Solana)和1(ETH)
         days_before: 检查多少天前的数据，默认10天
+        wallet_data: 已预取的钱包profile数据，为None时现场请求
     
     Returns:
         bool: True表示是阴谋钱包，False表示不是
@@ -224,7 +230,8 @@ def check_conspiracy_wallet(wallet_address, chain_id="501", days_before=10):
     print(f"🔍 检查{chain_name}链钱包 {wallet_address[:8]}... 是否为阴谋钱包")
     
     # 获取3个月的钱包数据
-    wallet_data = fetch_wallet_profile(chain_id, wallet_address, period_type=5)
+    if wallet_data is None:
+        wallet_data = fetch_wallet_profile(chain_id, wallet_address, period_type=5)
     
     if not wallet_data:
         print(f"❌ 无法获取钱包数据")
@@ -405,9 +412,11 @@ def generate_address_remarks(
     chain_name = "ETH" if str(chain_id) == "1" else "Solana"
     print(f"\n🚀 开始处理{chain_name}链CA: {ca_name} ({ca_address})")
     
-    # 获取数据
-    holders_data = fetch_top_holders(chain_id, ca_address, top_holders_count)
-    traders_data = fetch_top_traders(chain_id, ca_address, top_traders_count)
+    # 获取数据（holders和traders并发请求）
+    holders_data, traders_data = map_concurrently(lambda fetch: fetch(), [
+        lambda: fetch_top_holders(chain_id, ca_address, top_holders_count),
+        lambda: fetch_top_traders(chain_id, ca_address, top_traders_count),
+    ])
     
     # 合并数据
     address_map = {}
@@ -438,6 +447,11 @@ def generate_address_remarks(
     normal_remarks = []
     conspiracy_remarks = []
     
+    # 阴谋钱包检查需要每个地址的profile，先并发预取
+    profiles = {}
+    if conspiracy_check and address_map:
+        profiles = fetch_wallet_profiles(chain_id, list(address_map.keys()), period_type=5)
+    
     for address, data in address_map.items():
         holder_data = data.get("holder")
         trader_data = data.get("trader")
@@ -446,7 +460,10 @@ def generate_address_remarks(
         is_conspiracy = False
         if conspiracy_check:
             try:
-                is_conspiracy = check_conspiracy_wallet(address, chain_id=chain_id, days_before=conspiracy_days)
+                is_conspiracy = check_conspiracy_wallet(
+                    address, chain_id=chain_id, days_before=conspiracy_days,
+                    wallet_data=profiles.get(address)
+                )
             except Exception as e:
                 print(f"❌ 检查钱包 {address[:8]}... 阴谋状态失败: {e}")
                 is_conspiracy = False
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import requests
 import time
 import sys
@@ -6,12 +7,20 @@ import os
 import urllib3
 import datetime
 import json
-import sqlite3
 import threading
-import schedule
+import itertools
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 import logging
+from config.http_client import get_http_client
+from utils import fetch_guarded
+from services.paginator import fetch_offset_pages
+from services.sqlite_manager import get_sqlite_manager
+from services.snapshot_store import SnapshotStore, matrix_stats, format_epoch, to_epoch, parse_retention_policy
+from services.task_scheduler import TaskScheduler, staggered_due
+from services.job_queue import JobQueue
+from services.stream_export import iter_csv, iter_parquet, iter_zip
 
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -25,7 +34,7 @@ class HolderCollectionTask:
     
     def __init__(self, task_id: str, token_address: str, token_symbol: str, 
                  chain: str, interval_hours: int, max_records: int = 1000,
-                 description: str = ""):
+                 description: str = "", retention_policy: str = None):
         self.task_id = task_id
         self.token_address = token_address
         self.token_symbol = token_symbol
@@ -33,6 +42,8 @@ class HolderCollectionTask:
         self.interval_hours = interval_hours
         self.max_records = max_records
         self.description = description
+        # 快照保留策略（如 '7d=1h,90d=1d,*=1w'），为空时使用 HOLDER_RETENTION_POLICY（默认全部保留）
+        self.retention_policy = retention_policy
         self.created_at = datetime.datetime.now()
         self.last_run = None
         self.next_run = None
@@ -50,6 +61,7 @@ class HolderCollectionTask:
             'interval_hours': self.interval_hours,
             'max_records': self.max_records,
             'description': self.description,
+            'retention_policy': self.retention_policy,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_run': self.last_run.isoformat() if self.last_run else None,
             'next_run': self.next_run.isoformat() if self.next_run else None,
@@ -68,7 +80,8 @@ class HolderCollectionTask:
             chain=data['chain'],
             interval_hours=data['interval_hours'],
             max_records=data.get('max_records', 1000),
-            description=data.get('description', "")
+            description=data.get('description', ""),
+            retention_policy=data.get('retention_policy')
         )
         
         if data.get('created_at'):
@@ -90,17 +103,35 @@ class HolderDataCollector:
     
     def __init__(self, db_path: str = "holders_snapshots.db"):
         self.db_path = db_path
+        # WAL模式：专用写连接 + 只读连接池，采集写入与页面查询互不阻塞
+        self.db = get_sqlite_manager(db_path)
+        # 增量快照存储：关键帧 + 变化行
+        self.store = SnapshotStore(self.db)
         self.tasks: Dict[str, HolderCollectionTask] = {}
-        self.scheduler_thread = None
-        self.is_running = False
+        # 采集模式：inprocess 在本进程调度执行；queue 只写入持久化队列，由独立采集进程领取执行
+        self.queue_mode = os.getenv('HOLDER_COLLECTOR_MODE', 'inprocess') == 'queue'
+        self.is_worker = False  # 独立采集进程（services/holder_collector.py）中为 True
+        self.jobs = JobQueue(self.db)
+        # 堆调度器：睡眠到最近到期时间，到期任务进入有界线程池（按链限流，同代币合并抓取）
+        self.scheduler = TaskScheduler(self._on_due, name='holder-collector')
+        # 快照降采样后台线程（随调度器启停）；降采样会永久删除快照，默认策略为空（全部保留），需显式开启
+        self.retention_policy = os.getenv('HOLDER_RETENTION_POLICY', '')
+        self.compaction_interval = float(os.getenv('HOLDER_COMPACTION_INTERVAL_HOURS', 6)) * 3600
+        self._compaction_stop = threading.Event()
+        self._compaction_thread = None
         self.init_database()
         self.load_tasks()
         
     def init_database(self):
         """初始化数据库"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        with self.db.writer() as conn:
+            self._create_tables(conn.cursor())
+        self.store.migrate_legacy()
+        self.store.ensure_stats()
+        logger.info(f"✅ 数据库初始化完成: {self.db_path}")
+    
+    def _create_tables(self, cursor):
+        """创建表和索引"""
         # 创建任务表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS collection_tasks (
@@ -116,67 +147,43 @@ class HolderDataCollector:
                 next_run TIMESTAMP,
                 status TEXT DEFAULT 'active',
                 total_collections INTEGER DEFAULT 0,
-                last_error TEXT
+                last_error TEXT,
+                retention_policy TEXT
             )
         ''')
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(collection_tasks)")]
+        if 'retention_policy' not in columns:
+            cursor.execute("ALTER TABLE collection_tasks ADD COLUMN retention_policy TEXT")
         
-        # 创建快照数据表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS holder_snapshots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                task_id TEXT NOT NULL,
-                snapshot_time TIMESTAMP NOT NULL,
-                holder_address TEXT NOT NULL,
-                token_address TEXT NOT NULL,
-                balance TEXT NOT NULL,
-                percentage REAL,
-                rank_position INTEGER,
-                value_usd REAL,
-                FOREIGN KEY (task_id) REFERENCES collection_tasks (task_id)
-            )
-        ''')
-        
-        # 创建索引
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_snapshots_task_time 
-            ON holder_snapshots (task_id, snapshot_time)
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_snapshots_address 
-            ON holder_snapshots (holder_address)
-        ''')
+        # 快照表（地址字典 + 增量快照，旧版全量表在启动时迁移）
+        self.store.create_tables(cursor)
         
-        conn.commit()
-        conn.close()
-        logger.info(f"✅ 数据库初始化完成: {self.db_path}")
+        # 采集队列表（queue 模式下 Web 进程与采集进程共享）
+        self.jobs.create_tables(cursor)
     
     def add_task(self, task: HolderCollectionTask) -> bool:
         """添加采集任务"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 检查任务是否已存在
-            cursor.execute("SELECT task_id FROM collection_tasks WHERE task_id = ?", (task.task_id,))
-            if cursor.fetchone():
-                logger.warning(f"⚠️ 任务 {task.task_id} 已存在")
-                return False
-            
-            # 插入任务
-            cursor.execute('''
-                INSERT INTO collection_tasks 
-                (task_id, token_address, token_symbol, chain, interval_hours, max_records, 
-                 description, created_at, status, total_collections)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                task.task_id, task.token_address, task.token_symbol, task.chain,
-                task.interval_hours, task.max_records, task.description,
-                task.created_at, task.status, task.total_collections
-            ))
-            
-            conn.commit()
-            conn.close()
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                # 检查任务是否已存在
+                cursor.execute("SELECT task_id FROM collection_tasks WHERE task_id = ?", (task.task_id,))
+                if cursor.fetchone():
+                    logger.warning(f"⚠️ 任务 {task.task_id} 已存在")
+                    return False
+                
+                # 插入任务
+                cursor.execute('''
+                    INSERT INTO collection_tasks 
+                    (task_id, token_address, token_symbol, chain, interval_hours, max_records, 
+                     description, created_at, status, total_collections, retention_policy)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    task.task_id, task.token_address, task.token_symbol, task.chain,
+                    task.interval_hours, task.max_records, task.description,
+                    task.created_at, task.status, task.total_collections, task.retention_policy
+                ))
             
             # 添加到内存
             self.tasks[task.task_id] = task
@@ -194,20 +201,16 @@ class HolderDataCollector:
     def remove_task(self, task_id: str) -> bool:
         """删除采集任务"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # 删除任务（但保留历史数据）
-            cursor.execute("DELETE FROM collection_tasks WHERE task_id = ?", (task_id,))
-            conn.commit()
-            conn.close()
+            with self.db.writer() as conn:
+                conn.execute("DELETE FROM collection_tasks WHERE task_id = ?", (task_id,))
             
             # 从内存中移除
             if task_id in self.tasks:
                 del self.tasks[task_id]
             
             # 取消定时任务
-            schedule.clear(task_id)
+            self.scheduler.cancel(task_id)
             
             logger.info(f"✅ 成功删除任务: {task_id}")
             return True
@@ -227,18 +230,18 @@ class HolderDataCollector:
     def update_task_status(self, task_id: str, status: str) -> bool:
         """更新任务状态"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "UPDATE collection_tasks SET status = ? WHERE task_id = ?",
-                (status, task_id)
-            )
-            conn.commit()
-            conn.close()
+            with self.db.writer() as conn:
+                conn.execute(
+                    "UPDATE collection_tasks SET status = ? WHERE task_id = ?",
+                    (status, task_id)
+                )
             
             if task_id in self.tasks:
                 self.tasks[task_id].status = status
+                if status == 'active':
+                    self.schedule_task(self.tasks[task_id])
+                else:
+                    self.scheduler.cancel(task_id)
             
             logger.info(f"✅ 任务 {task_id} 状态更新为: {status}")
             return True
@@ -247,103 +250,184 @@ class HolderDataCollector:
             logger.error(f"❌ 更新任务状态失败: {e}")
             return False
     
-    def load_tasks(self):
-        """从数据库加载任务"""
-        try:
-            conn = sqlite3.connect(self.db_path)
+    def _read_tasks(self, task_ids: List[str] = None) -> List[HolderCollectionTask]:
+        """从数据库读取任务（task_ids 为空时读取全部）"""
+        with self.db.reader() as conn:
             cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM collection_tasks")
+            if task_ids:
+                placeholders = ','.join('?' * len(task_ids))
+                cursor.execute(f"SELECT * FROM collection_tasks WHERE task_id IN ({placeholders})", list(task_ids))
+            else:
+                cursor.execute("SELECT * FROM collection_tasks")
             rows = cursor.fetchall()
             columns = [description[0] for description in cursor.description]
-            
-            for row in rows:
-                task_data = dict(zip(columns, row))
-                task = HolderCollectionTask.from_dict(task_data)
+        return [HolderCollectionTask.from_dict(dict(zip(columns, row))) for row in rows]
+    
+    def load_tasks(self):
+        """从数据库加载任务"""
+        try:
+            for task in self._read_tasks():
                 self.tasks[task.task_id] = task
                 
                 # 为活跃任务安排定时执行
                 if task.status == 'active':
                     self.schedule_task(task)
             
-            conn.close()
             logger.info(f"✅ 加载了 {len(self.tasks)} 个采集任务")
             
         except Exception as e:
             logger.error(f"❌ 加载任务失败: {e}")
     
+    def refresh_tasks(self, task_ids: List[str] = None):
+        """
+        重新读取任务（queue 模式下任务由其他进程增删改、执行结果由采集进程写入）
+        
+        调度器运行时同步调度：新增/恢复的任务安排执行，删除/暂停的任务取消
+        """
+        try:
+            tasks = {task.task_id: task for task in self._read_tasks(task_ids)}
+        except Exception as e:
+            logger.error(f"❌ 刷新任务失败: {e}")
+            return
+        
+        removed = set(task_ids or self.tasks) - set(tasks)
+        for task_id in removed:
+            self.tasks.pop(task_id, None)
+            self.scheduler.cancel(task_id)
+        
+        for task_id, task in tasks.items():
+            self.tasks[task_id] = task
+            if not self.scheduler.is_running:
+                continue
+            if task.status != 'active':
+                self.scheduler.cancel(task_id)
+            elif task.next_run is None or self.scheduler.next_due(task_id) is None:
+                self.schedule_task(task)
+    
     def schedule_task(self, task: HolderCollectionTask):
-        """安排定时任务"""
+        """安排定时任务（沿用已保存的下次运行时间，过期的会在抓取预算内尽快执行）"""
         if task.status != 'active':
             return
         
-        # 清除现有的同名任务
-        schedule.clear(task.task_id)
-            
-        # 根据间隔时间安排任务
-        if task.interval_hours == 1:
-            job = schedule.every().hour.do(self.run_collection, task.task_id).tag(task.task_id)
-        elif task.interval_hours == 4:
-            job = schedule.every(4).hours.do(self.run_collection, task.task_id).tag(task.task_id)
-        elif task.interval_hours == 12:
-            job = schedule.every(12).hours.do(self.run_collection, task.task_id).tag(task.task_id)
-        elif task.interval_hours == 24:
-            job = schedule.every(24).hours.do(self.run_collection, task.task_id).tag(task.task_id)
-        else:
-            # 自定义间隔
-            job = schedule.every(task.interval_hours).hours.do(self.run_collection, task.task_id).tag(task.task_id)
+        if task.next_run is None:
+            task.next_run = self._next_run_after(task, datetime.datetime.now())
         
-        # 从schedule获取实际的下次运行时间
-        task.next_run = job.next_run
+        self.scheduler.schedule(task.task_id, task.next_run.timestamp(),
+                                group_key=self._group_key(task), chain=task.chain)
         logger.info(f"📅 任务 {task.task_id} 已安排，下次运行: {task.next_run}")
     
+    @staticmethod
+    def _next_run_after(task: HolderCollectionTask, after: datetime.datetime) -> datetime.datetime:
+        """下次运行时间：按 task_id 错开在间隔内，避免同时创建的任务在同一时刻触发"""
+        due = staggered_due(task.task_id, task.interval_hours * 3600, after.timestamp())
+        return datetime.datetime.fromtimestamp(due)
+    
+    @staticmethod
+    def _group_key(task: HolderCollectionTask):
+        """追踪同一代币/链的任务合并为一次抓取"""
+        return (str(task.chain), task.token_address)
+    
+    def run_now(self, task_id: str) -> str:
+        """
+        立即执行一次（提交到调度器线程池或写入采集队列，不阻塞调用方）
+        
+        Returns:
+            'started' 已提交执行 / 'queued' 已加入采集队列 /
+            'running' 仍在执行或已在队列中（本次未执行） / 'missing' 任务不存在
+        """
+        task = self.tasks.get(task_id)
+        if task is None:
+            logger.warning(f"⚠️ 任务 {task_id} 不存在")
+            return 'missing'
+        if self.queue_mode:
+            if self.jobs.has_pending(task_id):
+                logger.info(f"⏭️ 任务 {task_id} 已在采集队列中")
+                return 'running'
+            self.jobs.enqueue(task_id, kind='manual')
+            logger.info(f"📥 任务 {task_id} 已加入采集队列")
+            return 'queued'
+        if not self.scheduler.run_now(task_id, group_key=self._group_key(task), chain=task.chain):
+            return 'running'
+        return 'started'
+    
+    def _on_due(self, task_ids: List[str]):
+        """调度器到期回调：inprocess 模式直接执行，queue 模式写入采集队列"""
+        if self.queue_mode:
+            self.enqueue_due(task_ids)
+        else:
+            self.run_collection_group(task_ids)
+    
+    def enqueue_due(self, task_ids: List[str]):
+        """
+        将到期任务写入采集队列并安排下一次
+        
+        以 '任务ID@计划执行时刻' 去重：执行时刻按 task_id 确定性错开，多个采集进程同时调度也只入队一次
+        """
+        for task_id in task_ids:
+            task = self.tasks.get(task_id)
+            if task is None or task.status != 'active':
+                continue
+            now = datetime.datetime.now()
+            slot = task.next_run or now
+            job_id = self.jobs.enqueue(task_id, payload={'scheduled_at': slot.timestamp()},
+                                       dedup_key=f"{task_id}@{int(slot.timestamp())}")
+            if job_id is not None:
+                logger.info(f"📥 任务 {task_id} 已加入采集队列（计划时刻 {slot}）")
+            task.next_run = self._next_run_after(task, max(now, slot))
+            self.update_task_next_run(task)
+            self.schedule_task(task)
+    
     def run_collection(self, task_id: str):
         """执行数据采集"""
-        if task_id not in self.tasks:
-            logger.warning(f"⚠️ 任务 {task_id} 不存在")
-            return
+        self.run_collection_group([task_id])
+    
+    def run_collection_group(self, task_ids: List[str]) -> Optional[int]:
+        """
+        执行一组追踪同一代币/链的采集任务：只抓取一次，按各任务的记录数分别保存
+        
+        Returns:
+            成功保存快照的任务数；没有可执行的任务（已暂停/删除）时返回 None
+        """
+        tasks = []
+        for task_id in task_ids:
+            task = self.tasks.get(task_id)
+            if task is None:
+                logger.warning(f"⚠️ 任务 {task_id} 不存在")
+            elif task.status != 'active':
+                logger.info(f"⏸️ 任务 {task_id} 状态为 {task.status}，跳过执行")
+            else:
+                tasks.append(task)
+        if not tasks:
+            return None
         
-        task = self.tasks[task_id]
-        if task.status != 'active':
-            logger.info(f"⏸️ 任务 {task_id} 状态为 {task.status}，跳过执行")
-            return
+        logger.info(f"🚀 开始执行采集任务: {', '.join(task.task_id for task in tasks)}")
         
-        logger.info(f"🚀 开始执行采集任务: {task_id}")
+        # 按记录数最多的任务抓取，其余任务截取前N条
+        holders_data = self.fetch_holders_data(max(tasks, key=lambda task: task.max_records))
         
-        try:
-            # 获取holder数据
-            holders_data = self.fetch_holders_data(task)
-            
-            if holders_data:
-                # 保存到数据库
-                self.save_snapshot(task_id, holders_data)
-                
-                # 更新任务状态
-                task.last_run = datetime.datetime.now()
-                task.total_collections += 1
-                task.last_error = None
-                # 从schedule获取更新后的下次运行时间
-                self.update_task_next_run_from_schedule(task_id)
-                
-                self.update_task_in_db(task)
-                
-                logger.info(f"✅ 任务 {task_id} 执行完成，采集 {len(holders_data)} 条记录")
-            else:
-                # 即使未获取到数据也要更新时间，确保任务继续调度
+        saved = 0
+        for task in tasks:
+            try:
+                if holders_data:
+                    # 保存到数据库
+                    self.save_snapshot(task.task_id, holders_data[:task.max_records])
+                    saved += 1
+                    task.total_collections += 1
+                    task.last_error = None
+                    logger.info(f"✅ 任务 {task.task_id} 执行完成，采集 {min(len(holders_data), task.max_records)} 条记录")
+                else:
+                    task.last_error = "未获取到数据"
+                    logger.warning(f"⚠️ 任务 {task.task_id} 未获取到数据")
+            except Exception as e:
+                task.last_error = str(e)
+                logger.error(f"❌ 任务 {task.task_id} 执行失败: {e}")
+            finally:
+                # 无论成功失败都更新时间并重新安排，确保任务继续调度
                 task.last_run = datetime.datetime.now()
-                task.next_run = task.last_run + datetime.timedelta(hours=task.interval_hours)
-                task.last_error = "未获取到数据"
+                task.next_run = self._next_run_after(task, task.last_run)
                 self.update_task_in_db(task)
-                logger.warning(f"⚠️ 任务 {task_id} 未获取到数据")
-                
-        except Exception as e:
-            error_msg = str(e)
-            task.last_error = error_msg
-            # 即使失败也要更新last_run和next_run，确保任务能继续调度
-            task.last_run = datetime.datetime.now()
-            task.next_run = task.last_run + datetime.timedelta(hours=task.interval_hours)
-            self.update_task_in_db(task)
-            logger.error(f"❌ 任务 {task_id} 执行失败: {error_msg}")
+                self.schedule_task(task)
+        return saved
     
     def fetch_holders_data(self, task: HolderCollectionTask) -> List[Dict]:
         """获取holder数据 - 使用现有的get_all_holders函数"""
@@ -360,18 +444,7 @@ class HolderDataCollector:
                 logger.warning(f"⚠️ 未获取到 {task.task_id} 的holder数据")
                 return []
             
-            # 转换为字典列表
-            holders_list = []
-            for _, row in df.iterrows():
-                holder_data = {
-                    'address': row.get('address', ''),
-                    'balance': row.get('balance', ''),
-                    'percentage': row.get('percentage', 0),
-                    'value_usd': row.get('value_usd', 0),
-                    'rank': row.get('rank', 0)
-                }
-                holders_list.append(holder_data)
-            
+            holders_list = self._to_holder_list(df)
             logger.info(f"✅ 获取到 {len(holders_list)} 条holder数据")
             return holders_list
             
@@ -379,116 +452,287 @@ class HolderDataCollector:
             logger.error(f"❌ 获取holder数据失败: {e}")
             return []
     
+    @staticmethod
+    def _to_holder_list(df: pd.DataFrame) -> List[Dict]:
+        """转换为字典列表"""
+        holders_list = []
+        for _, row in df.iterrows():
+            holder_data = {
+                'address': row.get('address', ''),
+                'balance': row.get('balance', ''),
+                'percentage': row.get('percentage', 0),
+                'value_usd': row.get('value_usd', 0),
+                'rank': row.get('rank', 0)
+            }
+            holders_list.append(holder_data)
+        return holders_list
+    
+    def fetch_historical_holders(self, task: HolderCollectionTask, timestamp: float):
+        """
+        获取历史时间点（epoch秒）的holder数据
+        
+        Returns:
+            (holders_list, API返回的数据时间点epoch秒)；API未返回时间点时为 None
+        """
+        try:
+            df = get_all_holders(
+                chain_id=task.chain,
+                token_address=task.token_address,
+                timestamp=int(timestamp * 1000),
+                top_n=task.max_records
+            )
+            if df.empty:
+                return [], None
+            response_time = df.attrs.get('response_time')
+            return self._to_holder_list(df), int(response_time) / 1000 if response_time else None
+        
+        except Exception as e:
+            logger.error(f"❌ 获取历史holder数据失败 {task.task_id} @ {timestamp}: {e}")
+            return [], None
+    
+    def backfill_task(self, task_id: str, start_time=None, end_time=None, step_hours: float = None,
+                      days: float = None, workers: int = None) -> Dict:
+        """
+        回填任务的历史快照
+        
+        按 step_hours（默认任务采集间隔）在 [start_time, end_time] 内取时间点（默认最近 days 天），
+        跳过已有快照的时间点，在抓取预算内并发请求；API 返回的数据时间点缺失或与请求时间相差超过
+        半个步长的结果视为无效（上游忽略了时间参数），其余按返回的时间点写入并标记为回填。
+        每抓取 HOLDER_BACKFILL_BATCH_POINTS 个时间点写入一次，中断后重新执行只会请求尚缺的时间点
+        """
+        task = self.tasks.get(task_id)
+        if task is None:
+            logger.warning(f"⚠️ 任务 {task_id} 不存在")
+            return {'error': f'任务 {task_id} 不存在'}
+        
+        step = float(step_hours or task.interval_hours) * 3600
+        end = to_epoch(end_time) if end_time else time.time()
+        start = to_epoch(start_time) if start_time else end - float(days or os.getenv('HOLDER_BACKFILL_DAYS', 7)) * 86400
+        tolerance = float(os.getenv('HOLDER_BACKFILL_TOLERANCE_SECONDS', step / 2))
+        max_points = int(os.getenv('HOLDER_BACKFILL_MAX_POINTS', 500))
+        batch_points = int(os.getenv('HOLDER_BACKFILL_BATCH_POINTS', 48))
+        workers = workers or int(os.getenv('HOLDER_BACKFILL_WORKERS', 4))
+        
+        # 已有快照附近（半个步长内）的时间点不再请求
+        timeline = np.array(self.store.get_timeline(task_id), dtype=float)
+        points = np.arange(end, start - 1, -step)[::-1][-max_points:]
+        if len(timeline):
+            idx = np.searchsorted(timeline, points)
+            left = timeline[np.clip(idx - 1, 0, len(timeline) - 1)]
+            right = timeline[np.clip(idx, 0, len(timeline) - 1)]
+            points = points[np.minimum(np.abs(points - left), np.abs(right - points)) > step / 2]
+        
+        result = {'task_id': task_id, 'requested': len(points), 'saved': 0,
+                  'rejected': 0, 'failed': 0}
+        if not len(points):
+            return result
+        logger.info(f"⏪ 开始回填 {task_id}: {len(points)} 个时间点，步长 {step / 3600:g} 小时，并发 {workers}")
+        
+        def fetch(ts):
+            # 与定时采集共用每分钟抓取预算
+            if self.scheduler.budget is not None:
+                time.sleep(self.scheduler.budget.reserve())
+            return (ts,) + self.fetch_historical_holders(task, ts)
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='holder-backfill') as pool:
+            for offset in range(0, len(points), batch_points):
+                accepted = []
+                for ts, holders, response_ts in pool.map(fetch, points[offset:offset + batch_points]):
+                    if not holders:
+                        result['failed'] += 1
+                    elif response_ts is None or abs(response_ts - ts) > tolerance:
+                        result['rejected'] += 1
+                        logger.warning(f"⚠️ 回填 {task_id} @ {format_epoch(ts)}: 返回时间点无效（{response_ts}），已丢弃")
+                    else:
+                        accepted.append((int(response_ts), holders[:task.max_records]))
+                result['saved'] += self.store.save_backfill(task_id, task.token_address, accepted)
+                logger.info(f"⏪ 回填 {task_id}: 已处理 {min(offset + batch_points, len(points))}/{len(points)} 个时间点")
+        
+        logger.info(f"✅ 回填完成 {task_id}: {result}")
+        return result
+    
+    def start_backfill(self, task_id: str, **params) -> bool:
+        """在后台回填（queue 模式写入采集队列由采集进程执行，否则在后台线程执行）"""
+        if task_id not in self.tasks:
+            logger.warning(f"⚠️ 任务 {task_id} 不存在")
+            return False
+        if self.queue_mode:
+            self.jobs.enqueue(task_id, kind='backfill', payload=params)
+            logger.info(f"📥 任务 {task_id} 的回填已加入采集队列")
+        else:
+            threading.Thread(target=self.backfill_task, args=(task_id,), kwargs=params,
+                             name=f'holder-backfill-{task_id}', daemon=True).start()
+        return True
+    
     def save_snapshot(self, task_id: str, holders_data: List[Dict]):
-        """保存快照数据到数据库"""
+        """保存快照数据到数据库（增量编码）"""
         if not holders_data:
             return
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        snapshot_time = datetime.datetime.now()
         task = self.tasks[task_id]
-        
-        # 批量插入数据
-        insert_data = []
-        for rank, holder in enumerate(holders_data, 1):
-            insert_data.append((
-                task_id,
-                snapshot_time,
-                holder.get('address', ''),
-                task.token_address,
-                holder.get('balance', ''),
-                holder.get('percentage', 0),
-                rank,
-                holder.get('value_usd', 0)
-            ))
-        
-        cursor.executemany('''
-            INSERT INTO holder_snapshots 
-            (task_id, snapshot_time, holder_address, token_address, balance, 
-             percentage, rank_position, value_usd)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', insert_data)
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"💾 保存快照数据: {len(insert_data)} 条记录")
+        self.store.save_snapshot(task_id, task.token_address, holders_data, datetime.datetime.now())
     
     def update_task_in_db(self, task: HolderCollectionTask):
         """更新数据库中的任务信息"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE collection_tasks 
-                SET last_run = ?, next_run = ?, total_collections = ?, last_error = ?
-                WHERE task_id = ?
-            ''', (
-                task.last_run, task.next_run, task.total_collections, 
-                task.last_error, task.task_id
-            ))
-            
-            conn.commit()
-            conn.close()
+            with self.db.writer() as conn:
+                conn.execute('''
+                    UPDATE collection_tasks 
+                    SET last_run = ?, next_run = ?, total_collections = ?, last_error = ?
+                    WHERE task_id = ?
+                ''', (
+                    task.last_run, task.next_run, task.total_collections, 
+                    task.last_error, task.task_id
+                ))
             
         except Exception as e:
             logger.error(f"❌ 更新任务信息失败: {e}")
     
+    def update_task_next_run(self, task: HolderCollectionTask):
+        """只更新下次运行时间（不覆盖采集进程写入的执行结果）"""
+        try:
+            with self.db.writer() as conn:
+                conn.execute("UPDATE collection_tasks SET next_run = ? WHERE task_id = ?",
+                             (task.next_run, task.task_id))
+        except Exception as e:
+            logger.error(f"❌ 更新下次运行时间失败: {e}")
+    
     def get_tasks(self) -> List[Dict]:
         """获取所有任务列表"""
+        if self.queue_mode and not self.is_worker:
+            # 执行结果由采集进程写入数据库
+            self.refresh_tasks()
         return [task.to_dict() for task in self.tasks.values()]
     
     def get_task_snapshots(self, task_id: str, limit: int = 100) -> List[Dict]:
-        """获取任务的快照数据"""
+        """获取任务的快照数据（最新快照在前，快照内按排名）"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT snapshot_time, holder_address, balance, percentage, rank_position, value_usd
-                FROM holder_snapshots 
-                WHERE task_id = ?
-                ORDER BY snapshot_time DESC, rank_position ASC
-                LIMIT ?
-            ''', (task_id, limit))
-            
-            rows = cursor.fetchall()
-            columns = ['snapshot_time', 'holder_address', 'balance', 'percentage', 'rank_position', 'value_usd']
-            
-            result = []
-            for row in rows:
-                result.append(dict(zip(columns, row)))
-            
-            conn.close()
-            return result
+            return self.store.get_recent_rows(task_id, limit)
             
         except Exception as e:
             logger.error(f"❌ 获取快照数据失败: {e}")
             return []
     
-    def export_task_data(self, task_id: str, output_path: str = None) -> str:
-        """导出任务数据为CSV"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            
-            # 获取所有快照数据
-            df = pd.read_sql_query('''
-                SELECT task_id, snapshot_time, holder_address, token_address, 
-                       balance, percentage, rank_position, value_usd
-                FROM holder_snapshots 
-                WHERE task_id = ?
-                ORDER BY snapshot_time DESC, rank_position ASC
-            ''', conn, params=(task_id,))
+    EXPORT_COLUMNS = ['task_id', 'snapshot_time', 'holder_address', 'token_address',
+                      'balance', 'percentage', 'rank_position', 'value_usd']
+    
+    def iter_export_chunks(self, task_id: str, start_time=None, end_time=None):
+        """按时间顺序逐个快照产出导出记录（每个快照一块）"""
+        for meta, rows in self.store.iter_snapshots(task_id, start_time, end_time):
+            yield [
+                {
+                    'task_id': task_id,
+                    'snapshot_time': meta['snapshot_time'],
+                    'holder_address': row['holder_address'],
+                    'token_address': meta['token_address'],
+                    'balance': row['balance'],
+                    'percentage': row['percentage'],
+                    'rank_position': row['rank_position'],
+                    'value_usd': row['value_usd']
+                }
+                for row in rows
+            ]
+    
+    def stream_task_data(self, task_id: str, fmt: str = 'csv', start_time=None, end_time=None):
+        """
+        流式导出任务数据（按快照时间升序），返回 (生成器, mimetype, 文件名)
+        
+        fmt: csv 产出文本块；parquet 产出字节块（需要 pyarrow，列类型固定、zstd 压缩）
+        """
+        filename = f"holder_data_{task_id}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        chunks = self.iter_export_chunks(task_id, start_time, end_time)
+        
+        if fmt == 'parquet':
+            import pyarrow as pa
+            schema = pa.schema([
+                ('task_id', pa.dictionary(pa.int32(), pa.string())),
+                ('snapshot_time', pa.timestamp('s')),
+                ('holder_address', pa.string()),
+                ('token_address', pa.dictionary(pa.int32(), pa.string())),
+                ('balance', pa.float64()),
+                ('percentage', pa.float64()),
+                ('rank_position', pa.int32()),
+                ('value_usd', pa.float64())
+            ])
             
-            conn.close()
+            def typed(chunks):
+                for records in chunks:
+                    if records:
+                        snapshot_time = datetime.datetime.strptime(records[0]['snapshot_time'], '%Y-%m-%d %H:%M:%S')
+                        for record in records:
+                            record['snapshot_time'] = snapshot_time
+                    yield records
             
+            return (iter_parquet(typed(chunks), schema), 'application/vnd.apache.parquet',
+                    f"{filename}.parquet")
+        
+        return iter_csv(chunks, self.EXPORT_COLUMNS), 'text/csv; charset=utf-8', f"{filename}.csv"
+    
+    def stream_timeseries(self, task_id: str, fmt: str = 'csv', start_time=None, end_time=None):
+        """
+        流式导出 地址 × 快照 宽表（每个快照一组 balance_<时间>/pct_<时间> 列），返回 (生成器, mimetype)
+        
+        按地址分块从快照存储读取，不在内存中同时持有所有快照
+        """
+        blocks = self.store.iter_wide(task_id, start_time, end_time)
+        first = next(blocks, None)
+        labels = [meta['snapshot_time'] for meta in first['metas']] if first else []
+        columns = ['address'] + [f"{prefix}_{label}" for label in labels for prefix in ('balance', 'pct')]
+        
+        def frames():
+            if first is None:
+                return
+            for block in itertools.chain([first], blocks):
+                values = np.empty((len(block['addresses']), len(columns) - 1))
+                values[:, 0::2] = block['balance']
+                values[:, 1::2] = block['percentage']
+                frame = pd.DataFrame(values, columns=columns[1:])
+                frame.insert(0, 'address', block['addresses'])
+                yield frame
+        
+        if fmt == 'parquet':
+            import pyarrow as pa
+            schema = pa.schema([('address', pa.string())] + [(column, pa.float64()) for column in columns[1:]])
+            return iter_parquet(frames(), schema), 'application/vnd.apache.parquet'
+        return iter_csv(frames(), columns), 'text/csv; charset=utf-8'
+    
+    def export_holder_snapshots(self, task_id: str, export_type: str = 'merged', fmt: str = 'csv',
+                                start_time=None, end_time=None):
+        """
+        导出任务的持仓快照，返回 (生成器, mimetype, 文件名)
+        
+        export_type: merged 长表（每个快照每个地址一行）/ timeseries 宽表（地址 × 快照）/ all 两者打包为ZIP
+        fmt: csv / parquet
+        """
+        if export_type not in ('merged', 'timeseries', 'all'):
+            raise ValueError(f"不支持的导出类型: {export_type}")
+        if fmt not in ('csv', 'parquet'):
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        files = []
+        if export_type in ('merged', 'all'):
+            stream, mimetype, _ = self.stream_task_data(task_id, fmt, start_time, end_time)
+            files.append((stream, mimetype, f"holder_snapshots_{task_id}_{stamp}.{fmt}"))
+        if export_type in ('timeseries', 'all'):
+            stream, mimetype = self.stream_timeseries(task_id, fmt, start_time, end_time)
+            files.append((stream, mimetype, f"holder_timeseries_{task_id}_{stamp}.{fmt}"))
+        
+        if len(files) == 1:
+            return files[0]
+        return (iter_zip([(filename, stream) for stream, _, filename in files]), 'application/zip',
+                f"holder_snapshots_{task_id}_{stamp}.zip")
+    
+    def export_task_data(self, task_id: str, output_path: str = None) -> str:
+        """导出任务数据为CSV（逐快照写入文件）"""
+        try:
             if output_path is None:
                 output_path = f"holder_data_{task_id}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
             
-            df.to_csv(output_path, index=False, encoding='utf-8-sig')
+            stream, _, _ = self.stream_task_data(task_id, 'csv')
+            with open(output_path, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(stream)
+            
             logger.info(f"📁 数据已导出: {output_path}")
             return output_path
             
@@ -496,37 +740,123 @@ class HolderDataCollector:
             logger.error(f"❌ 导出数据失败: {e}")
             return None
     
+    def get_storage_stats(self, task_id: str = None) -> Dict:
+        """快照存储统计（关键帧数、实际存储行数、压缩比）"""
+        return self.store.get_storage_stats(task_id)
+    
+    def diff_snapshots(self, task_id: str, from_time=None, to_time=None, top_k: int = 20) -> Optional[Dict]:
+        """比较两个快照的新进/退出地址、排名与余额变化（默认最新一次与前一次）"""
+        return self.store.diff_snapshots(task_id, from_time, to_time, top_k)
+    
+    def get_address_history(self, task_id: str, addresses: List[str], start_time=None, end_time=None,
+                            points: Optional[int] = None, method: str = 'lttb', field: str = 'balance') -> Optional[Dict]:
+        """指定地址的持仓时间序列（服务端降采样到每个地址最多约 points 个点）"""
+        return self.store.address_history(task_id, addresses, start_time, end_time, points, method, field)
+    
+    def set_retention_policy(self, task_id: str, policy: Optional[str]) -> bool:
+        """设置任务的快照保留策略（None 表示使用默认策略）"""
+        try:
+            if policy:
+                parse_retention_policy(policy)
+            with self.db.writer() as conn:
+                conn.execute("UPDATE collection_tasks SET retention_policy = ? WHERE task_id = ?",
+                             (policy or None, task_id))
+            if task_id in self.tasks:
+                self.tasks[task_id].retention_policy = policy or None
+            logger.info(f"✅ 任务 {task_id} 保留策略: {policy or self.retention_policy or '全部保留'}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ 设置保留策略失败: {e}")
+            return False
+    
+    def compact_snapshots(self, task_id: str = None) -> Dict[str, int]:
+        """
+        按各任务的保留策略降采样快照，重建受影响任务的持仓统计并回收空闲页
+        
+        任务和 HOLDER_RETENTION_POLICY 都未设置策略时该任务全部保留，不做任何处理
+        
+        Returns:
+            {task_id: 删除的快照数}
+        """
+        if task_id is not None:
+            tasks = [self.tasks[task_id]] if task_id in self.tasks else []
+        else:
+            tasks = list(self.tasks.values())
+        
+        result = {}
+        for task in tasks:
+            policy_text = task.retention_policy or self.retention_policy
+            if not policy_text:
+                continue
+            try:
+                policy = parse_retention_policy(policy_text)
+                deleted = self.store.compact(task.task_id, policy)
+                if deleted:
+                    self.store.rebuild_stats(task.task_id)
+                result[task.task_id] = deleted
+            except Exception as e:
+                logger.error(f"❌ 任务 {task.task_id} 快照降采样失败: {e}")
+        
+        if any(result.values()):
+            self.db.incremental_vacuum()
+        return result
+    
+    def _compaction_loop(self):
+        # 启动后稍等再执行，避免与启动时补跑的采集争抢写锁
+        wait = min(60, self.compaction_interval)
+        while not self._compaction_stop.wait(wait):
+            self.compact_snapshots()
+            wait = self.compaction_interval
+    
+    @property
+    def is_running(self) -> bool:
+        return self.scheduler.is_running
+    
     def start_scheduler(self):
         """启动定时调度器"""
-        if self.is_running:
-            logger.warning("⚠️ 调度器已在运行")
+        if self.queue_mode and not self.is_worker:
+            logger.info("📥 队列模式：定时调度与采集由独立采集进程负责（python -m services.holder_collector）")
             return
         
-        self.is_running = True
+        if not self.scheduler.start():
+            logger.warning("⚠️ 调度器已在运行")
+            return
         
-        def run_scheduler():
-            logger.info("🔄 定时调度器启动")
-            while self.is_running:
-                schedule.run_pending()
-                time.sleep(60)  # 每分钟检查一次
-            logger.info("⏹️ 定时调度器停止")
+        # 重新安排活跃任务（停止期间排队未执行的任务也会恢复）
+        for task in list(self.tasks.values()):
+            self.schedule_task(task)
         
-        self.scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-        self.scheduler_thread.start()
+        if self.compaction_interval > 0:
+            self._compaction_stop.clear()
+            self._compaction_thread = threading.Thread(target=self._compaction_loop,
+                                                       name='holder-compaction', daemon=True)
+            self._compaction_thread.start()
         
         logger.info("✅ 定时调度器已启动")
     
     def stop_scheduler(self):
         """停止定时调度器"""
-        self.is_running = False
-        if self.scheduler_thread and self.scheduler_thread.is_alive():
-            self.scheduler_thread.join(timeout=5)
+        self.scheduler.stop()
+        self._compaction_stop.set()
         logger.info("⏹️ 定时调度器已停止")
+    
+    def get_scheduler_status(self) -> Dict:
+        """调度器状态（供监控使用）"""
+        status = self.scheduler.get_status()
+        status['mode'] = 'queue' if self.queue_mode else 'inprocess'
+        if self.queue_mode:
+            status['queue'] = self.jobs.get_stats()
+        return status
 
 
 # 以下保留原有的数据获取函数
 def fetch_okx_data(url, params=None, timeout=15):
-    """专门用于OKX API的请求函数"""
+    """专门用于OKX API的请求函数（经过负缓存/熔断/单飞保护层，见 utils.fetch_guarded）"""
+    return fetch_guarded(url, params, lambda: _fetch_okx_data(url, params, timeout))
+
+
+def _fetch_okx_data(url, params=None, timeout=15):
+    """实际发出OKX API请求"""
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         'Accept': 'application/json, text/plain, */*',
@@ -556,13 +886,12 @@ def fetch_okx_data(url, params=None, timeout=15):
         full_url = f"{url}?{urlencode(params or {})}"
         print(f"🔗 完整URL: {full_url}")
         
-        # 确保直接请求 OKX API
-        response = requests.get(
+        # 确保直接请求 OKX API（复用共享连接池）
+        response = get_http_client().get(
             url, 
             params=params, 
             headers=headers, 
-            timeout=timeout,
-            verify=True  # 使用SSL验证
+            timeout=timeout
         )
         
         print(f"📊 响应状态码: {response.status_code}")
@@ -628,40 +957,43 @@ def get_all_holders(chain_id, token_address, timestamp=None, top_n=100):
     print(f"💰 代币地址: {token_address}")
     print(f"📊 目标数量: {top_n}")
     
-    all_holders = []
-    page_count = 0
-    max_pages = 20
+    page_size = params['limit']
+    # API 返回的数据时间点（毫秒，未返回时为 None），供历史回填校验是否真的是历史数据
+    response_meta = {'response_time': None}
     
-    try:
-        while len(all_holders) < top_n and page_count < max_pages:
-            print(f"\n📄 正在请求第 {page_count + 1} 页，已获取 {len(all_holders)} 条数据")
-            
-            # 使用专门的请求函数
-            response = fetch_okx_data(url, params)
-            
-            if not response:
-                print("❌ API响应为空，停止请求")
-                break
-            
-            # 检查响应状态
-            response_code = response.get('code')
-            if response_code != 0:
-                error_msg = response.get('error_message') or response.get('msg') or 'Unknown error'
-                print(f"❌ API返回错误: code={response_code}, message={error_msg}")
-                break
-                
-            # 获取持仓列表
-            data_obj = response.get('data', {})
-            holder_list = data_obj.get('holderRankingList', [])
-            
-            if not holder_list:
-                print("⚠️ holderRankingList 为空")
-                # 打印完整响应以便调试
-                print(f"完整响应: {json.dumps(response, indent=2)[:1000]}")
-                break
+    def fetch_page(offset):
+        """获取单页持仓，失败返回 None"""
+        page_params = dict(params, offset=offset)
+        print(f"\n📄 正在请求第 {offset // page_size + 1} 页 (offset={offset})")
+        
+        # 使用专门的请求函数
+        response = fetch_okx_data(url, page_params)
+        
+        if not response:
+            print("❌ API响应为空，停止请求")
+            return None
+        
+        # 检查响应状态
+        response_code = response.get('code')
+        if response_code != 0:
+            error_msg = response.get('error_message') or response.get('msg') or 'Unknown error'
+            print(f"❌ API返回错误: code={response_code}, message={error_msg}")
+            return None
             
-            # 检查响应中是否包含时间戳或日期信息，用于验证API是否真的返回了历史数据
-            response_time = data_obj.get('timestamp') or data_obj.get('snapshotTime') or params.get('timestamp')
+        # 获取持仓列表
+        data_obj = response.get('data', {})
+        holder_list = data_obj.get('holderRankingList', [])
+        
+        if not holder_list:
+            print("⚠️ holderRankingList 为空")
+            # 打印完整响应以便调试
+            print(f"完整响应: {json.dumps(response, indent=2)[:1000]}")
+            return []
+        
+        # 首页检查响应中是否包含时间戳或日期信息，用于验证API是否真的返回了历史数据
+        if offset == 0:
+            response_meta['response_time'] = data_obj.get('timestamp') or data_obj.get('snapshotTime')
+            response_time = response_meta['response_time'] or params.get('timestamp')
             if response_time:
                 resp_time_str = datetime.datetime.fromtimestamp(int(response_time)/1000).strftime('%Y-%m-%d %H:%M:%S')
                 print(f"📅 API返回数据时间点: {resp_time_str}")
@@ -674,22 +1006,13 @@ def get_all_holders(chain_id, token_address, timestamp=None, top_n=100):
                     print(f"📊 返回时间: {resp_time_str}")
             else:
                 print("⚠️ 警告: API响应中没有时间戳信息，无法验证是否返回了历史数据")
-            
-            print(f"✅ 本页获取到 {len(holder_list)} 条数据")
-            all_holders.extend(holder_list)
-            
-            # 检查是否已到最后一页
-            if len(holder_list) < params['limit']:
-                print("🏁 已到最后一页")
-                break
-                
-            # 更新offset到下一页
-            params['offset'] += params['limit']
-            page_count += 1
-            
-            # 避免请求过快
-            print("⏳ 等待0.8秒...")
-            time.sleep(0.8)
+        
+        print(f"✅ offset={offset} 获取到 {len(holder_list)} 条数据")
+        return holder_list
+    
+    try:
+        # offset 事先可知，多页并发请求（节奏由全局限流器控制），短页即停止
+        all_holders = fetch_offset_pages(fetch_page, page_size, max_items=top_n, max_pages=20)
     
     except Exception as e:
         print(f"❌ 获取数据时发生错误: {str(e)}")
@@ -749,6 +1072,8 @@ def get_all_holders(chain_id, token_address, timestamp=None, top_n=100):
         df_processed = df_processed.head(top_n)
         df_processed = df_processed.sort_values('percentage', ascending=False).reset_index(drop=True)
         
+        df_processed.attrs['response_time'] = response_meta['response_time']
+        
         print(f"✅ 数据处理完成!")
         print(f"📊 前5名持仓地址:")
         print(df_processed[['address', 'balance', 'percentage']].head())
@@ -775,7 +1100,7 @@ def get_collector() -> HolderDataCollector:
 
 def create_collection_task(task_id: str, token_address: str, token_symbol: str, 
                           chain: str, interval_hours: int, max_records: int = 1000,
-                          description: str = "") -> bool:
+                          description: str = "", retention_policy: str = None) -> bool:
     """创建新的采集任务"""
     collector = get_collector()
     
@@ -786,7 +1111,8 @@ def create_collection_task(task_id: str, token_address: str, token_symbol: str,
         chain=chain,
         interval_hours=interval_hours,
         max_records=max_records,
-        description=description
+        description=description,
+        retention_policy=retention_policy
     )
     
     return collector.add_task(task)
@@ -819,6 +1145,17 @@ def export_task_data_csv(task_id: str, output_path: str = None) -> str:
     collector = get_collector()
     return collector.export_task_data(task_id, output_path)
 
+def stream_task_data(task_id: str, fmt: str = 'csv'):
+    """流式导出任务数据，返回 (生成器, mimetype, 文件名)"""
+    collector = get_collector()
+    return collector.stream_task_data(task_id, fmt)
+
+def export_holder_snapshots(task_id: str, export_type: str = 'merged', fmt: str = 'csv',
+                            start_time=None, end_time=None):
+    """流式导出任务的持仓快照（长表/宽表/打包），返回 (生成器, mimetype, 文件名)"""
+    collector = get_collector()
+    return collector.export_holder_snapshots(task_id, export_type, fmt, start_time, end_time)
+
 def get_all_tasks_summary() -> List[Dict]:
     """获取所有任务的数据概览"""
     try:
@@ -868,20 +1205,45 @@ def resume_collection_task(task_id: str) -> bool:
     collector = get_collector()
     return collector.resume_task(task_id)
 
+def diff_snapshots(task_id: str, t1=None, t2=None, top_k: int = 20) -> Optional[Dict]:
+    """比较任务在 t1、t2 两个时间点（不晚于该时间的最近快照）之间的持仓变化"""
+    collector = get_collector()
+    return collector.diff_snapshots(task_id, t1, t2, top_k)
+
+def get_address_history(task_id: str, addresses: List[str], start_time=None, end_time=None,
+                        points: Optional[int] = None, method: str = 'lttb', field: str = 'balance') -> Optional[Dict]:
+    """查询任务中若干地址的持仓历史"""
+    collector = get_collector()
+    return collector.get_address_history(task_id, addresses, start_time, end_time, points, method, field)
+
+def backfill_collection_task(task_id: str, days: float = None, step_hours: float = None) -> bool:
+    """后台回填任务最近 days 天的历史快照"""
+    collector = get_collector()
+    params = {key: value for key, value in (('days', days), ('step_hours', step_hours)) if value}
+    return collector.start_backfill(task_id, **params)
+
+def compact_collection_snapshots(task_id: str = None) -> Dict[str, int]:
+    """按保留策略降采样快照"""
+    collector = get_collector()
+    return collector.compact_snapshots(task_id)
+
 def remove_collection_task(task_id: str) -> bool:
     """删除采集任务"""
     collector = get_collector()
     return collector.remove_task(task_id)
 
-def run_task_now(task_id: str):
-    """立即执行一次采集任务"""
+def run_task_now(task_id: str) -> str:
+    """立即执行一次采集任务（提交到采集线程池，不阻塞），返回执行状态（见 HolderDataCollector.run_now）"""
     collector = get_collector()
-    collector.run_collection(task_id)
+    return collector.run_now(task_id)
 
 def analyze_holder_patterns(task_id: str, top_n: int = 100, min_snapshots: int = 3) -> Dict:
     """
     分析定时采集的持仓数据，识别早期入局且长期持仓的地址（疑似庄家）
     
+    读取随快照写入增量维护的 holder_stats（单次索引查询，耗时不随快照数增长）；
+    top_n 不在 HOLDER_STATS_TOP_N 档位中时，从全部历史快照的 地址 × 时间 矩阵计算
+    
     Args:
         task_id: 采集任务ID
         top_n: 分析前N名持仓者
@@ -891,159 +1253,102 @@ def analyze_holder_patterns(task_id: str, top_n: int = 100, min_snapshots: int =
         Dict: 分析结果
     """
     try:
-        # 获取任务的所有快照数据
-        snapshots = get_task_data(task_id, limit=1000)
+        store = get_collector().store
+        timeline = store.get_timeline(task_id)
         
-        if not snapshots:
+        if not timeline:
             raise Exception(f"任务 {task_id} 暂无采集数据")
         
-        # 按时间分组快照
-        snapshots_by_time = {}
-        for record in snapshots:
-            snapshot_time = record['snapshot_time']
-            if snapshot_time not in snapshots_by_time:
-                snapshots_by_time[snapshot_time] = []
-            snapshots_by_time[snapshot_time].append(record)
-        
-        if len(snapshots_by_time) < 2:
-            raise Exception(f"快照数量不足，需要至少2个时间点的数据，当前只有 {len(snapshots_by_time)} 个")
-        
-        # 分析每个快照的top_n持仓者
-        time_points = sorted(snapshots_by_time.keys())
-        holder_analysis = {}
-        
-        # 统计每个地址在不同快照中的表现
-        address_snapshots = {}  # {address: {time: {rank, percentage, balance}}}
-        
-        for snapshot_time in time_points:
-            snapshot_holders = snapshots_by_time[snapshot_time]
-            
-            # 按持仓比例排序，取top_n
-            snapshot_holders.sort(key=lambda x: float(x.get('percentage', 0)), reverse=True)
-            top_holders = snapshot_holders[:top_n]
-            
-            for rank, holder in enumerate(top_holders, 1):
-                address = holder['holder_address']
-                
-                if address not in address_snapshots:
-                    address_snapshots[address] = {}
-                
-                address_snapshots[address][snapshot_time] = {
-                    'rank': rank,
-                    'percentage': float(holder.get('percentage', 0)),
-                    'balance': holder.get('balance', '0'),
-                    'value_usd': float(holder.get('value_usd', 0))
-                }
+        total_snapshots = len(timeline)
+        if total_snapshots < 2:
+            raise Exception(f"快照数量不足，需要至少2个时间点的数据，当前只有 {total_snapshots} 个")
+        
+        raw = store.get_holder_stats(task_id, top_n)
+        if raw is None:
+            raw = matrix_stats(store.load_matrix(task_id), top_n)
+        
+        rank_volatility = raw['rank_max'] - raw['rank_min']
+        latest_percentage = raw['last_percentage'].fillna(0)
+        stats = pd.DataFrame({
+            'address': raw['address'],
+            'snapshot_count': raw['snapshot_count'],
+            'first_seen': raw['first_seen'],
+            'last_seen': raw['last_seen'],
+            'earliest_rank': raw['first_rank'],
+            'latest_rank': raw['last_rank'],
+            'avg_rank': (raw['rank_sum'] / raw['snapshot_count']).round(1),
+            'rank_volatility': rank_volatility,
+            'avg_percentage': (raw['percentage_sum'] / raw['snapshot_count']).round(4),
+            'percentage_change': (latest_percentage - raw['first_percentage'].fillna(0)).round(4),
+            'latest_percentage': latest_percentage,
+            'latest_balance': raw['last_balance'],
+            'latest_value_usd': raw['last_value_usd'].fillna(0),
+            'stability_score': ((raw['snapshot_count'] / total_snapshots) * (1 - rank_volatility / 100)).round(3)
+        })
         
         # 分析不同类型的地址
-        persistent_whales = []      # 早期入局且长期持仓（疑似庄家）
-        frequent_traders = []       # 频繁进出的地址（搬砖党）
-        new_entrants = []          # 新入场的大户
-        disappeared_holders = []    # 已经退出的地址
-        
-        for address, time_data in address_snapshots.items():
-            snapshot_count = len(time_data)
-            time_list = sorted(time_data.keys())
-            
-            # 计算持仓稳定性
-            if snapshot_count >= min_snapshots:
-                # 检查是否早期就在榜上
-                earliest_time = time_list[0]
-                latest_time = time_list[-1]
-                
-                earliest_rank = time_data[earliest_time]['rank']
-                latest_rank = time_data[latest_time]['rank']
-                
-                # 计算平均排名和排名波动
-                ranks = [data['rank'] for data in time_data.values()]
-                avg_rank = sum(ranks) / len(ranks)
-                rank_volatility = max(ranks) - min(ranks)
-                
-                # 计算持仓比例变化
-                percentages = [data['percentage'] for data in time_data.values()]
-                avg_percentage = sum(percentages) / len(percentages)
-                percentage_change = percentages[-1] - percentages[0] if len(percentages) > 1 else 0
-                
-                # 判断地址类型
-                analysis_data = {
-                    'address': address,
-                    'snapshot_count': snapshot_count,
-                    'first_seen': earliest_time,
-                    'last_seen': latest_time,
-                    'earliest_rank': earliest_rank,
-                    'latest_rank': latest_rank,
-                    'avg_rank': round(avg_rank, 1),
-                    'rank_volatility': rank_volatility,
-                    'avg_percentage': round(avg_percentage, 4),
-                    'percentage_change': round(percentage_change, 4),
-                    'latest_percentage': percentages[-1],
-                    'latest_balance': time_data[latest_time]['balance'],
-                    'latest_value_usd': time_data[latest_time]['value_usd'],
-                    'stability_score': round((snapshot_count / len(time_points)) * (1 - rank_volatility / 100), 3)
-                }
-                
-                # 早期入局且长期持仓（疑似庄家特征）
-                if (earliest_rank <= 20 and  # 早期就在前20
-                    rank_volatility <= 30 and  # 排名变化不大
-                    percentage_change >= -0.5):  # 持仓比例没有大幅减少
-                    analysis_data['whale_type'] = '疑似庄家'
-                    analysis_data['confidence'] = 'high' if rank_volatility <= 15 else 'medium'
-                    persistent_whales.append(analysis_data)
-                
-                # 频繁进出（搬砖党特征）
-                elif rank_volatility > 50:  # 排名波动很大
-                    analysis_data['whale_type'] = '搬砖地址'
-                    analysis_data['confidence'] = 'high' if rank_volatility > 80 else 'medium'
-                    frequent_traders.append(analysis_data)
-                
-                # 新入场大户
-                elif earliest_time in time_list[-3:] and latest_rank <= 50:  # 最近才出现但排名靠前
-                    analysis_data['whale_type'] = '新入场大户'
-                    analysis_data['confidence'] = 'high' if latest_rank <= 20 else 'medium'
-                    new_entrants.append(analysis_data)
-            
-            # 已消失的地址（在早期快照中出现但最近消失）
-            elif snapshot_count >= 2 and time_list[-1] not in time_list[-2:]:
-                latest_data = time_data[time_list[-1]]
-                disappeared_holders.append({
-                    'address': address,
-                    'last_seen': time_list[-1],
-                    'last_rank': latest_data['rank'],
-                    'last_percentage': latest_data['percentage'],
-                    'snapshot_count': snapshot_count
-                })
-        
-        # 按相关指标排序
-        persistent_whales.sort(key=lambda x: (x['stability_score'], -x['avg_rank']), reverse=True)
-        frequent_traders.sort(key=lambda x: x['rank_volatility'], reverse=True)
-        new_entrants.sort(key=lambda x: x['latest_rank'])
-        disappeared_holders.sort(key=lambda x: x['last_rank'])
+        persistent = stats['snapshot_count'] >= min_snapshots
+        # 早期入局且长期持仓（疑似庄家特征）：早期就在前20、排名变化不大、持仓比例没有大幅减少
+        whale = persistent & (stats['earliest_rank'] <= 20) & (stats['rank_volatility'] <= 30) & (stats['percentage_change'] >= -0.5)
+        # 频繁进出（搬砖党特征）：排名波动很大
+        trader = persistent & ~whale & (stats['rank_volatility'] > 50)
+        # 新入场大户：最近3个快照才出现但排名靠前
+        entrant = persistent & ~whale & ~trader & (stats['first_seen'] >= timeline[max(total_snapshots - 3, 0)]) & (stats['latest_rank'] <= 50)
+        # 已消失的地址：出现过但最近2个快照都不在前top_n
+        disappeared = ~persistent & (stats['snapshot_count'] >= 2) & (stats['last_seen'] < timeline[-2])
+        
+        columns = ['address', 'snapshot_count', 'first_seen', 'last_seen', 'earliest_rank', 'latest_rank',
+                   'avg_rank', 'rank_volatility', 'avg_percentage', 'percentage_change', 'latest_percentage',
+                   'latest_balance', 'latest_value_usd', 'stability_score']
+        
+        def classify(mask, whale_type, high, sort_by, ascending, limit):
+            frame = stats.loc[mask, columns].assign(whale_type=whale_type, confidence=np.where(high[mask], 'high', 'medium'))
+            frame = frame.sort_values(sort_by, ascending=ascending, kind='stable').head(limit)
+            frame['first_seen'] = frame['first_seen'].map(format_epoch)
+            frame['last_seen'] = frame['last_seen'].map(format_epoch)
+            return frame.to_dict('records'), int(mask.sum())
+        
+        persistent_whales, whales_count = classify(
+            whale, '疑似庄家', stats['rank_volatility'] <= 15,
+            ['stability_score', 'avg_rank'], [False, True], 20)
+        frequent_traders, traders_count = classify(
+            trader, '搬砖地址', stats['rank_volatility'] > 80, 'rank_volatility', False, 15)
+        new_entrants, entrants_count = classify(
+            entrant, '新入场大户', stats['latest_rank'] <= 20, 'latest_rank', True, 10)
+        
+        disappeared_holders = (
+            stats.loc[disappeared, ['address', 'last_seen', 'latest_rank', 'latest_percentage', 'snapshot_count']]
+            .rename(columns={'latest_rank': 'last_rank', 'latest_percentage': 'last_percentage'})
+            .sort_values('last_rank', kind='stable').head(10)
+            .assign(last_seen=lambda frame: frame['last_seen'].map(format_epoch))
+            .to_dict('records')
+        )
         
         # 生成分析报告
         analysis_result = {
             'task_id': task_id,
-            'total_snapshots': len(time_points),
+            'total_snapshots': total_snapshots,
             'time_range': {
-                'start': time_points[0],
-                'end': time_points[-1]
+                'start': format_epoch(timeline[0]),
+                'end': format_epoch(timeline[-1])
             },
-            'total_addresses_analyzed': len(address_snapshots),
-            'persistent_whales': persistent_whales[:20],  # 前20个疑似庄家
-            'frequent_traders': frequent_traders[:15],    # 前15个搬砖地址  
-            'new_entrants': new_entrants[:10],           # 前10个新入场大户
-            'disappeared_holders': disappeared_holders[:10],  # 前10个消失地址
+            'total_addresses_analyzed': len(stats),
+            'persistent_whales': persistent_whales,      # 前20个疑似庄家
+            'frequent_traders': frequent_traders,        # 前15个搬砖地址
+            'new_entrants': new_entrants,                # 前10个新入场大户
+            'disappeared_holders': disappeared_holders,  # 前10个消失地址
             'summary': {
-                'suspected_whales_count': len(persistent_whales),
-                'active_traders_count': len(frequent_traders),
-                'new_big_holders_count': len(new_entrants),
-                'disappeared_count': len(disappeared_holders)
+                'suspected_whales_count': whales_count,
+                'active_traders_count': traders_count,
+                'new_big_holders_count': entrants_count,
+                'disappeared_count': int(disappeared.sum())
             }
         }
         
         logger.info(f"✅ 持仓模式分析完成: {task_id}")
-        logger.info(f"   疑似庄家: {len(persistent_whales)}个")
-        logger.info(f"   搬砖地址: {len(frequent_traders)}个") 
-        logger.info(f"   新入场大户: {len(new_entrants)}个")
+        logger.info(f"   疑似庄家: {whales_count}个")
+        logger.info(f"   搬砖地址: {traders_count}个") 
+        logger.info(f"   新入场大户: {entrants_count}个")
         
         return analysis_result
         
@@ -1086,7 +1391,7 @@ def example_usage():
     print("\n4. 立即执行一次采集...")
     if tasks:
         task_id = tasks[0]['task_id']
-        run_task_now(task_id)
+        get_collector().run_collection(task_id)  # 同步执行，便于接着查看数据
         
         # 查看采集数据
         print("\n5. 查看采集数据...")
@@ -8,14 +8,15 @@ import time
 import math
 from collections import defaultdict, Counter
 from utils import fetch_data_robust
+from services.async_fetcher import fetch_many
 
 class ImprovedSmartAccountDetector:
     def __init__(self):
         self.similarity_threshold = 0.3  # 相似度阈值
         self.min_common_tokens = 3       # 最少共同代币数
         
-    def get_token_holders(self, chain_id, token_address, limit=100):
-        """获取代币的持有者列表"""
+    def _token_holders_request(self, chain_id, token_address, limit=100):
+        """构建代币持有者请求"""
         url = "https://www.okx.com/priapi/v1/dx/market/v2/holders/ranking-list"
         params = {
             "chainId": chain_id,
@@ -29,16 +30,24 @@ class ImprovedSmartAccountDetector:
         if str(chain_id) == "1":
             params["currentUserWalletAddress"] = "0x63291f7d06ea0a17306c5e48779baae289865e99"
         
-        response = fetch_data_robust(url, params, max_retries=2, timeout=10)
-        
+        return {"url": url, "params": params, "max_retries": 2, "timeout": 10}
+    
+    def _parse_token_holders(self, response):
+        """解析代币持有者响应"""
         if response and "data" in response and response["data"]:
             holder_list = response["data"].get("holderRankingList", [])
             return [holder.get("holderWalletAddress") for holder in holder_list if holder.get("holderWalletAddress")]
         
         return []
     
-    def get_wallet_tokens(self, wallet_address, chain_id):
-        """获取钱包的代币持仓列表"""
+    def get_token_holders(self, chain_id, token_address, limit=100):
+        """获取代币的持有者列表"""
+        req = self._token_holders_request(chain_id, token_address, limit)
+        response = fetch_data_robust(req["url"], req["params"], max_retries=req["max_retries"], timeout=req["timeout"])
+        return self._parse_token_holders(response)
+    
+    def _wallet_tokens_request(self, wallet_address, chain_id):
+        """构建钱包代币持仓请求"""
         url = "https://web3.okx.com/priapi/v1/dx/market/v2/pnl/token-list"
         params = {
             "walletAddress": wallet_address,
@@ -55,14 +64,22 @@ class ImprovedSmartAccountDetector:
         if str(chain_id) == "1":
             params["currentUserWalletAddress"] = "0x63291f7d06ea0a17306c5e48779baae289865e99"
         
-        response = fetch_data_robust(url, params, max_retries=2, timeout=15)
-        
+        return {"url": url, "params": params, "max_retries": 2, "timeout": 15}
+    
+    def _parse_wallet_tokens(self, response):
+        """解析钱包代币持仓响应"""
         if response and "data" in response and response["data"]:
             token_list = response["data"].get("tokenList", [])
             return [token.get("tokenContractAddress") for token in token_list if token.get("tokenContractAddress")]
         
         return []
     
+    def get_wallet_tokens(self, wallet_address, chain_id):
+        """获取钱包的代币持仓列表"""
+        req = self._wallet_tokens_request(wallet_address, chain_id)
+        response = fetch_data_robust(req["url"], req["params"], max_retries=req["max_retries"], timeout=req["timeout"])
+        return self._parse_wallet_tokens(response)
+    
     def calculate_portfolio_similarity(self, tokens1, tokens2):
         """计算两个投资组合的相似度"""
         if not tokens1 or not tokens2:
@@ -92,37 +109,36 @@ class ImprovedSmartAccountDetector:
         
         print(f"🎯 目标地址持有 {len(target_tokens)} 个代币")
         
-        # 2. 对于目标地址持有的每个代币，获取其他持有者
+        # 2. 对于目标地址持有的每个代币，并发获取其他持有者
         candidate_addresses = set()
         
-        for i, token_addr in enumerate(target_tokens[:max_tokens]):
-            print(f"📊 分析代币 {i+1}/{min(len(target_tokens), max_tokens)}: {token_addr[:8]}...")
-            
-            holders = self.get_token_holders(chain_id, token_addr, limit=50)
-            candidate_addresses.update(holders)
-            
-            time.sleep(0.5)  # API限速
+        tokens_to_scan = target_tokens[:max_tokens]
+        print(f"📊 并发分析 {len(tokens_to_scan)} 个代币的持有者...")
+        responses = fetch_many([
+            self._token_holders_request(chain_id, token_addr, limit=50) for token_addr in tokens_to_scan
+        ])
+        for response in responses:
+            candidate_addresses.update(self._parse_token_holders(response))
         
         # 移除目标地址自身
         candidate_addresses.discard(target_address)
         print(f"🔍 发现 {len(candidate_addresses)} 个候选地址")
         
-        # 3. 计算每个候选地址与目标地址的相似度
+        # 3. 并发获取候选地址持仓，计算与目标地址的相似度
         similarity_scores = []
         
-        for i, candidate in enumerate(list(candidate_addresses)[:50]):  # 限制分析数量
-            if i % 10 == 0:
-                print(f"📈 进度: {i+1}/50")
-            
-            candidate_tokens = self.get_wallet_tokens(candidate, chain_id)
+        candidates = list(candidate_addresses)[:50]  # 限制分析数量
+        print(f"📈 并发获取 {len(candidates)} 个候选地址的持仓...")
+        responses = fetch_many([self._wallet_tokens_request(candidate, chain_id) for candidate in candidates])
+        
+        for candidate, response in zip(candidates, responses):
+            candidate_tokens = self._parse_wallet_tokens(response)
             similarity = self.calculate_portfolio_similarity(target_tokens, candidate_tokens)
             
             if similarity >= self.similarity_threshold:
                 common_tokens = len(set(target_tokens) & set(candidate_tokens))
                 if common_tokens >= self.min_common_tokens:
                     similarity_scores.append((candidate, similarity, common_tokens))
-            
-            time.sleep(0.3)  # API限速
         
         # 4. 按相似度排序
         similarity_scores.sort(key=lambda x: (x[1], x[2]), reverse=True)
@@ -140,15 +156,14 @@ class ImprovedSmartAccountDetector:
         
         overlap_counter = defaultdict(int)
         
-        # 对每个代币查询盈利榜
-        for token_addr in target_tokens[:10]:  # 限制数量
-            top_traders = self.get_top_traders_for_token(chain_id, token_addr)
-            
-            for trader_addr in top_traders:
+        # 对每个代币并发查询盈利榜
+        tokens_to_scan = target_tokens[:10]  # 限制数量
+        responses = fetch_many([self._top_traders_request(chain_id, token_addr) for token_addr in tokens_to_scan])
+        
+        for response in responses:
+            for trader_addr in self._parse_top_traders(response):
                 if trader_addr != target_address:
                     overlap_counter[trader_addr] += 1
-            
-            time.sleep(0.5)
         
         # 返回出现频率高的地址
         frequent_addresses = [(addr, count) for addr, count in overlap_counter.items() if count >= 3]
@@ -156,8 +171,8 @@ class ImprovedSmartAccountDetector:
         
         return frequent_addresses
     
-    def get_top_traders_for_token(self, chain_id, token_address):
-        """获取代币的盈利榜地址"""
+    def _top_traders_request(self, chain_id, token_address):
+        """构建代币盈利榜请求"""
         url = "https://web3.okx.com/priapi/v1/dx/market/v2/pnl/top-trader/ranking-list"
         params = {
             "chainId": chain_id,
@@ -171,14 +186,22 @@ class ImprovedSmartAccountDetector:
         if str(chain_id) == "1":
             params["currentUserWalletAddress"] = "0x63291f7d06ea0a17306c5e48779baae289865e99"
         
-        response = fetch_data_robust(url, params, max_retries=2, timeout=15)
-        
+        return {"url": url, "params": params, "max_retries": 2, "timeout": 15}
+    
+    def _parse_top_traders(self, response):
+        """解析代币盈利榜响应"""
         if response and response.get('code') == 0:
             trader_list = response.get('data', {}).get('list', [])
             return [trader.get('holderWalletAddress') for trader in trader_list if trader.get('holderWalletAddress')]
         
         return []
     
+    def get_top_traders_for_token(self, chain_id, token_address):
+        """获取代币的盈利榜地址"""
+        req = self._top_traders_request(chain_id, token_address)
+        response = fetch_data_robust(req["url"], req["params"], max_retries=req["max_retries"], timeout=req["timeout"])
+        return self._parse_top_traders(response)
+    
     def comprehensive_detection(self, target_address, chain_id):
         """综合检测方法"""
         print(f"\n🚀 开始综合检测小号: {target_address[:8]}...")
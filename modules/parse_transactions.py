@@ -1,8 +1,7 @@
 # parse_transactions.py
-import requests
 import pandas as pd
-import time
 from datetime import datetime
+from config.http_client import get_http_client
 
 def fetch_transactions_helius(address, helius_api_key, limit=500):
     """从Helius获取地址的交易历史"""
@@ -13,7 +12,7 @@ def fetch_transactions_helius(address, helius_api_key, limit=500):
     params = {"api-key": helius_api_key, "limit": limit}
     
     try:
-        resp = requests.get(url, params=params, timeout=30)
+        resp = get_http_client().get(url, params=params, timeout=30)
         resp.raise_for_status()
         return resp.json()
     except Exception as e:
@@ -30,7 +29,7 @@ def parse_enhanced_transactions(address, helius_api_key, limit=500):
     }
     
     try:
-        resp = requests.get(url, params=params, timeout=30)
+        resp = get_http_client().get(url, params=params, timeout=30)
         resp.raise_for_status()
         return resp.json()
     except Exception as e:
@@ -131,9 +130,6 @@ def batch_analyze_holders(holders_df, helius_api_key, target_token=None):
         if not events_df.empty:
             all_events.append(events_df)
         
-        # 避免请求过快
-        time.sleep(1)
-        
         if idx % 10 == 0:
             print(f"已处理 {idx + 1}/{len(holders_df)} 个地址")
     
@@ -2,6 +2,7 @@ import time
 import json
 from collections import defaultdict
 from utils import fetch_data
+from services.async_fetcher import map_concurrently
 
 
 def get_token_list(address, chain_id):
@@ -57,7 +58,7 @@ def get_first_buy(address, chain_id, token_address):
     
     return None
 
-def get_early_traders(chain_id, token_address, first_tx_id, page_limit=5):
+def get_early_traders(chain_id, token_address, first_tx_id, page_limit=5, target_address=""):
     """获取在目标地址之前交易该代币的所有地址"""
     url = "https://web3.okx.com/priapi/v1/dx/market/v2/pnl/trading-history"
     early_traders = set()
@@ -83,7 +84,7 @@ def get_early_traders(chain_id, token_address, first_tx_id, page_limit=5):
         trades = data['list']
         # 收集交易地址（排除目标地址自身）
         for trade in trades:
-            if trade['userAddress'].lower() != address.lower():
+            if trade['userAddress'].lower() != target_address.lower():
                 early_traders.add(trade['userAddress'])
         
         # 更新下一页起始ID（使用最后一笔交易的ID）
@@ -102,27 +103,24 @@ def find_smart_accounts(target_address, chain_id, max_tokens=50, page_limit=5):
     # 限制代币数量，避免请求过多
     tokens = tokens[:max_tokens]
     
-    # 2. 统计每个地址的"提前买入"次数
-    address_counter = defaultdict(int)
-    
-    for token in tokens:
-        token_address = token.get('tokenContractAddress')
-        if not token_address:
-            continue
-            
+    def scan_token(token_address):
         # 2.1 获取目标地址在该代币的最早交易ID
         first_tx_id = get_first_buy(target_address, chain_id, token_address)
         if not first_tx_id:
-            continue
+            return set()
         
-        # 2.2 获取所有更早的交易地址
-        early_traders = get_early_traders(chain_id, token_address, first_tx_id, page_limit)
-        
-        # 2.3 更新地址计数器
-        for addr in early_traders:
+        # 2.2 获取所有更早的交易地址（同一代币内的翻页依赖上一页ID，只能串行）
+        return get_early_traders(chain_id, token_address, first_tx_id, page_limit, target_address)
+    
+    # 2. 不同代币之间互不依赖，并发扫描
+    token_addresses = [token.get('tokenContractAddress') for token in tokens if token.get('tokenContractAddress')]
+    early_traders_per_token = map_concurrently(scan_token, token_addresses)
+    
+    # 2.3 统计每个地址的"提前买入"次数
+    address_counter = defaultdict(int)
+    for early_traders in early_traders_per_token:
+        for addr in early_traders or ():
             address_counter[addr] += 1
-        
-        time.sleep(0.5)  # API限速缓冲
     
     # 3. 按出现频率排序
     suspicious_accounts = sorted(address_counter.items(), key=lambda x: x[1], reverse=True)
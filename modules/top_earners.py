@@ -5,11 +5,11 @@ import pandas as pd
 import time
 import gc
 from utils import fetch_data_robust
+from services.paginator import fetch_offset_pages
 
 class TopEarnersTracker:
     def __init__(self):
         self.max_workers = 2  # Render 环境限制并发数
-        self.request_delay = 1.0  # 稍微增加请求间隔
         self.max_timeout = 25  # 增加单个请求超时
         
         # 支持的链配置
@@ -126,73 +126,48 @@ class TopEarnersTracker:
         max_batches = max(1, (max_records + batch_size - 1) // batch_size)
         max_batches = min(max_batches, 3)
         
-        all_tokens = []
+        # 调整超时
+        timeout = 30 if str(chain_id) == "1" else self.max_timeout
+        
+        def fetch_batch(offset):
+            """获取单批代币，失败返回 None"""
+            batch = offset // batch_size
+            current_limit = min(batch_size, max_records - offset)
+            params = {
+                "walletAddress": wallet_address,
+                "chainId": str(chain_id),
+                "isAsc": False,
+                "sortType": 1,
+                "offset": offset,
+                "limit": current_limit,
+                "t": int(time.time() * 1000)
+            }
+            
+            print(f"📊 第 {batch + 1}/{max_batches} 次请求，偏移: {offset}, 数量: {current_limit}")
+            
+            response = fetch_data_robust(
+                url, params, 
+                max_retries=2,
+                timeout=timeout
+            )
+            
+            if not response or response.get('code') != 0:
+                print(f"❌ 第 {batch + 1} 次请求失败")
+                if response:
+                    print(f"🔍 错误响应: {response}")
+                return None
+            
+            tokens = response.get('data', {}).get('tokenList', [])
+            if not tokens:
+                print(f"📝 第 {batch + 1} 次请求无数据，停止获取")
+                return []
+            
+            print(f"✅ 第 {batch + 1} 次请求获取到 {len(tokens)} 个代币")
+            return tokens
         
         try:
-            for batch in range(max_batches):
-                offset = batch * batch_size
-                remaining = max_records - len(all_tokens)
-                current_limit = min(batch_size, remaining)
-                
-                if current_limit <= 0:
-                    break
-                
-                params = {
-                    "walletAddress": wallet_address,
-                    "chainId": str(chain_id),
-                    "isAsc": False,
-                    "sortType": 1,
-                    "offset": offset,
-                    "limit": current_limit,
-                    "t": int(time.time() * 1000)
-                }
-                
-                print(f"📊 第 {batch + 1}/{max_batches} 次请求，偏移: {offset}, 数量: {current_limit}")
-                
-                # 只在多次请求时添加延迟
-                if batch > 0:
-                    time.sleep(self.request_delay)
-                
-                # 调整超时
-                timeout = 30 if str(chain_id) == "1" else self.max_timeout
-                
-                response = fetch_data_robust(
-                    url, params, 
-                    max_retries=2,
-                    timeout=timeout
-                )
-                
-                if not response or response.get('code') != 0:
-                    print(f"❌ 第 {batch + 1} 次请求失败")
-                    if response:
-                        print(f"🔍 错误响应: {response}")
-                    break
-                
-                data = response.get('data', {})
-                tokens = data.get('tokenList', [])
-                
-                if not tokens:
-                    print(f"📝 第 {batch + 1} 次请求无数据，停止获取")
-                    break
-                
-                print(f"✅ 第 {batch + 1} 次请求获取到 {len(tokens)} 个代币")
-                all_tokens.extend(tokens)
-                
-                # 保存当前批次的 tokens 数量，用于后续判断
-                current_tokens_count = len(tokens)
-                
-                # 内存清理
-                del tokens, data, response
-                
-                # 检查是否达到目标数量
-                if len(all_tokens) >= max_records:
-                    print(f"🎯 已达到目标数量 {max_records}，停止请求")
-                    break
-                
-                # 如果这次返回的数据少于请求的，说明已经没有更多数据了
-                if current_tokens_count < current_limit:
-                    print(f"📝 返回数据量({current_tokens_count}) < 请求量({current_limit})，无更多数据")
-                    break
+            # 各批次offset事先可知，并发请求，返回不足一批即视为无更多数据
+            all_tokens = fetch_offset_pages(fetch_batch, batch_size, max_items=max_records, max_pages=max_batches)
             
             # 确保不超过目标数量
             result = all_tokens[:max_records]
@@ -1,11 +1,10 @@
-import requests
-import time
 import hmac
 import base64
 import hashlib
 import json
 import pandas as pd
 from datetime import datetime, timezone
+from config.http_client import get_http_client
 
 
 # 你的 API 信息
@@ -120,7 +119,7 @@ def get_okx_transaction_df(address, chain="501", begin=None, end=None, limit=100
             'OK-ACCESS-PROJECT': PROJECT_ID
         }
 
-        response = requests.get(url, headers=headers, params=params, timeout=15)
+        response = get_http_client().get(url, headers=headers, params=params, timeout=15)
         response.raise_for_status()  # 检查HTTP错误
         if response.status_code != 200:
             print("请求失败:", response.status_code, response.text)
@@ -136,8 +135,6 @@ def get_okx_transaction_df(address, chain="501", begin=None, end=None, limit=100
         if not cursor or not txs:
             break
 
-        time.sleep(1)
-
     if not all_txs:
         return pd.DataFrame()
     
@@ -2,8 +2,15 @@ import json
 import time
 from datetime import datetime, timedelta
 from utils import fetch_data_robust
+from services.async_fetcher import fetch_many
 
 class WalletTagEngine:
+    # periodType: 3=7D, 4=30D
+    PROFILE_PERIODS = {
+        '7d': 3,
+        '30d': 4
+    }
+    
     def __init__(self, config_path=None):
         """初始化标签引擎"""
         if config_path is None:
@@ -39,8 +46,8 @@ class WalletTagEngine:
         self.tags_config = self.config.get('tags', default_config['tags'])
         self.exclusive_groups = self.config.get('exclusive_groups', default_config['exclusive_groups'])
     
-    def fetch_wallet_tokens(self, wallet_address, chain_id="501"):
-        """获取钱包代币数据"""
+    def _wallet_tokens_request(self, wallet_address, chain_id="501"):
+        """构建代币列表请求"""
         url = "https://web3.okx.com/priapi/v1/dx/market/v2/pnl/token-list"
         
         params = {
@@ -60,72 +67,81 @@ class WalletTagEngine:
             params["offset"] = 1 
             print(f"🔧 {chain_id_str}链: 添加filterEmptyBalance和offset=1参数")
         
+        return {'url': url, 'params': params, 'max_retries': 3, 'timeout': 20}
+    
+    def _parse_wallet_tokens(self, response):
+        """解析代币列表响应"""
+        if response and response.get('code') == 0:
+            tokens = response.get('data', {}).get('tokenList', [])
+            print(f"✅ 获取到 {len(tokens)} 个代币")
+            return tokens
+        else:
+            print(f"❌ 获取代币失败")
+            return []
+    
+    def fetch_wallet_tokens(self, wallet_address, chain_id="501"):
+        """获取钱包代币数据"""
+        req = self._wallet_tokens_request(wallet_address, chain_id)
+        
         try:
-            response = fetch_data_robust(url, params, max_retries=3, timeout=20)
-            
-            if response and response.get('code') == 0:
-                tokens = response.get('data', {}).get('tokenList', [])
-                print(f"✅ 获取到 {len(tokens)} 个代币")
-                return tokens
-            else:
-                print(f"❌ 获取代币失败")
-                return []
+            response = fetch_data_robust(req['url'], req['params'], max_retries=req['max_retries'], timeout=req['timeout'])
+            return self._parse_wallet_tokens(response)
                 
         except Exception as e:
             print(f"❌ 代币请求异常: {e}")
             return []
     
-    def fetch_wallet_profile_multi_period(self, wallet_address, chain_id="501"):
-        """获取多个时间窗口的钱包profile数据（只要7D和30D）"""
+    def _profile_requests(self, wallet_address, chain_id="501"):
+        """构建多时间窗口profile请求（只要7D和30D）"""
         url = "https://web3.okx.com/priapi/v1/dx/market/v2/pnl/wallet-profile/summary"
-        
-        # periodType: 3=7D, 4=30D
-        periods = {
-            '7d': 3,
-            '30d': 4
-        }
-        
-        profile_data = {}
         chain_id_str = str(chain_id)
         
-        for period_name, period_type in periods.items():
+        # 🔧 ETH链可能需要额外参数（根据API模式推测）
+        if chain_id_str in ["1", "56"]:  # ETH链或BSC链
+            print(f"🔧 {chain_id_str}链profile请求")
+        
+        requests = []
+        for period_name, period_type in self.PROFILE_PERIODS.items():
             params = {
                 "periodType": period_type,
                 "chainId": chain_id_str,
                 "walletAddress": wallet_address,
                 "t": int(time.time() * 1000)
             }
-            
-            # 🔧 ETH链可能需要额外参数（根据API模式推测）
-            if chain_id_str in ["1", "56"]:  # ETH链或BSC链
-                print(f"🔧 {chain_id_str}链profile请求")
-            
-            try:
-                response = fetch_data_robust(url, params, max_retries=3, timeout=25)
-                
-                if response and response.get('code') == 0:
-                    data = response.get('data', {})
-                    profile_data[period_name] = {
-                        'win_rate': float(data.get('totalWinRate', 0)),
-                        'total_pnl': float(data.get('totalPnl', 0)),
-                        'total_roi': float(data.get('totalPnlRoi', 0)),
-                        'total_tx_buy': int(data.get('totalTxsBuy', 0)),
-                        'total_tx_sell': int(data.get('totalTxsSell', 0)),
-                        'total_tx': int(data.get('totalTxsBuy', 0)) + int(data.get('totalTxsSell', 0))
-                    }
-                    print(f"✅ 获取{period_name}数据成功")
-                else:
-                    print(f"❌ 获取{period_name}数据失败: {response.get('msg', 'Unknown error') if response else 'No response'}")
-                    profile_data[period_name] = self._get_empty_profile()
-                
-                # 避免API限制
-                time.sleep(0.5)
-                    
-            except Exception as e:
-                print(f"❌ {period_name}请求异常: {e}")
-                profile_data[period_name] = self._get_empty_profile()
+            requests.append({'url': url, 'params': params, 'max_retries': 3, 'timeout': 25})
+        return requests
+    
+    def _parse_profile(self, period_name, response):
+        """解析单个时间窗口的profile响应"""
+        try:
+            if response and response.get('code') == 0:
+                data = response.get('data', {})
+                profile = {
+                    'win_rate': float(data.get('totalWinRate', 0)),
+                    'total_pnl': float(data.get('totalPnl', 0)),
+                    'total_roi': float(data.get('totalPnlRoi', 0)),
+                    'total_tx_buy': int(data.get('totalTxsBuy', 0)),
+                    'total_tx_sell': int(data.get('totalTxsSell', 0)),
+                    'total_tx': int(data.get('totalTxsBuy', 0)) + int(data.get('totalTxsSell', 0))
+                }
+                print(f"✅ 获取{period_name}数据成功")
+                return profile
+            else:
+                print(f"❌ 获取{period_name}数据失败: {response.get('msg', 'Unknown error') if response else 'No response'}")
+                return self._get_empty_profile()
+        except Exception as e:
+            print(f"❌ {period_name}请求异常: {e}")
+            return self._get_empty_profile()
+    
+    def fetch_wallet_profile_multi_period(self, wallet_address, chain_id="501"):
+        """获取多个时间窗口的钱包profile数据（只要7D和30D）"""
+        requests = self._profile_requests(wallet_address, chain_id)
+        responses = fetch_many(requests)
         
-        return profile_data
+        return {
+            period_name: self._parse_profile(period_name, response)
+            for period_name, response in zip(self.PROFILE_PERIODS, responses)
+        }
     
     def _get_empty_profile(self):
         """返回空的profile数据"""
@@ -318,14 +334,16 @@ class WalletTagEngine:
             print(f"❌ 标签识别失败: {e}")
             return ["未知钱包"]
     
-    def analyze_wallet(self, wallet_address, chain_id="501"):
-        """分析单个钱包"""
+    def analyze_wallet(self, wallet_address, chain_id="501", tokens_data=None, profile_data_multi=None):
+        """分析单个钱包（可传入已预取的数据，避免重复请求）"""
         print(f"🔍 开始分析钱包: {wallet_address[:8]}...")
         
         try:
             # 获取数据
-            tokens_data = self.fetch_wallet_tokens(wallet_address, chain_id)
-            profile_data_multi = self.fetch_wallet_profile_multi_period(wallet_address, chain_id)
+            if tokens_data is None:
+                tokens_data = self.fetch_wallet_tokens(wallet_address, chain_id)
+            if profile_data_multi is None:
+                profile_data_multi = self.fetch_wallet_profile_multi_period(wallet_address, chain_id)
             
             # 计算统计数据
             stats = self.calculate_wallet_stats(tokens_data, profile_data_multi)
@@ -391,18 +409,33 @@ class WalletTagEngine:
         return filtered_tags
     
     def batch_analyze(self, addresses, chain_id="501"):
-        """批量分析钱包"""
-        results = []
+        """批量分析钱包 - 所有钱包的请求并发发出，再逐个计算标签"""
+        addresses = [address.strip() for address in addresses]
+        periods = list(self.PROFILE_PERIODS)
+        
+        # 每个钱包: 1个代币列表请求 + 每个时间窗口1个profile请求
+        requests = []
+        for address in addresses:
+            requests.append(self._wallet_tokens_request(address, chain_id))
+            requests.extend(self._profile_requests(address, chain_id))
         
+        print(f"\n🚀 并发获取 {len(addresses)} 个钱包数据，共 {len(requests)} 个请求")
+        responses = fetch_many(requests)
+        
+        results = []
+        per_wallet = 1 + len(periods)
         for i, address in enumerate(addresses):
             print(f"\n🔍 分析钱包 {i+1}/{len(addresses)}: {address[:8]}...")
             
-            result = self.analyze_wallet(address.strip(), chain_id)
-            results.append(result)
+            wallet_responses = responses[i * per_wallet:(i + 1) * per_wallet]
+            tokens_data = self._parse_wallet_tokens(wallet_responses[0])
+            profile_data_multi = {
+                period_name: self._parse_profile(period_name, response)
+                for period_name, response in zip(periods, wallet_responses[1:])
+            }
             
-            # 避免API限制
-            if i < len(addresses) - 1:  # 最后一个不需要等待
-                time.sleep(2)  # 增加等待时间，因为要请求多个API
+            result = self.analyze_wallet(address, chain_id, tokens_data, profile_data_multi)
+            results.append(result)
         
         print(f"\n✅ 批量分析完成！共处理 {len(results)} 个钱包")
         return results
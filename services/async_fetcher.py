@@ -0,0 +1,183 @@
+"""
+异步并发请求引擎
+基于 asyncio + 信号量限制在途请求数，底层复用 utils.fetch_data_robust 的同步请求链路
+（共享连接池、重试逻辑），同时提供同步包装函数供 Flask 路由直接调用
+"""
+
+import os
+import asyncio
+import threading
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import fetch_data_robust
+
+logger = logging.getLogger(__name__)
+
+# 当前线程所在 map 线程池的嵌套层级（主线程为0）
+_local = threading.local()
+
+
+class AsyncFetcher:
+    """有界并发的异步请求器"""
+
+    def __init__(self, max_concurrency=None):
+        # 默认8个在途请求，可通过 ASYNC_FETCH_CONCURRENCY 调整（建议8-16）
+        self.max_concurrency = max_concurrency or int(os.getenv('ASYNC_FETCH_CONCURRENCY', 8))
+        # 专用线程池：阻塞的HTTP请求在这里执行，不占用默认执行器
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="async_fetch"
+        )
+        # map 的共享线程池按嵌套层级划分：map 任务内部可以再调用 map_concurrently / fetch_many，
+        # 内层任务进入下一层的线程池，不会与占满本层线程的外层任务互相等待；
+        # 各层线程池常驻复用，单次调用的并发数由信号量限制
+        self.map_workers = int(os.getenv('ASYNC_MAP_MAX_WORKERS', 32))
+        self._map_executors = {}
+        self._map_lock = threading.Lock()
+
+    async def _run_blocking(self, semaphore, func, *args, **kwargs):
+        """在信号量保护下把阻塞调用放入线程池执行"""
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+
+    async def fetch(self, url, params=None, semaphore=None, **kwargs):
+        """异步获取单个请求（kwargs 透传给 fetch_data_robust）"""
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        try:
+            return await self._run_blocking(semaphore, fetch_data_robust, url, params, **kwargs)
+        except Exception as e:
+            logger.error(f"❌ 异步请求失败 {url[:50]}...: {e}")
+            return None
+
+    async def fetch_many(self, requests):
+        """
+        并发获取多个请求，结果顺序与输入一致
+
+        Args:
+            requests: 请求描述列表，每项为 dict：
+                {'url': ..., 'params': {...}, 'max_retries': 3, 'timeout': 15, 'headers': {...}}
+                除 url 外均可省略
+
+        Returns:
+            List: 每个请求的JSON响应，失败的位置为 None
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = []
+        for req in requests:
+            req = dict(req)
+            url = req.pop('url')
+            params = req.pop('params', None)
+            tasks.append(self.fetch(url, params, semaphore=semaphore, **req))
+        return await asyncio.gather(*tasks)
+
+    def _map_executor(self, depth):
+        """第 depth 层的 map 线程池（首次使用时创建）"""
+        with self._map_lock:
+            executor = self._map_executors.get(depth)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=self.map_workers,
+                                              thread_name_prefix=f"async_map{depth}")
+                self._map_executors[depth] = executor
+            return executor
+
+    async def map(self, func, items, max_concurrency=None, depth=0):
+        """
+        并发执行任意阻塞函数 func(item)，结果顺序与输入一致，异常位置为 None
+
+        depth 为调用方所在的嵌套层级（见 map_concurrently），任务在第 depth 层的共享线程池中执行
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        executor = self._map_executor(depth)
+
+        def call(item):
+            _local.depth = depth + 1
+            return func(item)
+
+        async def run_one(item):
+            try:
+                async with semaphore:
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(executor, call, item)
+            except Exception as e:
+                logger.error(f"❌ 并发任务失败: {e}")
+                return None
+
+        return await asyncio.gather(*(run_one(item) for item in items))
+
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False)
+        with self._map_lock:
+            for executor in self._map_executors.values():
+                executor.shutdown(wait=False)
+            self._map_executors.clear()
+
+
+def _run_sync(coro):
+    """在同步代码中运行协程；若当前线程已有事件循环，则在新线程中运行"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def runner():
+        try:
+            result['value'] = asyncio.run(coro)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+# 全局请求器实例
+_async_fetcher = None
+_async_fetcher_lock = threading.Lock()
+
+
+def get_async_fetcher():
+    """获取全局异步请求器实例（单例模式）"""
+    global _async_fetcher
+    if _async_fetcher is None:
+        with _async_fetcher_lock:
+            if _async_fetcher is None:
+                _async_fetcher = AsyncFetcher()
+    return _async_fetcher
+
+
+# 同步包装函数（供 Flask 路由和现有同步模块使用）
+def fetch_many(requests, max_concurrency=None):
+    """同步并发获取多个请求，返回与输入顺序一致的结果列表"""
+    if not requests:
+        return []
+    fetcher = AsyncFetcher(max_concurrency) if max_concurrency else get_async_fetcher()
+    try:
+        logger.info(f"🚀 并发请求 {len(requests)} 个 (并发上限 {fetcher.max_concurrency})")
+        return _run_sync(fetcher.fetch_many(requests))
+    finally:
+        if fetcher is not _async_fetcher:
+            fetcher.shutdown()
+
+
+def map_concurrently(func, items, max_concurrency=None):
+    """同步并发执行 func(item)，返回与输入顺序一致的结果列表
+
+    复用全局请求器按嵌套层级划分的 map 线程池（不再每次新建线程池），并发数由 max_concurrency 限制；
+    func 内部可以继续调用 map_concurrently / fetch_many 而不会与外层任务互相等待
+    """
+    items = list(items)
+    if not items:
+        return []
+    depth = getattr(_local, 'depth', 0)
+    return _run_sync(get_async_fetcher().map(func, items, max_concurrency, depth))
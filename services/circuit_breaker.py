@@ -0,0 +1,149 @@
+"""
+上游接口熔断器
+按 (接口, 链) 维护熔断状态：连续失败达到阈值后熔断（快速失败，不再占用线程等待超时），
+冷却时间到后进入半开状态放行一个探测请求，成功则恢复，失败则继续熔断
+"""
+
+import os
+import time
+import threading
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 参数中表示链的字段（各接口命名不一）
+CHAIN_PARAM_NAMES = ('chainId', 'chain', 'chainIndex')
+
+
+class CircuitBreaker:
+    """单个 (接口, 链) 的熔断器（线程安全）"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        # 监控统计
+        self.total_rejected = 0
+        self.times_opened = 0
+
+    def allow(self):
+        """是否放行本次请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"🔌 熔断器半开，放行探测请求: {self.name}")
+
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+
+            self.total_rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"✅ 熔断器恢复: {self.name}")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                    logger.warning(
+                        f"⚡ 熔断器打开: {self.name}（连续失败 {self.consecutive_failures} 次，"
+                        f"{self.reset_timeout}s 后半开）"
+                    )
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def get_status(self):
+        with self._lock:
+            status = {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'total_rejected': self.total_rejected
+            }
+            if self.state == OPEN:
+                status['retry_in_seconds'] = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+            return status
+
+
+class CircuitBreakerRegistry:
+    """按 (接口, 链) 管理熔断器"""
+
+    def __init__(self):
+        self.enabled = os.getenv('CIRCUIT_BREAKER_ENABLED', 'True').lower() == 'true'
+        self.failure_threshold = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+        self.reset_timeout = float(os.getenv('CIRCUIT_RESET_SECONDS', 60))
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def breaker_name(url, params=None):
+        """熔断器名称：主机+路径，带链ID时追加 @chain"""
+        parsed = urlparse(url)
+        name = f"{parsed.netloc.lower()}{parsed.path}"
+        for key in CHAIN_PARAM_NAMES:
+            if params and params.get(key) not in (None, ''):
+                return f"{name}@{params[key]}"
+        return name
+
+    def get_breaker(self, url, params=None):
+        """获取（或创建）URL+参数对应的熔断器"""
+        name = self.breaker_name(url, params)
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    breaker = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+                    self._breakers[name] = breaker
+        return breaker
+
+    def allow(self, url, params=None):
+        """是否放行请求（未启用熔断时总是放行）"""
+        return not self.enabled or self.get_breaker(url, params).allow()
+
+    def get_status(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.get_status() for name, breaker in breakers.items()}
+
+
+# 全局实例
+_circuit_breakers = None
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breakers():
+    """获取全局熔断器注册表（单例模式）"""
+    global _circuit_breakers
+    if _circuit_breakers is None:
+        with _circuit_breakers_lock:
+            if _circuit_breakers is None:
+                _circuit_breakers = CircuitBreakerRegistry()
+    return _circuit_breakers
@@ -0,0 +1,160 @@
+"""
+自适应并发控制器（AIMD）
+按上游主机维护在途请求上限：响应正常时加性增加（每轮约+1），
+遇到429/5xx、超时或延迟突增时乘性减少，使长时间批量任务自动逼近上游真实可承受的并发
+"""
+
+import os
+import time
+import threading
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class AIMDLimiter:
+    """单个主机的AIMD并发上限（线程安全）"""
+
+    def __init__(self, initial=4, min_limit=1, max_limit=16, decrease_factor=0.5,
+                 latency_factor=3.0, min_spike_seconds=1.0, cooldown_seconds=1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        # 延迟超过基线的 latency_factor 倍且超过 min_spike_seconds 视为延迟突增
+        self.latency_factor = latency_factor
+        self.min_spike_seconds = min_spike_seconds
+        # 同一批并发请求同时失败只减一次
+        self.cooldown_seconds = cooldown_seconds
+
+        self.in_flight = 0
+        self.latency_ewma = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+        # 监控统计
+        self.total_requests = 0
+        self.total_overloaded = 0
+        self.total_decreases = 0
+        self.peak_limit = self.limit
+
+    def acquire(self):
+        """占用一个在途名额，超过当前上限时阻塞等待"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded=False, success=True):
+        """
+        释放名额并根据本次结果调整上限
+
+        Args:
+            latency: 本次请求耗时（秒）
+            overloaded: 是否出现过载信号（429/5xx/超时）
+            success: 请求是否正常完成（非过载的其他异常传 False，不参与调整）
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self.total_requests += 1
+
+            spike = (
+                not overloaded and success and self.latency_ewma is not None
+                and latency > self.min_spike_seconds
+                and latency > self.latency_ewma * self.latency_factor
+            )
+
+            if overloaded or spike:
+                self.total_overloaded += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown_seconds:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self.total_decreases += 1
+                    reason = '延迟突增' if spike else '429/5xx/超时'
+                    logger.info(f"📉 并发上限下调至 {int(self.limit)}（{reason}）")
+            elif success:
+                # 加性增加：每完成约 limit 个正常请求（一轮）上限+1
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+                self.latency_ewma = latency if self.latency_ewma is None else 0.9 * self.latency_ewma + 0.1 * latency
+
+            self._cond.notify_all()
+
+    def get_status(self):
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'peak_limit': int(self.peak_limit),
+                'latency_ewma_ms': round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+                'total_requests': self.total_requests,
+                'total_overloaded': self.total_overloaded,
+                'total_decreases': self.total_decreases
+            }
+
+
+def is_overloaded_response(response):
+    """响应本身或适配器层重试历史中出现过429/5xx即视为过载"""
+    if response.status_code == 429 or response.status_code >= 500:
+        return True
+    retries = getattr(response.raw, 'retries', None)
+    for entry in getattr(retries, 'history', ()) or ():
+        if entry.status is not None and (entry.status == 429 or entry.status >= 500):
+            return True
+        if entry.error is not None:
+            return True
+    return False
+
+
+class ConcurrencyController:
+    """按上游主机路由到AIMD限制器"""
+
+    def __init__(self):
+        self.enabled = os.getenv('AIMD_ENABLED', 'True').lower() == 'true'
+        self.initial = int(os.getenv('AIMD_INITIAL_CONCURRENCY', 4))
+        self.min_limit = int(os.getenv('AIMD_MIN_CONCURRENCY', 1))
+        # 上限默认与单主机连接池大小一致
+        self.max_limit = int(os.getenv('AIMD_MAX_CONCURRENCY', os.getenv('HTTP_POOL_MAXSIZE', 16)))
+        self.latency_factor = float(os.getenv('AIMD_LATENCY_FACTOR', 3.0))
+
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get_limiter(self, url):
+        """获取（或创建）URL所属主机的限制器"""
+        host = urlparse(url).netloc.lower()
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(host)
+                if limiter is None:
+                    limiter = AIMDLimiter(
+                        initial=self.initial,
+                        min_limit=self.min_limit,
+                        max_limit=self.max_limit,
+                        latency_factor=self.latency_factor
+                    )
+                    self._limiters[host] = limiter
+        return limiter
+
+    def get_status(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {host: limiter.get_status() for host, limiter in limiters.items()}
+
+
+# 全局控制器实例
+_concurrency_controller = None
+_concurrency_controller_lock = threading.Lock()
+
+
+def get_concurrency_controller():
+    """获取全局并发控制器实例（单例模式）"""
+    global _concurrency_controller
+    if _concurrency_controller is None:
+        with _concurrency_controller_lock:
+            if _concurrency_controller is None:
+                _concurrency_controller = ConcurrencyController()
+    return _concurrency_controller
@@ -4,7 +4,8 @@
 """
 
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, and_, or_
+from sqlalchemy import desc, and_, or_, text
+from sqlalchemy.exc import IntegrityError
 from models.database_models import TopTrader, TokenHolder, WalletTag, TransactionHistory, AnalysisJob
 from config.database import get_db_session, get_db_engine, get_db
 import pandas as pd
@@ -17,68 +18,86 @@ logger = logging.getLogger(__name__)
 class TopTraderService:
     """TOP交易者数据服务 - Render优化版"""
     
+    # API字段 -> (列名, 类型)
+    TRADER_FIELDS = {
+        'walletAddress': ('wallet_address', str),
+        'totalPnl': ('total_pnl', float),
+        'totalProfitPercentage': ('total_pnl_percentage', float),
+        'realizedProfit': ('realized_profit', float),
+        'realizedProfitPercentage': ('realized_profit_percentage', float),
+        'roi': ('roi', float),
+        'buyCount': ('buy_count', int),
+        'sellCount': ('sell_count', int),
+        'totalCount': ('total_count', int),
+        'winRate': ('win_rate', float),
+        'buyValue': ('buy_value', float),
+        'sellValue': ('sell_value', float),
+        'holdAmount': ('hold_amount', float),
+        'boughtAvgPrice': ('bought_avg_price', float),
+        'soldAvgPrice': ('sold_avg_price', float),
+        'tags': ('tags', str),
+        'remark': ('remark', str)
+    }
+    UNIQUE_KEY = ('wallet_address', 'token_address', 'chain_id')
+    
     @staticmethod
     def save_traders(traders_data, token_address, chain_id):
-        """保存交易者数据到数据库 - 使用优化的会话管理"""
+        """
+        保存交易者数据到数据库 - 批量 upsert
+        
+        按 (钱包, 代币, 链) 插入或更新，再删除本次未出现的旧交易者（与原先先删后插的结果一致）；
+        整个过程是一个短事务，连接池中的连接只占用几毫秒
+        """
         try:
-            # 🔧 使用新的会话管理器，自动释放连接
-            db_gen = get_db()
-            db = next(db_gen)
+            now = datetime.utcnow()
+            records = TopTraderService._prepare_trader_rows(traders_data, token_address, chain_id, now)
+            engine = get_db_engine()
+            _ensure_trader_unique_index(engine)
             
-            try:
-                # 先删除相同token的旧数据
-                db.query(TopTrader).filter(
-                    and_(
-                        TopTrader.token_address == token_address,
-                        TopTrader.chain_id == chain_id
-                    )
-                ).delete()
-                
-                # 添加新数据
-                saved_count = 0
-                for trader_data in traders_data:
-                    trader = TopTrader(
-                        wallet_address=trader_data.get('walletAddress', ''),
-                        token_address=token_address,
-                        chain_id=chain_id,
-                        total_pnl=float(trader_data.get('totalPnl', 0)),
-                        total_pnl_percentage=float(trader_data.get('totalProfitPercentage', 0)),
-                        realized_profit=float(trader_data.get('realizedProfit', 0)),
-                        realized_profit_percentage=float(trader_data.get('realizedProfitPercentage', 0)),
-                        roi=float(trader_data.get('roi', 0)),
-                        buy_count=int(trader_data.get('buyCount', 0)),
-                        sell_count=int(trader_data.get('sellCount', 0)),
-                        total_count=int(trader_data.get('totalCount', 0)),
-                        win_rate=float(trader_data.get('winRate', 0)),
-                        buy_value=float(trader_data.get('buyValue', 0)),
-                        sell_value=float(trader_data.get('sellValue', 0)),
-                        hold_amount=float(trader_data.get('holdAmount', 0)),
-                        bought_avg_price=float(trader_data.get('boughtAvgPrice', 0)),
-                        sold_avg_price=float(trader_data.get('soldAvgPrice', 0)),
-                        tags=trader_data.get('tags', ''),
-                        remark=trader_data.get('remark', '')
-                    )
-                    db.add(trader)
-                    saved_count += 1
-                
-                db.commit()
-                logger.info(f"✅ 成功保存 {saved_count} 个交易者数据")
-                return saved_count
-                
-            except Exception as e:
-                db.rollback()
-                raise e
-            finally:
-                # 🔧 确保会话被正确关闭
-                try:
-                    next(db_gen)
-                except StopIteration:
-                    pass
+            table = TopTrader.__table__
+            with engine.begin() as conn:
+                upsert = _upsert_statement(conn.dialect.name, table, TopTraderService.UNIQUE_KEY)
+                if upsert is None:
+                    # 不支持 ON CONFLICT 的数据库：先删后批量插入
+                    conn.execute(table.delete().where(and_(
+                        table.c.token_address == token_address, table.c.chain_id == chain_id
+                    )))
+                    upsert = table.insert()
+                if records:
+                    conn.execute(upsert, records)
+                # 本次写入的行 updated_at 都等于 now，更早的即为已不在榜单中的旧数据
+                conn.execute(table.delete().where(and_(
+                    table.c.token_address == token_address,
+                    table.c.chain_id == chain_id,
+                    or_(table.c.updated_at.is_(None), table.c.updated_at < now)
+                )))
+            
+            logger.info(f"✅ 成功保存 {len(records)} 个交易者数据")
+            return len(records)
                 
         except Exception as e:
             logger.error(f"❌ 保存交易者数据失败: {e}")
             raise
     
+    @staticmethod
+    def _prepare_trader_rows(traders_data, token_address, chain_id, updated_at):
+        """按列把API数据转换为待写入的行（向量化转换，替代逐条 float()/int()，无法解析的数值记为0）"""
+        source = pd.DataFrame(list(traders_data))
+        frame = pd.DataFrame(index=source.index)
+        for field, (column, kind) in TopTraderService.TRADER_FIELDS.items():
+            values = source[field] if field in source else pd.Series(None, index=source.index, dtype=object)
+            if kind is str:
+                frame[column] = values.fillna('').astype(str)
+            else:
+                numbers = pd.to_numeric(values, errors='coerce').fillna(0)
+                frame[column] = numbers.astype('int64' if kind is int else 'float64')
+        frame['token_address'] = token_address
+        frame['chain_id'] = chain_id
+        frame['updated_at'] = updated_at
+        # 同一条语句中不能两次更新同一行：重复钱包保留最后一条
+        frame = frame.drop_duplicates('wallet_address', keep='last')
+        return frame.to_dict('records')
+    
     @staticmethod
     def get_traders(token_address, chain_id, limit=100):
         """从数据库获取交易者数据 - 使用优化的会话管理"""
@@ -368,6 +387,51 @@ class AnalysisJobService:
             logger.error(f"❌ 更新任务状态失败: {e}")
             return False
 
+# 批量 upsert 辅助函数
+_unique_index_ready = False
+
+def _ensure_trader_unique_index(engine):
+    """为已有的 top_traders 表补建 (钱包, 代币, 链) 唯一索引（新建的表由模型定义创建），每个进程只检查一次"""
+    global _unique_index_ready
+    if _unique_index_ready:
+        return
+    create_sql = text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_trader_wallet_token_chain "
+        "ON top_traders (wallet_address, token_address, chain_id)"
+    )
+    try:
+        with engine.begin() as conn:
+            conn.execute(create_sql)
+    except IntegrityError:
+        # 旧数据中有重复行：保留每组最新的一行后重建
+        with engine.begin() as conn:
+            conn.execute(text(
+                "DELETE FROM top_traders WHERE id NOT IN ("
+                "SELECT MAX(id) FROM top_traders GROUP BY wallet_address, token_address, chain_id)"
+            ))
+            conn.execute(create_sql)
+        logger.info("🔧 已清理 top_traders 重复行并创建唯一索引")
+    _unique_index_ready = True
+
+def _upsert_statement(dialect_name, table, key_columns):
+    """按唯一键冲突时更新其余列的 INSERT 语句；数据库不支持时返回 None"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    statement = insert(table)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={
+            column.name: excluded[column.name]
+            for column in table.columns
+            if column.name not in key_columns and column.name not in ('id', 'created_at')
+        }
+    )
+
 # 导出DataFrame到数据库的通用函数
 def save_dataframe_to_db(df, table_name, if_exists='replace'):
     """将DataFrame保存到数据库 - 使用优化的连接管理"""
@@ -0,0 +1,108 @@
+"""
+时间序列降采样
+多条序列共用同一时间轴（如多个地址在同一组快照上的余额），缺失点为 NaN；
+按桶挑选代表点，返回与输入同形状的布尔掩码，调用方据此取出保留的点。
+所有序列在同一次循环中向量化处理，耗时只与目标点数有关，与序列条数基本无关
+"""
+
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def _prepare(x, values):
+    x = np.asarray(x, dtype=float)
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    return x, values, ~np.isnan(values)
+
+
+def _ends(present):
+    """每条序列首个/最后一个有效点的列号，以及是否有有效点"""
+    has_any = present.any(axis=1)
+    first = np.argmax(present, axis=1)
+    last = present.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+    return has_any, first, last
+
+
+def lttb(x, values, points):
+    """
+    Largest-Triangle-Three-Buckets：保留首尾点，中间按列均分为 points-2 个桶，
+    每桶选与「上一个选中点、下一桶均值点」构成三角形面积最大的点，折线形状保留得最好
+
+    Args:
+        x: 时间轴（长度 m，升序）
+        values: (k, m) 数值矩阵，NaN 表示该序列在该时刻无数据
+        points: 每条序列最多保留的点数
+    Returns:
+        (k, m) 布尔掩码
+    """
+    x, values, present = _prepare(x, values)
+    k, m = values.shape
+    if points >= m or m <= 2:
+        return present
+    points = max(int(points), 3)
+
+    rows = np.arange(k)
+    has_any, first, last = _ends(present)
+    keep = np.zeros_like(present)
+    keep[rows[has_any], first[has_any]] = True
+    keep[rows[has_any], last[has_any]] = True
+
+    # 上一个选中点（初始为首点）；下一桶无数据时以末点代替均值点
+    ax, ay = x[first], values[rows, first]
+    last_x, last_y = x[last], values[rows, last]
+    edges = np.linspace(1, m - 1, points - 1).astype(int)
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if lo >= hi:
+            continue
+        next_lo, next_hi = (hi, edges[i + 2]) if i + 2 < len(edges) else (m - 1, m)
+        mask = present[:, next_lo:next_hi]
+        count = mask.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cx = np.where(mask, x[next_lo:next_hi], 0).sum(axis=1) / count
+            cy = np.where(mask, values[:, next_lo:next_hi], 0).sum(axis=1) / count
+        cx = np.where(count > 0, cx, last_x)
+        cy = np.where(count > 0, cy, last_y)
+
+        bx, by = x[lo:hi], values[:, lo:hi]
+        area = np.abs((ax - cx)[:, None] * (by - ay[:, None]) - (ax[:, None] - bx) * (cy - ay)[:, None])
+        area = np.where(present[:, lo:hi], area, -1)
+        j = area.argmax(axis=1)
+        hit = present[rows, lo + j]
+        keep[rows[hit], lo + j[hit]] = True
+        ax = np.where(hit, bx[j], ax)
+        ay = np.where(hit, by[rows, j], ay)
+    return keep
+
+
+def minmax(x, values, points):
+    """
+    分桶最小/最大值：按列均分为 points//2 个桶，每桶保留最小和最大点（尖峰不会被抹掉）
+
+    参数与返回值同 lttb
+    """
+    x, values, present = _prepare(x, values)
+    k, m = values.shape
+    if points >= m:
+        return present
+
+    rows = np.arange(k)
+    keep = np.zeros_like(present)
+    edges = np.linspace(0, m, max(int(points) // 2, 1) + 1).astype(int)
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if lo >= hi:
+            continue
+        mask = present[:, lo:hi]
+        hit = mask.any(axis=1)
+        for j in (np.where(mask, values[:, lo:hi], np.inf).argmin(axis=1),
+                  np.where(mask, values[:, lo:hi], -np.inf).argmax(axis=1)):
+            keep[rows[hit], lo + j[hit]] = True
+    return keep
+
+
+def downsample(x, values, points, method='lttb'):
+    """按 method（lttb / minmax）降采样，返回保留点的布尔掩码"""
+    if method not in METHODS:
+        raise ValueError(f"不支持的降采样方法: {method}（可选 {', '.join(METHODS)}）")
+    return (lttb if method == 'lttb' else minmax)(x, values, points)
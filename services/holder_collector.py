@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+独立Holder采集进程
+Web 进程设置 HOLDER_COLLECTOR_MODE=queue 后只负责入队和读取结果，本进程负责：
+  - 定时调度：到期任务写入持久化队列（按计划时刻去重，多个采集进程可同时运行）
+  - 消费队列：领取队列项（带租约），同代币/链的任务合并抓取，完成后确认，失败按退避重试；
+    进程崩溃时租约过期，队列项由其他采集进程重新领取
+
+用法：python -m services.holder_collector [--concurrency 4] [--once] [--no-schedule] [--compact]
+      python -m services.holder_collector --backfill TASK_ID [--days 7] [--step-hours 1]
+"""
+
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class HolderCollectorWorker:
+    """队列消费者：从 collector.jobs 领取队列项并调用 collector.run_collection_group 执行"""
+
+    def __init__(self, collector, concurrency=None, poll_seconds=None, reload_seconds=None, worker_id=None):
+        self.collector = collector
+        self.queue = collector.jobs
+        self.concurrency = concurrency or int(os.getenv('HOLDER_COLLECTOR_CONCURRENCY', 4))
+        self.poll_seconds = poll_seconds or float(os.getenv('HOLDER_COLLECTOR_POLL_SECONDS', 5))
+        self.reload_seconds = reload_seconds or float(os.getenv('HOLDER_COLLECTOR_RELOAD_SECONDS', 30))
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+        self._lock = threading.Lock()
+        self._inflight = 0
+        # 执行中的队列项：定期续租，避免执行时间超过租约后被其他进程重复领取
+        self._leased = {}
+        self.heartbeat_seconds = self.queue.lease_seconds / 3
+        self._last_heartbeat = time.monotonic()
+        self._stop_event = threading.Event()
+
+        # 监控统计
+        self.total_claimed = 0
+        self.total_acked = 0
+        self.total_failed = 0
+
+    def run(self, once=False, schedule=True):
+        """
+        主循环：定期同步任务、领取并执行队列项
+
+        once=True 时不启动定时调度，队列清空后退出
+        """
+        self.collector.queue_mode = True
+        self.collector.is_worker = True
+        if schedule and not once:
+            self.collector.start_scheduler()
+
+        logger.info(f"🚀 采集进程 {self.worker_id} 启动，并发 {self.concurrency}")
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='holder-worker')
+        last_reload = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                if time.monotonic() - last_reload >= self.reload_seconds:
+                    # 同步 Web 进程中增删改的任务，并清理旧队列项
+                    self.collector.refresh_tasks()
+                    self.queue.purge()
+                    last_reload = time.monotonic()
+
+                self._heartbeat()
+                with self._lock:
+                    free = self.concurrency - self._inflight
+                jobs = self.queue.claim(self.worker_id, limit=free) if free > 0 else []
+                if jobs:
+                    self.total_claimed += len(jobs)
+                    for group in self._group_jobs(jobs):
+                        with self._lock:
+                            self._inflight += 1
+                            self._leased.update((job['job_id'], job) for job in group)
+                        executor.submit(self._run_jobs, group)
+                    continue
+
+                with self._lock:
+                    idle = self._inflight == 0
+                if once and idle:
+                    break
+                self._stop_event.wait(min(self.poll_seconds, self.heartbeat_seconds))
+        finally:
+            executor.shutdown(wait=True)
+            self.collector.stop_scheduler()
+            logger.info(f"⏹️ 采集进程 {self.worker_id} 已停止（领取 {self.total_claimed}，完成 {self.total_acked}，失败 {self.total_failed}）")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _heartbeat(self):
+        """每隔 1/3 租约时长为执行中的队列项续租"""
+        if time.monotonic() - self._last_heartbeat < self.heartbeat_seconds:
+            return
+        self._last_heartbeat = time.monotonic()
+        with self._lock:
+            jobs = list(self._leased.values())
+        for job in jobs:
+            if not self.queue.extend(job):
+                logger.warning(f"⚠️ 队列项 {job['job_id']} 续租失败，租约已被其他进程接管")
+
+    def _group_jobs(self, jobs):
+        """同一代币/链的队列项合并为一组（只抓取一次）"""
+        groups = {}
+        for job in jobs:
+            if job['kind'] == 'backfill':
+                groups[('backfill', job['job_id'])] = [job]
+                continue
+            task = self.collector.tasks.get(job['task_id'])
+            key = self.collector._group_key(task) if task else job['task_id']
+            groups.setdefault(key, []).append(job)
+        return list(groups.values())
+
+    def _run_jobs(self, jobs):
+        task_ids = list(dict.fromkeys(job['task_id'] for job in jobs))
+        try:
+            # 执行前读取最新任务状态（可能已被 Web 进程暂停/删除，执行计数也可能由其他采集进程更新）
+            self.collector.refresh_tasks(task_ids)
+            if jobs[0]['kind'] == 'backfill':
+                result = self.collector.backfill_task(jobs[0]['task_id'], **jobs[0]['payload'])
+                if 'error' in result:
+                    raise RuntimeError(result['error'])
+            else:
+                saved = self.collector.run_collection_group(task_ids)
+                if saved == 0:
+                    # 抓取/保存失败只记录在任务上，这里转为队列项失败，走退避重试
+                    errors = {self.collector.tasks[task_id].last_error for task_id in task_ids
+                              if task_id in self.collector.tasks}
+                    raise RuntimeError('; '.join(sorted(filter(None, errors))) or '未保存任何快照')
+        except Exception as e:
+            logger.error(f"❌ 执行队列项 {task_ids} 失败: {e}")
+            for job in jobs:
+                self.queue.fail(job, e)
+            self.total_failed += len(jobs)
+        else:
+            for job in jobs:
+                if not self.queue.ack(job):
+                    logger.warning(f"⚠️ 队列项 {job['job_id']} 租约已过期，结果可能被重复采集")
+            self.total_acked += len(jobs)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                for job in jobs:
+                    self._leased.pop(job['job_id'], None)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='独立Holder采集进程')
+    parser.add_argument('--db', default='holders_snapshots.db', help='快照数据库路径')
+    parser.add_argument('--concurrency', type=int, help='同时执行的采集组数')
+    parser.add_argument('--poll', type=float, help='队列为空时的轮询间隔（秒）')
+    parser.add_argument('--once', action='store_true', help='处理完当前队列后退出（不做定时调度）')
+    parser.add_argument('--no-schedule', action='store_true', help='只消费队列，不做定时调度')
+    parser.add_argument('--compact', action='store_true', help='按保留策略降采样一次快照后退出')
+    parser.add_argument('--backfill', metavar='TASK_ID', help='回填指定任务的历史快照后退出')
+    parser.add_argument('--days', type=float, help='回填最近多少天（默认 HOLDER_BACKFILL_DAYS）')
+    parser.add_argument('--step-hours', type=float, help='回填步长（小时，默认任务采集间隔）')
+    args = parser.parse_args()
+
+    from modules.holder import HolderDataCollector
+    collector = HolderDataCollector(args.db)
+    if args.compact:
+        result = collector.compact_snapshots()
+        logger.info(f"🗜️ 降采样完成，共删除 {sum(result.values())} 个快照")
+        return True
+    if args.backfill:
+        result = collector.backfill_task(args.backfill, days=args.days, step_hours=args.step_hours)
+        return 'error' not in result
+    worker = HolderCollectorWorker(collector, concurrency=args.concurrency, poll_seconds=args.poll)
+
+    def handle_signal(signum, frame):
+        logger.info(f"🛑 收到信号 {signum}，等待执行中的任务完成后退出")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    try:
+        worker.run(once=args.once, schedule=not args.no_schedule)
+        return True
+    except Exception as e:
+        logger.error(f"❌ 采集进程异常退出: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    logging.basicConfig(level=logging.INFO)
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,192 @@
+"""
+持久化任务队列（SQLite）
+采集任务以行的形式存入数据库：消费者领取（claim）时获得带过期时间的租约，完成后确认（ack），
+失败按退避重新排队；进程崩溃时租约过期，任务自动被其他消费者重新领取。
+多个采集进程可以同时消费同一个数据库中的队列
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """采集任务队列（基于 SQLiteConnectionManager，多进程安全）"""
+
+    def __init__(self, db):
+        self.db = db
+        self.lease_seconds = float(os.getenv('HOLDER_JOB_LEASE_SECONDS', 600))
+        self.max_attempts = int(os.getenv('HOLDER_JOB_MAX_ATTEMPTS', 3))
+        self.retry_delay = float(os.getenv('HOLDER_JOB_RETRY_SECONDS', 60))
+
+    @staticmethod
+    def create_tables(cursor):
+        """创建队列表"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS collection_jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT,
+                dedup_key TEXT UNIQUE,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_collection_jobs_status
+            ON collection_jobs (status, available_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_collection_jobs_task
+            ON collection_jobs (task_id, status)
+        ''')
+
+    def enqueue(self, task_id, kind='collect', payload=None, dedup_key=None, delay=0, max_attempts=None):
+        """
+        入队，返回 job_id；dedup_key 已存在时不重复入队，返回 None
+
+        dedup_key 在表内永久唯一（例如定时任务用 '任务ID@执行时刻'，多个调度进程只会入队一次）
+        """
+        now = time.time()
+        with self.db.writer() as conn:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO collection_jobs
+                (task_id, kind, payload, dedup_key, status, max_attempts, available_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (task_id, kind, json.dumps(payload or {}, ensure_ascii=False), dedup_key, QUEUED,
+                  max_attempts or self.max_attempts, now + delay, now, now))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def has_pending(self, task_id):
+        """任务是否已有排队中或执行中的队列项"""
+        with self.db.reader() as conn:
+            return conn.execute(
+                "SELECT 1 FROM collection_jobs WHERE task_id = ? AND status IN (?, ?) LIMIT 1",
+                (task_id, QUEUED, LEASED)
+            ).fetchone() is not None
+
+    def claim(self, owner, limit=1, lease_seconds=None):
+        """
+        领取最多 limit 个可执行的队列项（排队中且已到时间，或租约已过期），返回 dict 列表
+
+        单条 UPDATE 完成选择与加锁，多个进程同时领取不会拿到同一项；
+        租约过期且已用完尝试次数的队列项（例如每次执行都导致进程崩溃）标记为失败，不再领取
+        """
+        now = time.time()
+        lease_token = f"{owner}:{uuid.uuid4().hex[:8]}"
+        with self.db.writer() as conn:
+            expired = conn.execute('''
+                UPDATE collection_jobs
+                SET status = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?,
+                    last_error = '租约过期（执行进程可能已崩溃），已达最大尝试次数'
+                WHERE status = ? AND lease_expires <= ? AND attempts >= max_attempts
+            ''', (FAILED, now, LEASED, now)).rowcount
+            if expired:
+                logger.error(f"❌ {expired} 个队列项租约过期且已达最大尝试次数，标记为失败")
+            conn.execute('''
+                UPDATE collection_jobs
+                SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?
+                WHERE job_id IN (
+                    SELECT job_id FROM collection_jobs
+                    WHERE (status = ? AND available_at <= ?)
+                       OR (status = ? AND lease_expires <= ? AND attempts < max_attempts)
+                    ORDER BY available_at, job_id
+                    LIMIT ?
+                )
+            ''', (LEASED, lease_token, now + (lease_seconds or self.lease_seconds), now,
+                  QUEUED, now, LEASED, now, limit))
+            rows = conn.execute('''
+                SELECT job_id, task_id, kind, payload, attempts, max_attempts, lease_owner
+                FROM collection_jobs WHERE lease_owner = ? AND status = ?
+            ''', (lease_token, LEASED)).fetchall()
+
+        columns = ['job_id', 'task_id', 'kind', 'payload', 'attempts', 'max_attempts', 'lease_owner']
+        jobs = [dict(zip(columns, row)) for row in rows]
+        for job in jobs:
+            job['payload'] = json.loads(job['payload'] or '{}')
+        return jobs
+
+    def extend(self, job, lease_seconds=None):
+        """延长租约（执行中的队列项由采集进程定期调用）；租约已被他人接管时返回 False"""
+        with self.db.writer() as conn:
+            cursor = conn.execute('''
+                UPDATE collection_jobs SET lease_expires = ?, updated_at = ?
+                WHERE job_id = ? AND lease_owner = ? AND status = ?
+            ''', (time.time() + (lease_seconds or self.lease_seconds), time.time(),
+                  job['job_id'], job['lease_owner'], LEASED))
+            return cursor.rowcount > 0
+
+    def ack(self, job):
+        """确认完成；租约已被他人接管时返回 False"""
+        with self.db.writer() as conn:
+            cursor = conn.execute('''
+                UPDATE collection_jobs SET status = ?, lease_expires = NULL, updated_at = ?, last_error = NULL
+                WHERE job_id = ? AND lease_owner = ? AND status = ?
+            ''', (DONE, time.time(), job['job_id'], job['lease_owner'], LEASED))
+            return cursor.rowcount > 0
+
+    def fail(self, job, error):
+        """标记失败：未超过最大尝试次数时按指数退避重新排队"""
+        now = time.time()
+        retry = job['attempts'] < job['max_attempts']
+        delay = self.retry_delay * (2 ** (job['attempts'] - 1))
+        with self.db.writer() as conn:
+            cursor = conn.execute('''
+                UPDATE collection_jobs
+                SET status = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL,
+                    updated_at = ?, last_error = ?
+                WHERE job_id = ? AND lease_owner = ? AND status = ?
+            ''', (QUEUED if retry else FAILED, now + delay, now, str(error)[:1000],
+                  job['job_id'], job['lease_owner'], LEASED))
+        if retry:
+            logger.warning(f"⚠️ 队列项 {job['job_id']}（{job['task_id']}）失败，{delay:.0f}s 后重试: {error}")
+        else:
+            logger.error(f"❌ 队列项 {job['job_id']}（{job['task_id']}）已达最大尝试次数: {error}")
+        return cursor.rowcount > 0
+
+    def purge(self, older_than_seconds=7 * 86400):
+        """清理已完成/已失败的旧队列项，返回删除数量"""
+        with self.db.writer() as conn:
+            cursor = conn.execute(
+                "DELETE FROM collection_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - older_than_seconds)
+            )
+            return cursor.rowcount
+
+    def get_stats(self):
+        """各状态的队列项数量及最早排队时间"""
+        now = time.time()
+        with self.db.reader() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM collection_jobs GROUP BY status").fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(available_at) FROM collection_jobs WHERE status = ? AND available_at <= ?",
+                (QUEUED, now)
+            ).fetchone()[0]
+            expired = conn.execute(
+                "SELECT COUNT(*) FROM collection_jobs WHERE status = ? AND lease_expires <= ?", (LEASED, now)
+            ).fetchone()[0]
+        return {
+            'queued': counts.get(QUEUED, 0),
+            'leased': counts.get(LEASED, 0),
+            'done': counts.get(DONE, 0),
+            'failed': counts.get(FAILED, 0),
+            'expired_leases': expired,
+            'oldest_wait_seconds': round(now - oldest, 1) if oldest else 0.0
+        }
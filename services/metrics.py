@@ -0,0 +1,217 @@
+"""
+上游调用统计
+按接口记录延迟直方图、状态码/429/超时次数、重试次数、响应字节数和缓存命中情况，
+可导出为JSON（/metrics）或 Prometheus 文本格式（/metrics?format=prometheus）
+"""
+
+import re
+import json
+import time
+import threading
+import logging
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+# 路径中的地址/ID段（如 Helius /v0/addresses/<地址>/transactions）归一化，避免接口数量无限增长
+_ID_SEGMENT = re.compile(r'^(\d+|0x[0-9a-fA-F]+|[1-9A-HJ-NP-Za-km-z]{24,})$')
+
+
+def endpoint_name(url):
+    """接口名：主机 + 归一化路径"""
+    parsed = urlparse(url)
+    segments = ['{id}' if _ID_SEGMENT.match(seg) else seg for seg in parsed.path.split('/')]
+    return f"{parsed.netloc.lower()}{'/'.join(segments)}"
+
+
+def classify_error(error):
+    """异常分类"""
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.RetryError):
+        return 'retries_exhausted'
+    if isinstance(error, requests.exceptions.SSLError):
+        return 'ssl'
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return 'connection'
+    return 'other'
+
+
+class EndpointMetrics:
+    """单个接口的统计（由 MetricsRegistry 加锁访问）"""
+
+    def __init__(self):
+        self.requests = 0
+        self.status_codes = {}
+        self.errors = {}
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.bytes_received = 0
+        self.adapter_retries = 0   # urllib3 适配器层重试（429/5xx/连接错误）
+        self.app_retries = 0       # fetch_data_robust 应用层重试
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.circuit_rejected = 0
+
+    def observe_latency(self, seconds):
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+                break
+
+    def percentile(self, q):
+        """按直方图估算分位数（返回所在桶的上限，不超过实际最大值）"""
+        total = sum(self.latency_buckets)
+        if not total:
+            return None
+        threshold = q * total
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets):
+            cumulative += count
+            if cumulative >= threshold:
+                return min(bound, self.latency_max)
+        return self.latency_max
+
+    def to_dict(self):
+        observed = sum(self.latency_buckets)
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'requests': self.requests,
+            'status_codes': dict(self.status_codes),
+            'rate_limited_429': self.status_codes.get('429', 0),
+            'errors': dict(self.errors),
+            'adapter_retries': self.adapter_retries,
+            'app_retries': self.app_retries,
+            'latency': {
+                'avg_ms': round(self.latency_sum / observed * 1000, 1) if observed else None,
+                'p50_ms': round(self.percentile(0.5) * 1000, 1) if observed else None,
+                'p95_ms': round(self.percentile(0.95) * 1000, 1) if observed else None,
+                'max_ms': round(self.latency_max * 1000, 1),
+                'total_seconds': round(self.latency_sum, 3),
+                'buckets': {
+                    ('+Inf' if bound == float('inf') else f"{bound}"): count
+                    for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)
+                }
+            },
+            'bytes_received': self.bytes_received,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_hit_ratio': round(self.cache_hits / lookups, 3) if lookups else None,
+            'circuit_rejected': self.circuit_rejected
+        }
+
+
+class MetricsRegistry:
+    """进程内上游调用统计注册表（线程安全）"""
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _get(self, url):
+        name = endpoint_name(url)
+        metrics = self._endpoints.get(name)
+        if metrics is None:
+            metrics = self._endpoints[name] = EndpointMetrics()
+        return metrics
+
+    def observe_request(self, url, seconds, response=None, error=None):
+        """记录一次实际的上游HTTP请求（由 HttpClientRegistry 调用）"""
+        adapter_retries = 0
+        size = 0
+        if response is not None:
+            retries = getattr(response.raw, 'retries', None)
+            adapter_retries = len(getattr(retries, 'history', ()) or ())
+            size = len(response.content or b'')
+
+        with self._lock:
+            metrics = self._get(url)
+            metrics.requests += 1
+            metrics.observe_latency(seconds)
+            metrics.adapter_retries += adapter_retries
+            metrics.bytes_received += size
+            if response is not None:
+                code = str(response.status_code)
+                metrics.status_codes[code] = metrics.status_codes.get(code, 0) + 1
+            if error is not None:
+                kind = classify_error(error)
+                metrics.errors[kind] = metrics.errors.get(kind, 0) + 1
+
+    def increment(self, url, field, amount=1):
+        """累加计数字段（app_retries / cache_hits / cache_misses / circuit_rejected）"""
+        with self._lock:
+            metrics = self._get(url)
+            setattr(metrics, field, getattr(metrics, field) + amount)
+
+    def snapshot(self):
+        """导出全部统计（按总耗时降序，最占延迟的接口排在前面）"""
+        with self._lock:
+            endpoints = {name: m.to_dict() for name, m in self._endpoints.items()}
+        ordered = dict(sorted(endpoints.items(), key=lambda kv: kv[1]['latency']['total_seconds'], reverse=True))
+        return {
+            'since': int(self.started_at),
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'endpoints': ordered
+        }
+
+    def dump_json(self, path):
+        """写入JSON文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        logger.info(f"📊 上游调用统计已写入: {path}")
+
+    def to_prometheus(self):
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            items = list(self._endpoints.items())
+            for name, m in items:
+                label = f'endpoint="{name}"'
+                lines.append(f'upstream_requests_total{{{label}}} {m.requests}')
+                for code, count in m.status_codes.items():
+                    lines.append(f'upstream_responses_total{{{label},code="{code}"}} {count}')
+                for kind, count in m.errors.items():
+                    lines.append(f'upstream_errors_total{{{label},kind="{kind}"}} {count}')
+                lines.append(f'upstream_adapter_retries_total{{{label}}} {m.adapter_retries}')
+                lines.append(f'upstream_app_retries_total{{{label}}} {m.app_retries}')
+                lines.append(f'upstream_bytes_received_total{{{label}}} {m.bytes_received}')
+                lines.append(f'upstream_cache_hits_total{{{label}}} {m.cache_hits}')
+                lines.append(f'upstream_cache_misses_total{{{label}}} {m.cache_misses}')
+                lines.append(f'upstream_circuit_rejected_total{{{label}}} {m.circuit_rejected}')
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, m.latency_buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'upstream_latency_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f'upstream_latency_seconds_sum{{{label}}} {m.latency_sum:.6f}')
+                lines.append(f'upstream_latency_seconds_count{{{label}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self.started_at = time.time()
+
+
+# 全局实例
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """获取全局统计注册表（单例模式）"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = MetricsRegistry()
+    return _metrics
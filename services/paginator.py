@@ -0,0 +1,55 @@
+"""
+offset分页接口的并发翻页器
+offset 事先可知，因此按窗口并发请求多页（请求节奏仍受全局限流器和AIMD并发控制约束），
+按页序拼接结果，遇到短页/空页/失败页即停止
+"""
+
+import os
+import math
+import logging
+
+from services.async_fetcher import map_concurrently
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_offset_pages(fetch_page, page_size, max_items=None, max_pages=20, concurrency=None, start_offset=0):
+    """
+    并发获取offset分页数据
+
+    Args:
+        fetch_page: 单页获取函数 fetch_page(offset) -> List，失败返回 None
+        page_size: 每页条数（返回条数小于该值视为最后一页）
+        max_items: 最多获取的条数（None 表示只受 max_pages 限制）
+        max_pages: 最多请求的页数
+        concurrency: 每个窗口并发请求的页数，默认 PAGINATOR_CONCURRENCY（4）
+        start_offset: 起始offset
+
+    Returns:
+        List: 按页序拼接的结果（不超过 max_items 条）
+    """
+    total_pages = max_pages
+    if max_items is not None:
+        total_pages = min(max_pages, math.ceil(max_items / page_size))
+    concurrency = concurrency or int(os.getenv('PAGINATOR_CONCURRENCY', 4))
+
+    items = []
+    page = 0
+    finished = False
+    while page < total_pages and not finished:
+        window = min(concurrency, total_pages - page)
+        offsets = [start_offset + (page + i) * page_size for i in range(window)]
+        if window > 1:
+            logger.info(f"📑 并发获取第 {page + 1}-{page + window} 页")
+        results = map_concurrently(fetch_page, offsets, max_concurrency=window)
+
+        for result in results:
+            page += 1
+            if result:
+                items.extend(result)
+            if not result or len(result) < page_size:
+                # 失败/空页/短页即为最后一页，同一窗口中之后的页丢弃（无法保证连续）
+                finished = True
+                break
+
+    return items if max_items is None else items[:max_items]
@@ -0,0 +1,159 @@
+"""
+上游API限流器
+按主机/接口路径维护令牌桶，进程内所有线程（Flask请求、并发请求池、Holder定时采集）共享，
+替代各模块中写死的 time.sleep 间隔
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 默认限流规则: key 为主机名或 "主机名/路径前缀"，值为 (每秒速率, 突发容量)
+# 可通过环境变量 RATE_LIMITS 覆盖/追加，例如:
+#   RATE_LIMITS='{"web3.okx.com": [6, 12], "web3.okx.com/priapi/v1/dx/market/v2/pnl/wallet-profile": [3, 6]}'
+DEFAULT_RATE_LIMITS = {
+    'www.okx.com': (4.0, 8),
+    'web3.okx.com': (4.0, 8),
+    'api.helius.xyz': (10.0, 10),
+    'api.coingecko.com': (0.5, 5),  # 免费版约30次/分钟
+}
+
+
+class TokenBucket:
+    """线程安全的令牌桶（预约式：令牌不足时先扣减再等待，保证先到先得且速率精确）"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        # 监控统计
+        self.total_acquired = 0
+        self.total_waited = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def reserve(self, tokens=1):
+        """预约令牌，返回需要等待的秒数（不阻塞）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+            self.total_acquired += 1
+            if wait > 0:
+                self.total_waited += 1
+                self.total_wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            return wait
+
+    def acquire(self, tokens=1):
+        """获取令牌，必要时阻塞等待；返回实际等待秒数"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def get_status(self):
+        """获取当前令牌水位和等待统计"""
+        with self._lock:
+            self._refill(time.monotonic())
+            tokens = self._tokens
+        return {
+            'rate_per_second': self.rate,
+            'burst': self.burst,
+            'available_tokens': round(max(tokens, 0.0), 2),
+            # 令牌为负表示已有请求排队，新请求需要等待的时间
+            'current_wait_seconds': round(-tokens / self.rate, 3) if tokens < 0 else 0.0,
+            'total_acquired': self.total_acquired,
+            'total_waited': self.total_waited,
+            'total_wait_seconds': round(self.total_wait_seconds, 3),
+            'avg_wait_seconds': round(self.total_wait_seconds / self.total_waited, 3) if self.total_waited else 0.0,
+            'max_wait_seconds': round(self.max_wait_seconds, 3)
+        }
+
+
+class RateLimiter:
+    """按主机/接口路由到令牌桶的限流器"""
+
+    def __init__(self, rules=None):
+        self.rules = dict(DEFAULT_RATE_LIMITS)
+        env_rules = os.getenv('RATE_LIMITS')
+        if env_rules:
+            try:
+                for key, (rate, burst) in json.loads(env_rules).items():
+                    self.rules[key] = (float(rate), burst)
+            except Exception as e:
+                logger.error(f"❌ RATE_LIMITS 配置解析失败，使用默认规则: {e}")
+        if rules:
+            self.rules.update(rules)
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def resolve_key(self, url):
+        """找到URL对应的限流规则key（最长前缀匹配），无匹配返回None"""
+        parsed = urlparse(url)
+        target = f"{parsed.netloc.lower()}{parsed.path}"
+        best = None
+        for key in self.rules:
+            if target == key or target.startswith(key.rstrip('/') + '/'):
+                if best is None or len(key) > len(best):
+                    best = key
+        return best
+
+    def get_bucket(self, key):
+        """获取（或创建）指定规则的令牌桶"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    rate, burst = self.rules[key]
+                    bucket = TokenBucket(rate, burst)
+                    self._buckets[key] = bucket
+        return bucket
+
+    def acquire(self, url, tokens=1):
+        """请求前调用：按URL所属规则获取令牌，返回等待秒数；无规则的URL不限流"""
+        key = self.resolve_key(url)
+        if key is None:
+            return 0.0
+        wait = self.get_bucket(key).acquire(tokens)
+        if wait > 0.5:
+            logger.info(f"⏳ 限流等待 {wait:.2f}s: {key}")
+        return wait
+
+    def get_status(self):
+        """获取所有令牌桶状态（供监控使用）"""
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {key: bucket.get_status() for key, bucket in buckets.items()}
+
+
+# 全局限流器实例
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """获取全局限流器实例（单例模式）"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
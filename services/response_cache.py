@@ -0,0 +1,299 @@
+"""
+上游API响应持久化缓存
+基于SQLite，缓存键由URL和归一化后的参数组成（忽略 t 等防缓存参数），
+按接口设置TTL，超出容量时按最近访问时间（LRU）淘汰
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 参与缓存键计算时忽略的参数（OKX接口的防缓存时间戳）
+VOLATILE_PARAMS = {'t'}
+
+# 各接口缓存时间（秒），key 为 "主机/路径前缀"，最长前缀匹配；未匹配的接口不缓存
+# （持仓排行 holders/ranking-list 用于快照采集，必须取实时数据，故不在此列）
+# 可通过环境变量 RESPONSE_CACHE_TTLS 覆盖/追加（JSON格式）
+DEFAULT_CACHE_TTLS = {
+    'web3.okx.com/priapi/v1/dx/market/v2/pnl/token-list': 600,
+    'web3.okx.com/priapi/v1/dx/market/v2/pnl/wallet-profile/summary': 600,
+    'web3.okx.com/priapi/v1/dx/market/v2/pnl/top-trader/ranking-list': 300,
+    'web3.okx.com/priapi/v1/dx/market/v2/pnl/trading-history': 300,
+    'api.coingecko.com/api/v3/coins': 86400,  # 历史价格不会变化
+}
+
+
+def normalize_params(params):
+    """去掉防缓存参数并排序，得到稳定的参数表示"""
+    if not params:
+        return {}
+    return {str(k): str(v) for k, v in sorted(params.items()) if k not in VOLATILE_PARAMS}
+
+
+# 命中时的最近访问时间先记在内存，攒够条数或间隔后批量写回（LRU淘汰前也会写回）
+ACCESS_FLUSH_ROWS = 256
+ACCESS_FLUSH_SECONDS = 30
+
+# OKX "无数据/不支持" 类错误码，做短期负缓存
+NO_DATA_CODES = {'100'}
+
+
+def is_no_data_response(data):
+    """“无数据”响应：code 100，或 data 为空/其中的列表全为空（死币、无交易的钱包等）"""
+    if not isinstance(data, dict) or 'code' not in data:
+        return False
+    code = str(data.get('code'))
+    if code in NO_DATA_CODES:
+        return True
+    if code != '0':
+        return False
+    payload = data.get('data')
+    if not payload:
+        return True
+    if isinstance(payload, dict):
+        lists = [v for v in payload.values() if isinstance(v, list)]
+        return bool(lists) and not any(lists)
+    return False
+
+
+def is_cacheable(data):
+    """只缓存成功响应：OKX接口返回 code != 0 的错误结果不缓存"""
+    if data is None:
+        return False
+    if isinstance(data, dict) and 'code' in data:
+        return str(data.get('code')) == '0'
+    return True
+
+
+def make_cache_key(url, params):
+    """由URL和归一化参数生成缓存键"""
+    raw = json.dumps([url, normalize_params(params)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """SQLite持久化的响应缓存（线程安全）"""
+
+    def __init__(self, db_path=None, max_bytes=None, ttls=None):
+        self.db_path = db_path or os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db')
+        self.max_bytes = max_bytes or int(float(os.getenv('RESPONSE_CACHE_MAX_MB', 64)) * 1024 * 1024)
+        self.enabled = os.getenv('ENABLE_RESPONSE_CACHE', 'True').lower() == 'true'
+        # “无数据”响应的短期负缓存时间（秒），不超过接口TTL；TTL为0的实时接口（持币排行、分页等）不做负缓存
+        self.negative_ttl = int(os.getenv('RESPONSE_CACHE_NEGATIVE_TTL', 120))
+
+        self.ttls = dict(DEFAULT_CACHE_TTLS)
+        env_ttls = os.getenv('RESPONSE_CACHE_TTLS')
+        if env_ttls:
+            try:
+                self.ttls.update({k: int(v) for k, v in json.loads(env_ttls).items()})
+            except Exception as e:
+                logger.error(f"❌ RESPONSE_CACHE_TTLS 配置解析失败，使用默认TTL: {e}")
+        if ttls:
+            self.ttls.update(ttls)
+
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.negative_stores = 0
+        self.evictions = 0
+
+        # cache_key -> 最近命中时间（尚未写回数据库）
+        self._pending_access = {}
+        self._last_flush = time.time()
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._init_database()
+
+    def _init_database(self):
+        """初始化缓存表"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_response_cache_access
+                ON response_cache (last_access)
+            ''')
+            self._conn.commit()
+
+    def get_ttl(self, url):
+        """获取URL对应的缓存时间（秒），0表示不缓存"""
+        parsed = urlparse(url)
+        target = f"{parsed.netloc.lower()}{parsed.path}"
+        best = None
+        for key in self.ttls:
+            if target.startswith(key) and (best is None or len(key) > len(best)):
+                best = key
+        return self.ttls[best] if best else 0
+
+    def get(self, url, params=None):
+        """
+        查询缓存（含负缓存），未命中或已过期返回 None
+
+        TTL为0的接口不会有缓存条目，直接返回、不访问数据库；
+        命中时只在内存中记录访问时间，按批写回，查询路径上不提交事务
+        """
+        if not self.enabled or self.get_ttl(url) <= 0:
+            return None
+
+        key = make_cache_key(url, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires_at FROM response_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+
+            if row is None or row[1] < now:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._pending_access[key] = now
+            if len(self._pending_access) >= ACCESS_FLUSH_ROWS or now - self._last_flush >= ACCESS_FLUSH_SECONDS:
+                self._flush_access()
+                self._conn.commit()
+
+        return json.loads(row[0])
+
+    def _flush_access(self):
+        """把内存中的最近访问时间写回数据库（调用方持有锁并负责提交）"""
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE response_cache SET last_access = ? WHERE cache_key = ?",
+                [(accessed, key) for key, accessed in self._pending_access.items()]
+            )
+            self._pending_access.clear()
+        self._last_flush = time.time()
+
+    def set(self, url, params, data, ttl=None):
+        """
+        写入缓存：成功响应按接口TTL缓存，“无数据”响应按负缓存TTL缓存（不超过接口TTL）
+
+        TTL为0的接口不缓存任何响应：例如持币排行列表的缓存键不含时间戳，
+        分页越界的空页若被负缓存，窗口期内的手动采集会被截断
+        """
+        if not self.enabled or data is None:
+            return
+
+        negative = False
+        if ttl is None:
+            endpoint_ttl = self.get_ttl(url)
+            if is_no_data_response(data):
+                negative = True
+                ttl = min(endpoint_ttl, self.negative_ttl)
+            elif is_cacheable(data):
+                ttl = endpoint_ttl
+            else:
+                return
+        if ttl <= 0:
+            return
+
+        body = json.dumps(data, ensure_ascii=False)
+        size = len(body.encode('utf-8'))
+        if size > self.max_bytes // 10:
+            return  # 单条过大的响应不缓存，避免挤掉其他条目
+
+        key = make_cache_key(url, params)
+        parsed = urlparse(url)
+        now = time.time()
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO response_cache
+                (cache_key, endpoint, body, size, created_at, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (key, f"{parsed.netloc}{parsed.path}", body, size, now, now + ttl, now))
+            self.stores += 1
+            if negative:
+                self.negative_stores += 1
+            self._evict_if_needed()
+            self._conn.commit()
+
+    def _evict_if_needed(self):
+        """超过容量上限时，先删过期条目，再按LRU删除到上限的90%（调用方持有锁）"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        cursor = self._conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+        self.evictions += cursor.rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+
+        target = int(self.max_bytes * 0.9)
+        if total <= target:
+            return
+
+        # 按最新的访问时间淘汰
+        self._flush_access()
+        freed = 0
+        victims = []
+        for cache_key, size in self._conn.execute(
+            "SELECT cache_key, size FROM response_cache ORDER BY last_access ASC"
+        ):
+            victims.append((cache_key,))
+            freed += size
+            if total - freed <= target:
+                break
+        self._conn.executemany("DELETE FROM response_cache WHERE cache_key = ?", victims)
+        self.evictions += len(victims)
+        logger.info(f"🧹 响应缓存LRU淘汰 {len(victims)} 条，释放 {freed / 1024:.0f}KB")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._pending_access.clear()
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': count,
+            'size_mb': round(total / 1024 / 1024, 2),
+            'max_size_mb': round(self.max_bytes / 1024 / 1024, 2),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            'stores': self.stores,
+            'negative_stores': self.negative_stores,
+            'evictions': self.evictions
+        }
+
+
+# 全局缓存实例
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """获取全局响应缓存实例（单例模式）"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+    return _response_cache
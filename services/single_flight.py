@@ -0,0 +1,96 @@
+"""
+单飞（single-flight）请求合并
+同一时刻对同一上游接口+参数的多个请求只发出一次，其余调用方等待并共享结果
+（例如多人同时查询同一热门代币，或Holder定时采集与用户查询撞车）
+"""
+
+import copy
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """一次在途调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按key合并并发调用（线程安全）"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        # 监控统计
+        self.executed = 0   # 实际执行次数
+        self.coalesced = 0  # 被合并（未发出请求）的次数
+
+    def do(self, key, func):
+        """
+        执行 func()；若已有相同key的调用在途，则等待其完成并返回同一结果
+
+        Returns:
+            func 的返回值（等待方拿到的是深拷贝，互相修改不影响）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            if call.waiters:
+                logger.info(f"🔗 合并了 {call.waiters} 个相同的并发请求")
+            call.event.set()
+
+    def get_stats(self):
+        """获取合并统计"""
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            'in_flight': in_flight,
+            'executed': self.executed,
+            'coalesced': self.coalesced
+        }
+
+
+# 全局实例
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """获取全局单飞实例（单例模式）"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
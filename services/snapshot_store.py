@@ -0,0 +1,1203 @@
+"""
+Holder快照的增量（delta）存储
+每隔若干次采集保存一个完整关键帧，其余快照只保存相对上一次快照新进/变化/退出的地址，
+读取时从关键帧开始依次应用增量，按需还原任意时间点的完整快照
+
+表结构（规范化）:
+    addresses      地址字典表，持仓地址和代币地址都以整数ID引用
+    snapshot_meta  每次快照一行：任务、代币ID、时间（epoch秒）、所属关键帧、持仓数
+    snapshot_rows  快照行（WITHOUT ROWID，主键 (snapshot_id, address_id)），余额/占比为数值列
+    holder_stats   每个 (任务, 前N名档位, 地址) 的累计统计，随快照写入增量更新
+"""
+
+import os
+import math
+import time
+import heapq
+import datetime
+import logging
+
+import numpy as np
+import pandas as pd
+
+from services.downsample import downsample
+
+logger = logging.getLogger(__name__)
+
+# 增量行类型
+ROW_SET = 0      # 关键帧行 / 新进 / 持仓变化
+ROW_EXITED = 1   # 退出前N名
+
+# 增量超过本次持仓数的该比例时直接存关键帧（还原更快，空间也不更大）
+KEYFRAME_DELTA_RATIO = 0.5
+
+# SQLite IN (...) 参数个数上限内的分批大小
+_IN_CHUNK = 500
+
+
+def to_epoch(value):
+    """datetime / 'YYYY-MM-DD HH:MM:SS[.ffffff]' / 数字 -> epoch秒（本地时间）"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+def format_epoch(ts):
+    """epoch秒 -> 'YYYY-MM-DD HH:MM:SS'（本地时间）"""
+    return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def to_number(value):
+    """余额等数值字段：空值、NaN 和无法解析的文本存为 NULL"""
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _values(balance, percentage, value_usd):
+    """
+    用于比对是否变化的值（排名不参与比对：一个地址进出会使其后所有排名整体移动）
+
+    NaN 统一为 None（NaN 不等于自身，会让每个增量都把该行当作变化重新存储）
+    """
+    return (
+        to_number(balance),
+        to_number(percentage),
+        to_number(value_usd) or 0.0
+    )
+
+
+def _rank_key(item):
+    """排名规则：占比降序（无占比按0），同占比按存储的排名，再按地址（保证与增量的应用顺序无关）"""
+    key, values = item
+    percentage = values[1]
+    return (0.0 if percentage is None else -percentage), values[3], key
+
+
+def rank_rows(state):
+    """把 {key: (balance, percentage, value_usd, rank)} 还原为按排名排序的行列表"""
+    ordered = sorted(state.items(), key=_rank_key)
+    return [
+        {
+            'holder_address': key,
+            'balance': balance,
+            'percentage': percentage,
+            'rank_position': rank,
+            'value_usd': value_usd
+        }
+        for rank, (key, (balance, percentage, value_usd, _)) in enumerate(ordered, 1)
+    ]
+
+
+# 每个地址的累计统计字段（holder_stats 表列，也是 matrix_stats 的输出列）
+STATS_COLUMNS = ['first_seen', 'last_seen', 'snapshot_count', 'rank_min', 'rank_max', 'rank_sum',
+                 'percentage_sum', 'first_rank', 'first_percentage', 'last_rank', 'last_percentage',
+                 'last_balance', 'last_value_usd']
+
+
+def matrix_stats(matrix, top_n):
+    """
+    从 load_matrix 的结果计算每个地址在前top_n中的累计统计（与 holder_stats 表同口径）
+
+    Returns:
+        DataFrame: address + STATS_COLUMNS，只包含曾进入前top_n的地址
+    """
+    in_top = matrix['rank'] <= top_n
+    seen = in_top.any(axis=1)
+    in_top = in_top[seen]
+    ranks = np.where(in_top, matrix['rank'][seen], np.nan)
+    percentages = np.where(in_top, np.nan_to_num(matrix['percentage'][seen]), np.nan)
+    rows = np.arange(len(in_top))
+    first_idx = in_top.argmax(axis=1)
+    last_idx = in_top.shape[1] - 1 - in_top[:, ::-1].argmax(axis=1)
+    timestamps = np.array([meta['snapshot_ts'] for meta in matrix['metas']], dtype=np.int64)
+
+    return pd.DataFrame({
+        'address': matrix['addresses'][seen],
+        'first_seen': timestamps[first_idx],
+        'last_seen': timestamps[last_idx],
+        'snapshot_count': in_top.sum(axis=1),
+        'rank_min': np.nanmin(ranks, axis=1).astype(int),
+        'rank_max': np.nanmax(ranks, axis=1).astype(int),
+        'rank_sum': np.nansum(ranks, axis=1).astype(int),
+        'percentage_sum': np.nansum(percentages, axis=1),
+        'first_rank': ranks[rows, first_idx].astype(int),
+        'first_percentage': percentages[rows, first_idx],
+        'last_rank': ranks[rows, last_idx].astype(int),
+        'last_percentage': percentages[rows, last_idx],
+        'last_balance': matrix['balance'][seen][rows, last_idx],
+        'last_value_usd': np.nan_to_num(matrix['value_usd'][seen][rows, last_idx])
+    })
+
+
+def _fill_chains(chain, snapshot_ids, row_idx, n_rows, target_ids, rows, fields):
+    """
+    把增量行展开为 行 × 目标快照 矩阵：增量行即变化点，沿链前向填充
+
+    Args:
+        chain: DataFrame(snapshot_id, keyframe_id)，按 (keyframe_id, snapshot_id) 排序，
+               同一条链的快照在列上连续，关键帧列重置所有行
+        snapshot_ids / row_idx: 每条增量行所在的快照ID、所属矩阵行号
+        target_ids: 输出列对应的快照ID
+        rows: 增量行 DataFrame（含 change_type 和 fields 各列）
+    Returns:
+        (present, {field: 矩阵})，不在快照中的单元格为 False / NaN
+    """
+    columns = pd.Index(chain['snapshot_id'])
+    col_idx = columns.get_indexer(snapshot_ids)
+    shape = (n_rows, len(columns))
+
+    event = np.zeros(shape, dtype=bool)
+    event[:, (chain['snapshot_id'] == chain['keyframe_id']).to_numpy()] = True
+    event[row_idx, col_idx] = True
+    # 每个单元格取最近一次事件所在列
+    last_event = np.where(event, np.arange(shape[1]), 0)
+    np.maximum.accumulate(last_event, axis=1, out=last_event)
+    last_event = last_event[:, columns.get_indexer(target_ids)]
+
+    def fill(values, empty, dtype):
+        matrix = np.full(shape, empty, dtype=dtype)
+        matrix[row_idx, col_idx] = values
+        return np.take_along_axis(matrix, last_event, axis=1)
+
+    present = fill(rows['change_type'].to_numpy() == ROW_SET, False, bool)
+    matrices = {}
+    for field in fields:
+        matrix = fill(rows[field].to_numpy(dtype=float), np.nan, float)
+        matrix[~present] = np.nan
+        matrices[field] = matrix
+    return present, matrices
+
+
+def _sql_value(value):
+    """numpy 标量 -> SQLite 可绑定的值（NaN -> NULL）"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    return value
+
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def _parse_duration(text):
+    text = text.strip().lower()
+    if text in ('*', 'inf'):
+        return float('inf')
+    if text in ('0', 'all'):
+        return 0
+    return float(text[:-1]) * _DURATION_UNITS[text[-1]]
+
+
+def parse_retention_policy(text):
+    """
+    解析保留策略，例如 '7d=1h,90d=1d,*=1w'：
+    7天内每小时保留一个快照，7~90天每天保留一个，更早的每周保留一个（'=all' 表示全部保留）
+
+    Returns:
+        [(最大年龄秒, 分桶秒), ...]，按年龄升序；未覆盖的更早快照全部保留
+    """
+    tiers = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        age, _, bucket = part.partition('=')
+        tiers.append((_parse_duration(age), _parse_duration(bucket or 'all')))
+    return sorted(tiers)
+
+
+def retention_keep(snapshots, policy, now):
+    """
+    按保留策略选出要保留的快照ID
+
+    每个 (档位, 时间桶) 只保留收盘快照（桶内最后一个）；时间桶按本地时间对齐（天从0点开始，周从周一开始）
+
+    Args:
+        snapshots: [(snapshot_id, snapshot_ts), ...]
+        policy: parse_retention_policy 的结果
+    """
+    keep, closing = set(), {}
+    for snapshot_id, ts in snapshots:
+        age = now - ts
+        tier = next((i for i, (max_age, _) in enumerate(policy) if age < max_age), None)
+        if tier is None or policy[tier][1] == 0:
+            keep.add(snapshot_id)
+            continue
+        # 1970-01-01 是周四，偏移3天后周桶从周一开始
+        local = ts + time.localtime(ts).tm_gmtoff + 3 * 86400
+        bucket = (tier, int(local // policy[tier][1]))
+        if bucket not in closing or (ts, snapshot_id) > closing[bucket]:
+            closing[bucket] = (ts, snapshot_id)
+    keep.update(snapshot_id for _, snapshot_id in closing.values())
+    return keep
+
+
+class SnapshotStore:
+    """增量快照存储（基于 SQLiteConnectionManager）"""
+
+    def __init__(self, db):
+        self.db = db
+        mode = os.getenv('HOLDER_SNAPSHOT_STORAGE', 'delta').lower()
+        # full 模式等价于每次都是关键帧
+        self.keyframe_interval = 1 if mode == 'full' else int(os.getenv('HOLDER_KEYFRAME_INTERVAL', 24))
+        # task_id -> 最近一次快照的编码状态，避免每次写入都从数据库还原
+        self._last = {}
+        # 地址 -> address_id（地址只增不删，ID稳定）
+        self._address_ids = {}
+        # 随快照写入增量维护 holder_stats 的前N名档位（逗号分隔）
+        self.stats_tiers = tuple(sorted(
+            int(n) for n in os.getenv('HOLDER_STATS_TOP_N', '100').split(',') if n.strip()
+        ))
+
+    def _reset_caches(self):
+        """写事务回滚后缓存可能引用了未提交的ID，全部丢弃"""
+        self._last.clear()
+        self._address_ids.clear()
+
+    @staticmethod
+    def create_tables(cursor):
+        """创建规范化存储表"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS addresses (
+                address_id INTEGER PRIMARY KEY,
+                address TEXT NOT NULL UNIQUE
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_meta (
+                snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                token_id INTEGER NOT NULL REFERENCES addresses (address_id),
+                snapshot_time INTEGER NOT NULL,
+                is_keyframe INTEGER NOT NULL,
+                keyframe_id INTEGER,
+                holder_count INTEGER NOT NULL,
+                delta_rows INTEGER NOT NULL,
+                is_backfill INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # 覆盖索引：按任务+时间范围扫描不回表
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_snapshot_meta_task_time
+            ON snapshot_meta (task_id, snapshot_time, keyframe_id, holder_count)
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_rows (
+                snapshot_id INTEGER NOT NULL,
+                address_id INTEGER NOT NULL,
+                change_type INTEGER NOT NULL,
+                balance REAL,
+                percentage REAL,
+                value_usd REAL,
+                rank_position INTEGER,
+                PRIMARY KEY (snapshot_id, address_id)
+            ) WITHOUT ROWID
+        ''')
+        # 覆盖索引：单个地址的历史变化点（地址历史查询只扫描该索引，不回表）
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_snapshot_rows_address
+            ON snapshot_rows (address_id, snapshot_id, change_type, percentage, rank_position, balance, value_usd)
+        ''')
+
+        # 每个 (任务, 档位, 地址) 的累计统计，随快照写入在同一事务中更新
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS holder_stats (
+                task_id TEXT NOT NULL,
+                top_n INTEGER NOT NULL,
+                address_id INTEGER NOT NULL,
+                first_seen INTEGER NOT NULL,
+                last_seen INTEGER NOT NULL,
+                snapshot_count INTEGER NOT NULL,
+                rank_min INTEGER NOT NULL,
+                rank_max INTEGER NOT NULL,
+                rank_sum INTEGER NOT NULL,
+                percentage_sum REAL NOT NULL,
+                first_rank INTEGER NOT NULL,
+                first_percentage REAL,
+                last_rank INTEGER NOT NULL,
+                last_percentage REAL,
+                last_balance REAL,
+                last_value_usd REAL,
+                PRIMARY KEY (task_id, top_n, address_id)
+            ) WITHOUT ROWID
+        ''')
+
+
+    # ------------------------------------------------------------------ 写入
+
+    def save_snapshot(self, task_id, token_address, holders_data, snapshot_time):
+        """保存一次快照（holders_data 按排名顺序），返回 snapshot_id"""
+        try:
+            with self.db.writer() as conn:
+                return self._save(conn, task_id, token_address, holders_data, snapshot_time)
+        except Exception:
+            self._reset_caches()
+            raise
+
+    def save_backfill(self, task_id, token_address, snapshots):
+        """
+        批量写入回填的历史快照（标记 is_backfill），返回写入的快照数
+
+        snapshots 为 [(snapshot_time, holders_data), ...]；已有快照的时间点跳过。
+        回填快照按时间顺序在同一事务中写成独立的链（不接在实时采集的链上），
+        保证每条链内 snapshot_id 顺序与时间顺序一致
+        """
+        snapshots = sorted(((to_epoch(t), holders) for t, holders in snapshots if holders), key=lambda s: s[0])
+        if not snapshots:
+            return 0
+        try:
+            with self.db.writer() as conn:
+                existing = {row[0] for row in conn.execute(
+                    "SELECT snapshot_time FROM snapshot_meta WHERE task_id = ? AND snapshot_time BETWEEN ? AND ?",
+                    (task_id, snapshots[0][0], snapshots[-1][0]))}
+                chain = {}
+                saved = 0
+                for ts, holders in snapshots:
+                    if ts in existing:
+                        continue
+                    existing.add(ts)
+                    self._save(conn, task_id, token_address, holders, ts, chain=chain)
+                    saved += 1
+        except Exception:
+            self._reset_caches()
+            raise
+        logger.info(f"⏪ 回填快照: {task_id} 写入 {saved} 个")
+        return saved
+
+    def _intern(self, conn, addresses):
+        """地址 -> address_id（不存在则插入）"""
+        missing = list({a for a in addresses if a not in self._address_ids})
+        if missing:
+            conn.executemany("INSERT OR IGNORE INTO addresses (address) VALUES (?)", [(a,) for a in missing])
+            for i in range(0, len(missing), _IN_CHUNK):
+                chunk = missing[i:i + _IN_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                for address_id, address in conn.execute(
+                        f"SELECT address_id, address FROM addresses WHERE address IN ({placeholders})", chunk):
+                    self._address_ids[address] = address_id
+        return self._address_ids
+
+    def _save(self, conn, task_id, token_address, holders_data, snapshot_time, chain=None):
+        """
+        写入一次快照；chain 为空时接在任务最近一次快照之后（实时采集），
+        否则接在调用方传入的链状态之后并原地更新它（回填，标记 is_backfill）
+        """
+        # 空地址和同一快照内重复的地址（保留排名靠前的一行）直接丢弃，地址表里只有真实地址
+        state = {}
+        dropped = 0
+        for holder in holders_data:
+            address = holder.get('address', '') or ''
+            if not address or address in state:
+                dropped += 1
+                continue
+            state[address] = _values(holder.get('balance', ''), holder.get('percentage', 0),
+                                     holder.get('value_usd', 0)) + (len(state) + 1,)
+        if dropped:
+            logger.warning(f"⚠️ 快照 {task_id} 丢弃 {dropped} 行空地址或重复地址")
+
+        last = self._get_last(conn, task_id) if chain is None else (chain or None)
+        delta = None
+        if last is not None and last['chain_length'] < self.keyframe_interval:
+            delta = self._diff(last['state'], state)
+            if len(delta) > len(state) * KEYFRAME_DELTA_RATIO:
+                delta = None
+
+        is_keyframe = delta is None
+        rows = [(key,) + values + (ROW_SET,) for key, values in state.items()] if is_keyframe else delta
+        # 与还原时相同的排名规则
+        ranked = sorted(state.items(), key=_rank_key)
+        ranked = ranked[:max(self.stats_tiers, default=0)]
+        ids = self._intern(conn, [token_address] + [row[0] for row in rows] + [key for key, _ in ranked])
+
+        cursor = conn.execute('''
+            INSERT INTO snapshot_meta
+            (task_id, token_id, snapshot_time, is_keyframe, keyframe_id, holder_count, delta_rows, is_backfill)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (task_id, ids[token_address], to_epoch(snapshot_time), int(is_keyframe),
+              None if is_keyframe else last['keyframe_id'], len(state), len(rows), int(chain is not None)))
+        snapshot_id = cursor.lastrowid
+        keyframe_id = snapshot_id if is_keyframe else last['keyframe_id']
+        if is_keyframe:
+            conn.execute("UPDATE snapshot_meta SET keyframe_id = ? WHERE snapshot_id = ?", (snapshot_id, snapshot_id))
+
+        conn.executemany('''
+            INSERT INTO snapshot_rows
+            (snapshot_id, address_id, balance, percentage, value_usd, rank_position, change_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(snapshot_id, ids[row[0]]) + row[1:] for row in rows])
+        self._update_stats(conn, task_id, to_epoch(snapshot_time), ranked, ids)
+
+        encoded = {
+            'snapshot_id': snapshot_id,
+            'keyframe_id': keyframe_id,
+            'chain_length': 1 if is_keyframe else last['chain_length'] + 1,
+            'state': state
+        }
+        if chain is None:
+            self._last[task_id] = encoded
+        else:
+            chain.update(encoded)
+        kind = '关键帧' if is_keyframe else '增量'
+        logger.info(f"💾 保存快照({kind}): {task_id} 持仓 {len(state)} 条，写入 {len(rows)} 行")
+        return snapshot_id
+
+    def _update_stats(self, conn, task_id, snapshot_ts, ranked, ids):
+        """把一次快照累加进 holder_stats（与写入顺序无关：首次/最近值按时间比较）"""
+        for top_n in self.stats_tiers:
+            conn.executemany('''
+                INSERT INTO holder_stats
+                (task_id, top_n, address_id, first_seen, last_seen, snapshot_count, rank_min, rank_max,
+                 rank_sum, percentage_sum, first_rank, first_percentage, last_rank, last_percentage,
+                 last_balance, last_value_usd)
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (task_id, top_n, address_id) DO UPDATE SET
+                    snapshot_count = snapshot_count + 1,
+                    rank_min = MIN(rank_min, excluded.rank_min),
+                    rank_max = MAX(rank_max, excluded.rank_max),
+                    rank_sum = rank_sum + excluded.rank_sum,
+                    percentage_sum = percentage_sum + excluded.percentage_sum,
+                    first_rank = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_rank ELSE first_rank END,
+                    first_percentage = CASE WHEN excluded.first_seen < first_seen
+                        THEN excluded.first_percentage ELSE first_percentage END,
+                    first_seen = MIN(first_seen, excluded.first_seen),
+                    last_rank = CASE WHEN excluded.last_seen >= last_seen
+                        THEN excluded.last_rank ELSE last_rank END,
+                    last_percentage = CASE WHEN excluded.last_seen >= last_seen
+                        THEN excluded.last_percentage ELSE last_percentage END,
+                    last_balance = CASE WHEN excluded.last_seen >= last_seen
+                        THEN excluded.last_balance ELSE last_balance END,
+                    last_value_usd = CASE WHEN excluded.last_seen >= last_seen
+                        THEN excluded.last_value_usd ELSE last_value_usd END,
+                    last_seen = MAX(last_seen, excluded.last_seen)
+            ''', [
+                (task_id, top_n, ids[key], snapshot_ts, snapshot_ts, rank, rank, rank, percentage or 0,
+                 rank, percentage or 0, rank, percentage or 0, balance, value_usd)
+                for rank, (key, (balance, percentage, value_usd, _)) in enumerate(ranked[:top_n], 1)
+            ])
+
+    def rebuild_stats(self, task_id, top_n=None):
+        """从快照历史重建任务的 holder_stats（迁移、档位变更或删除快照后使用）"""
+        tiers = [top_n] if top_n is not None else list(self.stats_tiers)
+        # 持有写锁期间读取，避免重建过程中有新快照写入被漏算
+        with self.db.writer() as conn:
+            matrix = self.load_matrix(task_id)
+            for tier in tiers:
+                conn.execute("DELETE FROM holder_stats WHERE task_id = ? AND top_n = ?", (task_id, tier))
+                if matrix is None:
+                    continue
+                stats = matrix_stats(matrix, tier)
+                ids = self._intern(conn, list(stats['address']))
+                conn.executemany(f'''
+                    INSERT INTO holder_stats (task_id, top_n, address_id, {', '.join(STATS_COLUMNS)})
+                    VALUES (?, ?, ?, {', '.join('?' * len(STATS_COLUMNS))})
+                ''', [
+                    (task_id, tier, ids[row[0]]) + tuple(_sql_value(v) for v in row[1:])
+                    for row in stats[['address'] + STATS_COLUMNS].itertuples(index=False, name=None)
+                ])
+        logger.info(f"📊 已重建持仓统计: {task_id} 档位 {tiers}")
+
+    def ensure_stats(self):
+        """为缺少统计的 (任务, 档位) 重建 holder_stats"""
+        with self.db.reader() as conn:
+            task_ids = [row[0] for row in conn.execute("SELECT DISTINCT task_id FROM snapshot_meta")]
+            missing = [
+                (task_id, tier) for task_id in task_ids for tier in self.stats_tiers
+                if conn.execute("SELECT 1 FROM holder_stats WHERE task_id = ? AND top_n = ? LIMIT 1",
+                                (task_id, tier)).fetchone() is None
+            ]
+        for task_id, tier in missing:
+            self.rebuild_stats(task_id, tier)
+
+    def get_holder_stats(self, task_id, top_n):
+        """读取任务在某档位的累计统计（单次索引查询）；该档位未维护时返回 None"""
+        if top_n not in self.stats_tiers:
+            return None
+        with self.db.reader() as conn:
+            stats = pd.read_sql_query(f'''
+                SELECT a.address, {', '.join('s.' + c for c in STATS_COLUMNS)}
+                FROM holder_stats s JOIN addresses a ON a.address_id = s.address_id
+                WHERE s.task_id = ? AND s.top_n = ?
+            ''', conn, params=(task_id, top_n))
+        return stats
+
+    def get_timeline(self, task_id):
+        """任务的快照时间轴（升序 epoch秒）"""
+        with self.db.reader() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT snapshot_time FROM snapshot_meta WHERE task_id = ? ORDER BY snapshot_time", (task_id,))]
+
+    @staticmethod
+    def _resolve_snapshot(conn, task_id, snapshot_time=None, before_id=None):
+        """不晚于 snapshot_time 的最近一次快照（before_id 指定时取其前一次），返回 (id, 关键帧, 时间, 持仓数)"""
+        sql = "SELECT snapshot_id, keyframe_id, snapshot_time, holder_count FROM snapshot_meta WHERE task_id = ?"
+        params = [task_id]
+        if snapshot_time is not None:
+            sql += " AND snapshot_time <= ?"
+            params.append(to_epoch(snapshot_time))
+        if before_id is not None:
+            sql += " AND snapshot_id != ? AND snapshot_time <= (SELECT snapshot_time FROM snapshot_meta WHERE snapshot_id = ?)"
+            params += [before_id, before_id]
+        return conn.execute(sql + " ORDER BY snapshot_time DESC, snapshot_id DESC LIMIT 1", params).fetchone()
+
+    def diff_snapshots(self, task_id, from_time=None, to_time=None, top_k=20):
+        """
+        比较两个快照：新进/退出地址、排名变化、余额变化（各取前top_k）
+
+        两个快照的完整持仓都在SQL内还原（按任务索引取链内快照、按主键前缀取行，每个地址取不晚于目标快照的最后一行；
+        CROSS JOIN 固定连接顺序，避免优化器改为扫描全部任务的地址索引），
+        排名用窗口函数按与 rank_rows 相同的规则计算，只把发生变化的地址返回给 Python
+
+        Args:
+            from_time: 起始快照时间（不晚于该时间的最近一次），为空时取 to 的前一次快照
+            to_time: 结束快照时间，为空时取最新快照
+
+        Returns:
+            None（快照不足）或 dict
+        """
+        state_sql = '''
+            rows{n} AS (
+                SELECT r.address_id, r.balance, r.percentage, r.value_usd, r.rank_position, r.change_type,
+                       MAX(r.snapshot_id)
+                FROM snapshot_meta m CROSS JOIN snapshot_rows r ON r.snapshot_id = m.snapshot_id
+                WHERE m.task_id = ? AND m.keyframe_id = ? AND m.snapshot_id <= ?
+                GROUP BY r.address_id
+            ),
+            s{n} AS (
+                SELECT x.address_id, a.address, x.balance, x.percentage, x.value_usd,
+                       ROW_NUMBER() OVER (ORDER BY COALESCE(x.percentage, 0) DESC, x.rank_position, a.address) AS rnk
+                FROM rows{n} x JOIN addresses a ON a.address_id = x.address_id
+                WHERE x.change_type = {row_set}
+            )
+        '''
+        with self.db.reader() as conn:
+            target = self._resolve_snapshot(conn, task_id, to_time)
+            if target is None:
+                return None
+            if from_time is None:
+                source = self._resolve_snapshot(conn, task_id, before_id=target[0])
+            else:
+                source = self._resolve_snapshot(conn, task_id, from_time)
+            if source is None:
+                return None
+
+            changed = conn.execute(f'''
+                WITH {state_sql.format(n=1, row_set=ROW_SET)}, {state_sql.format(n=2, row_set=ROW_SET)}
+                SELECT s1.address, s1.balance, s2.balance, s1.percentage, s2.percentage,
+                       s1.value_usd, s2.value_usd, s1.rnk, s2.rnk
+                FROM s1 LEFT JOIN s2 ON s2.address_id = s1.address_id
+                WHERE s2.address_id IS NULL OR s1.rnk != s2.rnk
+                   OR s1.balance IS NOT s2.balance OR s1.percentage IS NOT s2.percentage
+                UNION ALL
+                SELECT s2.address, NULL, s2.balance, NULL, s2.percentage, NULL, s2.value_usd, NULL, s2.rnk
+                FROM s2 WHERE s2.address_id NOT IN (SELECT address_id FROM s1)
+            ''', (task_id, source[1], source[0], task_id, target[1], target[0])).fetchall()
+
+        entrants, exits, movers = [], [], []
+        for key, balance1, balance2, pct1, pct2, value1, value2, rank1, rank2 in changed:
+            if rank1 is None:
+                entrants.append({'address': key, 'balance': balance2, 'percentage': pct2,
+                                 'value_usd': value2, 'rank': rank2})
+            elif rank2 is None:
+                exits.append({'address': key, 'balance': balance1, 'percentage': pct1,
+                              'value_usd': value1, 'rank': rank1})
+            else:
+                movers.append({
+                    'address': key,
+                    'rank_from': rank1, 'rank_to': rank2, 'rank_change': rank1 - rank2,
+                    'balance_from': balance1, 'balance_to': balance2,
+                    'balance_change': (balance2 or 0) - (balance1 or 0),
+                    'percentage_change': (pct2 or 0) - (pct1 or 0)
+                })
+
+        def top(items, key, largest=False):
+            return (heapq.nlargest if largest else heapq.nsmallest)(top_k, items, key=key)
+
+        def snapshot_info(row):
+            return {'snapshot_time': format_epoch(row[2]), 'snapshot_ts': row[2], 'holder_count': row[3]}
+
+        return {
+            'task_id': task_id,
+            'from': snapshot_info(source),
+            'to': snapshot_info(target),
+            'summary': {
+                'entrants': len(entrants),
+                'exits': len(exits),
+                'rank_changed': sum(1 for m in movers if m['rank_change']),
+                'balance_changed': sum(1 for m in movers if m['balance_change']),
+                'entrant_balance': sum(e['balance'] or 0 for e in entrants),
+                'exit_balance': sum(e['balance'] or 0 for e in exits)
+            },
+            'entrants': top(entrants, lambda e: e['rank']),
+            'exits': top(exits, lambda e: e['rank']),
+            'rank_movers': top([m for m in movers if m['rank_change']], lambda m: abs(m['rank_change']), largest=True),
+            'balance_movers': top([m for m in movers if m['balance_change']], lambda m: abs(m['balance_change']),
+                                  largest=True)
+        }
+
+    @staticmethod
+    def _diff(old, new, exact=False):
+        """
+        计算增量行：(key, balance, percentage, value_usd, rank, change_type)
+
+        exact=True 时排名变化也记录（重新编码已有快照时保证还原结果逐行一致）
+        """
+        width = 4 if exact else 3
+        rows = []
+        for key, values in new.items():
+            previous = old.get(key)
+            if previous is None or previous[:width] != values[:width]:
+                rows.append((key,) + values + (ROW_SET,))
+        for key, values in old.items():
+            if key not in new:
+                rows.append((key,) + values + (ROW_EXITED,))
+        return rows
+
+    def _get_last(self, conn, task_id):
+        """获取任务最近一次快照的编码状态（缓存失效时从数据库还原）"""
+        row = conn.execute('''
+            SELECT snapshot_id, keyframe_id FROM snapshot_meta
+            WHERE task_id = ? ORDER BY snapshot_time DESC, snapshot_id DESC LIMIT 1
+        ''', (task_id,)).fetchone()
+        if row is None:
+            self._last.pop(task_id, None)
+            return None
+
+        cached = self._last.get(task_id)
+        if cached is not None and cached['snapshot_id'] == row[0]:
+            return cached
+
+        snapshot_id, keyframe_id = row
+        chain = [r[0] for r in conn.execute('''
+            SELECT snapshot_id FROM snapshot_meta
+            WHERE keyframe_id = ? AND snapshot_id <= ? ORDER BY snapshot_id
+        ''', (keyframe_id, snapshot_id))]
+        state = {}
+        for member_id in chain:
+            self._apply(state, self._load_rows(conn, member_id))
+        self._last[task_id] = {
+            'snapshot_id': snapshot_id,
+            'keyframe_id': keyframe_id,
+            'chain_length': len(chain),
+            'state': state
+        }
+        return self._last[task_id]
+
+    # ------------------------------------------------------------------ 读取
+
+    @staticmethod
+    def _load_rows(conn, snapshot_id):
+        return conn.execute('''
+            SELECT a.address, r.balance, r.percentage, r.value_usd, r.rank_position, r.change_type
+            FROM snapshot_rows r JOIN addresses a ON a.address_id = r.address_id
+            WHERE r.snapshot_id = ?
+        ''', (snapshot_id,)).fetchall()
+
+    @staticmethod
+    def _apply(state, rows):
+        for key, balance, percentage, value_usd, rank, change_type in rows:
+            if change_type == ROW_EXITED:
+                state.pop(key, None)
+            else:
+                state[key] = (balance, percentage, value_usd, rank)
+
+    def list_snapshots(self, task_id, start_time=None, end_time=None, conn=None):
+        """
+        列出任务的快照元数据（按时间升序）
+
+        start_time / end_time 可以是 datetime、时间字符串或 epoch秒；
+        返回的 snapshot_time 为 'YYYY-MM-DD HH:MM:SS'，snapshot_ts 为 epoch秒
+        """
+        sql = '''
+            SELECT m.snapshot_id, m.task_id, a.address, m.snapshot_time, m.is_keyframe,
+                   m.keyframe_id, m.holder_count, m.delta_rows
+            FROM snapshot_meta m JOIN addresses a ON a.address_id = m.token_id
+            WHERE m.task_id = ?
+        '''
+        params = [task_id]
+        if start_time is not None:
+            sql += " AND m.snapshot_time >= ?"
+            params.append(to_epoch(start_time))
+        if end_time is not None:
+            sql += " AND m.snapshot_time <= ?"
+            params.append(to_epoch(end_time))
+        sql += " ORDER BY m.snapshot_time, m.snapshot_id"
+
+        def build(rows):
+            return [
+                {
+                    'snapshot_id': snapshot_id,
+                    'task_id': task,
+                    'token_address': token_address,
+                    'snapshot_time': format_epoch(ts),
+                    'snapshot_ts': ts,
+                    'is_keyframe': bool(is_keyframe),
+                    'keyframe_id': keyframe_id,
+                    'holder_count': holder_count,
+                    'delta_rows': delta_rows
+                }
+                for snapshot_id, task, token_address, ts, is_keyframe, keyframe_id, holder_count, delta_rows in rows
+            ]
+
+        if conn is not None:
+            return build(conn.execute(sql, params))
+        with self.db.reader() as conn:
+            return build(conn.execute(sql, params))
+
+    def iter_snapshots(self, task_id, start_time=None, end_time=None):
+        """
+        按时间顺序逐个还原快照
+
+        导出的消费速度由客户端决定，读连接只在每批查询期间借用（每批读到下一个输出快照为止），
+        产出前即归还连接池，慢速下载不会占满读连接池
+
+        Yields:
+            (meta, rows): meta 为快照元数据，rows 为按排名排序的完整持仓行
+        """
+        with self.db.reader() as conn:
+            targets = self.list_snapshots(task_id, start_time, end_time, conn=conn)
+            if not targets:
+                return
+            target_ids = {meta['snapshot_id'] for meta in targets}
+            last_target = max(target_ids)
+
+            # 区间起点之前的同链快照也要回放（不输出）
+            keyframes = sorted({meta['keyframe_id'] for meta in targets})
+            placeholders = ','.join('?' * len(keyframes))
+            # 链内 snapshot_id 顺序与时间顺序一致，按时间回放即可让回填链与实时链的输出按时间交错
+            chain = conn.execute(f'''
+                SELECT snapshot_id, keyframe_id FROM snapshot_meta
+                WHERE keyframe_id IN ({placeholders}) AND snapshot_id <= ?
+                ORDER BY snapshot_time, snapshot_id
+            ''', keyframes + [last_target]).fetchall()
+        metas = {meta['snapshot_id']: meta for meta in targets}
+        chain_end = {keyframe_id: snapshot_id for snapshot_id, keyframe_id in chain}
+
+        # 只保留尚未回放完的链的状态，长区间导出时内存占用与快照数无关
+        states = {}
+        batch = []
+        for snapshot_id, keyframe_id in chain:
+            batch.append((snapshot_id, keyframe_id))
+            if snapshot_id not in target_ids:
+                continue
+            with self.db.reader() as conn:
+                loaded = [(sid, kf, self._load_rows(conn, sid)) for sid, kf in batch]
+            batch = []
+            for sid, kf, rows in loaded:
+                state = states.setdefault(kf, {})
+                self._apply(state, rows)
+                if sid == snapshot_id:
+                    yield metas[sid], rank_rows(state)
+                if chain_end[kf] == sid:
+                    del states[kf]
+
+    def load_matrix(self, task_id, start_time=None, end_time=None):
+        """
+        把快照区间还原为 地址 × 快照 矩阵（向量化：增量行即变化点，沿时间轴前向填充）
+
+        Returns:
+            None（无快照）或 dict:
+                metas       快照元数据（时间升序，对应矩阵的列）
+                addresses   地址数组（对应矩阵的行）
+                present     是否在该快照中（bool）
+                balance / percentage / value_usd   数值矩阵（不在快照中为 NaN）
+                rank        排名矩阵（按占比降序重新计算，不在快照中为 NaN）
+        """
+        with self.db.reader() as conn:
+            targets = self.list_snapshots(task_id, start_time, end_time, conn=conn)
+            if not targets:
+                return None
+            keyframes = sorted({meta['keyframe_id'] for meta in targets})
+            last_target = max(meta['snapshot_id'] for meta in targets)
+            placeholders = ','.join('?' * len(keyframes))
+
+            # 同一条链的快照在列上连续：关键帧列重置所有地址，其后增量列只记录变化点
+            chain = pd.read_sql_query(f'''
+                SELECT snapshot_id, keyframe_id FROM snapshot_meta
+                WHERE keyframe_id IN ({placeholders}) AND snapshot_id <= ?
+                ORDER BY keyframe_id, snapshot_id
+            ''', conn, params=keyframes + [last_target])
+            rows = pd.read_sql_query(f'''
+                SELECT r.snapshot_id, a.address, r.change_type, r.balance, r.percentage,
+                       r.value_usd, r.rank_position
+                FROM snapshot_meta m
+                JOIN snapshot_rows r ON r.snapshot_id = m.snapshot_id
+                JOIN addresses a ON a.address_id = r.address_id
+                WHERE m.keyframe_id IN ({placeholders}) AND m.snapshot_id <= ?
+            ''', conn, params=keyframes + [last_target])
+
+        row_idx, addresses = pd.factorize(rows['address'])
+        present, matrices = _fill_chains(
+            chain, rows['snapshot_id'], row_idx, len(addresses), [meta['snapshot_id'] for meta in targets],
+            rows, ('balance', 'percentage', 'value_usd', 'rank_position')
+        )
+        shape = present.shape
+        result = {
+            'metas': targets,
+            'addresses': np.asarray(addresses, dtype=object),
+            'present': present,
+            **matrices
+        }
+
+        # 与 rank_rows 相同的排序规则：占比降序，同占比按存储的排名，再按地址
+        stored_rank = np.where(present, result.pop('rank_position'), np.inf)
+        percentage = np.where(present, np.nan_to_num(result['percentage']), -np.inf)
+        address_order = np.broadcast_to(np.argsort(np.argsort(result['addresses']))[:, None], shape)
+        order = np.lexsort((address_order, stored_rank, -percentage), axis=0)
+        rank = np.empty(order.shape, dtype=float)
+        np.put_along_axis(rank, order, np.arange(1, shape[0] + 1, dtype=float)[:, None], axis=0)
+        rank[~present] = np.nan
+        result['rank'] = rank
+        return result
+
+    def load_history(self, task_id, addresses, start_time=None, end_time=None):
+        """
+        指定地址在快照区间内的 余额/占比/价值 矩阵（地址 × 快照）
+
+        只按地址索引读取这些地址的变化点（不还原完整快照），再沿链前向填充；
+        排名需要完整快照才能重新计算，不在此返回（见 load_matrix）
+
+        Returns:
+            None（无快照）或 dict: metas / addresses（与传入顺序一致）/ present / balance / percentage / value_usd
+        """
+        addresses = list(dict.fromkeys(addresses))
+        with self.db.reader() as conn:
+            targets = self.list_snapshots(task_id, start_time, end_time, conn=conn)
+            if not targets:
+                return None
+            keyframes = sorted({meta['keyframe_id'] for meta in targets})
+            last_target = max(meta['snapshot_id'] for meta in targets)
+            placeholders = ','.join('?' * len(keyframes))
+            chain = pd.read_sql_query(f'''
+                SELECT snapshot_id, keyframe_id FROM snapshot_meta
+                WHERE keyframe_id IN ({placeholders}) AND snapshot_id <= ?
+                ORDER BY keyframe_id, snapshot_id
+            ''', conn, params=keyframes + [last_target])
+
+            ids = {}
+            for start in range(0, len(addresses), _IN_CHUNK):
+                batch = addresses[start:start + _IN_CHUNK]
+                ids.update(conn.execute(
+                    f"SELECT address, address_id FROM addresses WHERE address IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall())
+            # 覆盖索引 (address_id, snapshot_id, ...) 上的范围扫描；区间内其他任务的行在下面过滤掉
+            # 全是数值列，直接转为 float 数组（比逐列推断类型的 read_sql_query 快得多）
+            fetched = []
+            address_ids = list(ids.values())
+            for start in range(0, len(address_ids), _IN_CHUNK):
+                batch = address_ids[start:start + _IN_CHUNK]
+                fetched += conn.execute(f'''
+                    SELECT address_id, snapshot_id, change_type, balance, percentage, value_usd
+                    FROM snapshot_rows
+                    WHERE address_id IN ({','.join('?' * len(batch))}) AND snapshot_id BETWEEN ? AND ?
+                ''', batch + [keyframes[0], last_target]).fetchall()
+
+        columns = ['address_id', 'snapshot_id', 'change_type', 'balance', 'percentage', 'value_usd']
+        rows = pd.DataFrame(np.array(fetched, dtype=float).reshape(-1, len(columns)), columns=columns)
+        rows = rows[rows['snapshot_id'].isin(chain['snapshot_id'])]
+        row_of = {address_id: i for i, address_id in enumerate(ids.get(address) for address in addresses)}
+        present, matrices = _fill_chains(
+            chain, rows['snapshot_id'].astype(np.int64), rows['address_id'].map(row_of).to_numpy(dtype=int),
+            len(addresses), [meta['snapshot_id'] for meta in targets], rows, ('balance', 'percentage', 'value_usd')
+        )
+        return {'metas': targets, 'addresses': addresses, 'present': present, **matrices}
+
+    def iter_wide(self, task_id, start_time=None, end_time=None, chunk_size=None):
+        """
+        地址 × 快照 宽表，按地址分块产出（每块只读取这些地址的变化点，内存只与块大小有关）
+
+        地址按首次出现的时间排序；列固定为开始时的快照列表，导出期间新写入/删除的快照不影响列
+
+        Yields:
+            dict: metas（所有块相同）/ addresses / present / balance / percentage / value_usd，
+            只包含在区间内至少出现过一次的地址
+        """
+        chunk_size = chunk_size or int(os.getenv('HOLDER_WIDE_EXPORT_CHUNK', 500))
+        with self.db.reader() as conn:
+            targets = self.list_snapshots(task_id, start_time, end_time, conn=conn)
+            if not targets:
+                return
+            keyframes = sorted({meta['keyframe_id'] for meta in targets})
+            placeholders = ','.join('?' * len(keyframes))
+            addresses = [row[0] for row in conn.execute(f'''
+                SELECT a.address FROM snapshot_meta m
+                JOIN snapshot_rows r ON r.snapshot_id = m.snapshot_id
+                JOIN addresses a ON a.address_id = r.address_id
+                WHERE m.keyframe_id IN ({placeholders}) AND m.snapshot_id <= ? AND r.change_type = ?
+                GROUP BY r.address_id ORDER BY MIN(m.snapshot_time), r.address_id
+            ''', keyframes + [max(meta['snapshot_id'] for meta in targets), ROW_SET])]
+
+        target_ids = [meta['snapshot_id'] for meta in targets]
+        for start in range(0, len(addresses), chunk_size):
+            history = self.load_history(task_id, addresses[start:start + chunk_size],
+                                        targets[0]['snapshot_ts'], targets[-1]['snapshot_ts'])
+            if history is None:
+                return
+            cols = pd.Index([meta['snapshot_id'] for meta in history['metas']]).get_indexer(target_ids)
+            missing = cols < 0
+            present = history['present'][:, cols]
+            present[:, missing] = False
+            seen = present.any(axis=1)
+            block = {
+                'metas': targets,
+                'addresses': [address for address, keep in zip(history['addresses'], seen) if keep],
+                'present': present[seen]
+            }
+            for field in ('balance', 'percentage', 'value_usd'):
+                matrix = history[field][:, cols]
+                matrix[:, missing] = np.nan
+                block[field] = matrix[seen]
+            yield block
+
+    def address_history(self, task_id, addresses, start_time=None, end_time=None,
+                        points=None, method='lttb', field='balance'):
+        """
+        地址持仓的时间序列（供图表使用），按 field 降采样到每个地址最多约 points 个点
+
+        Returns:
+            None（无快照）或 dict: 区间、快照数、降采样参数，series 为每个地址的
+            {address, total_points, time（epoch秒）, balance, percentage, value_usd}
+        """
+        if field not in ('balance', 'percentage', 'value_usd'):
+            raise ValueError(f"不支持的降采样字段: {field}")
+        max_addresses = int(os.getenv('HOLDER_HISTORY_MAX_ADDRESSES', 100))
+        if not addresses or len(addresses) > max_addresses:
+            raise ValueError(f"地址数量需在 1~{max_addresses} 之间")
+
+        history = self.load_history(task_id, addresses, start_time, end_time)
+        if history is None:
+            return None
+        timestamps = np.array([meta['snapshot_ts'] for meta in history['metas']], dtype=np.int64)
+        values = np.where(history['present'], history[field], np.nan)
+        keep = downsample(timestamps, values, points, method) if points else ~np.isnan(values)
+
+        def to_list(array):
+            return [None if np.isnan(value) else value for value in array.tolist()]
+
+        series = []
+        for i, address in enumerate(history['addresses']):
+            cols = np.flatnonzero(keep[i])
+            series.append({
+                'address': address,
+                'total_points': int(history['present'][i].sum()),
+                'time': timestamps[cols].tolist(),
+                'balance': to_list(history['balance'][i, cols]),
+                'percentage': to_list(history['percentage'][i, cols]),
+                'value_usd': to_list(history['value_usd'][i, cols])
+            })
+        return {
+            'task_id': task_id,
+            'from': history['metas'][0]['snapshot_time'],
+            'to': history['metas'][-1]['snapshot_time'],
+            'snapshot_count': len(timestamps),
+            'method': method if points else None,
+            'points': points,
+            'field': field,
+            'series': series
+        }
+
+    def get_snapshot(self, task_id, snapshot_time=None):
+        """还原指定时间点（不晚于该时间的最近一次）的快照，返回 (meta, rows)，无数据返回 (None, [])"""
+        with self.db.reader() as conn:
+            sql = "SELECT snapshot_time FROM snapshot_meta WHERE task_id = ?"
+            params = [task_id]
+            if snapshot_time is not None:
+                sql += " AND snapshot_time <= ?"
+                params.append(to_epoch(snapshot_time))
+            row = conn.execute(sql + " ORDER BY snapshot_time DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None, []
+        for meta, rows in self.iter_snapshots(task_id, row[0], row[0]):
+            return meta, rows
+        return None, []
+
+    def get_recent_rows(self, task_id, limit):
+        """最近若干快照的持仓行（新快照在前，快照内按排名），最多 limit 行"""
+        with self.db.reader() as conn:
+            recent = conn.execute('''
+                SELECT snapshot_time, holder_count FROM snapshot_meta
+                WHERE task_id = ? ORDER BY snapshot_time DESC
+            ''', (task_id,)).fetchall()
+        if not recent:
+            return []
+
+        # 只还原凑够 limit 行所需的快照
+        total, start_time = 0, recent[-1][0]
+        for snapshot_time, holder_count in recent:
+            total += holder_count
+            if total >= limit:
+                start_time = snapshot_time
+                break
+
+        snapshots = list(self.iter_snapshots(task_id, start_time=start_time))
+        result = []
+        for meta, rows in reversed(snapshots):
+            for row in rows:
+                result.append(dict(row, snapshot_time=meta['snapshot_time']))
+                if len(result) >= limit:
+                    return result
+        return result
+
+    # ------------------------------------------------------------------ 迁移与统计
+
+    def migrate_legacy(self):
+        """
+        把旧版全量表 holder_snapshots（文本列、每行重复地址）按任务转换为增量存储，
+        全部迁移后删除旧表并 VACUUM 回收空间
+        """
+        with self.db.reader() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'holder_snapshots'"
+            ).fetchone()
+            task_ids = [row[0] for row in conn.execute("SELECT DISTINCT task_id FROM holder_snapshots")] if exists else []
+        if not exists:
+            return 0
+
+        migrated = 0
+        for task_id in task_ids:
+            try:
+                with self.db.writer() as conn:
+                    rows = conn.execute('''
+                        SELECT snapshot_time, holder_address, token_address, balance, percentage, value_usd
+                        FROM holder_snapshots WHERE task_id = ?
+                        ORDER BY snapshot_time, rank_position, id
+                    ''', (task_id,))
+
+                    current_time, token_address, holders = None, None, []
+                    for snapshot_time, address, token, balance, percentage, value_usd in rows:
+                        if snapshot_time != current_time and holders:
+                            self._save(conn, task_id, token_address, holders, current_time)
+                            migrated += 1
+                            holders = []
+                        current_time, token_address = snapshot_time, token
+                        holders.append({'address': address, 'balance': balance,
+                                        'percentage': percentage, 'value_usd': value_usd})
+                    if holders:
+                        self._save(conn, task_id, token_address, holders, current_time)
+                        migrated += 1
+
+                    conn.execute("DELETE FROM holder_snapshots WHERE task_id = ?", (task_id,))
+            except Exception:
+                self._reset_caches()
+                raise
+            logger.info(f"🔄 旧版快照已迁移为增量存储: {task_id}")
+
+        with self.db.writer() as conn:
+            conn.execute("DROP TABLE holder_snapshots")
+        self.db.vacuum()
+        logger.info(f"✅ 共迁移 {migrated} 个旧版快照，旧表已删除")
+        return migrated
+
+    def compact(self, task_id, policy, now=None):
+        """
+        按保留策略降采样任务的快照：删除各时间桶内非收盘的快照，并把受影响的增量链重新编码
+
+        被删快照的变化并入下一个保留的快照（保留快照的完整持仓不变），
+        从第一个受影响链到最后一个受影响链之间的保留快照按时间重新连成链（遵守关键帧间隔，ID回退处断链）。
+        调用方随后需重建 holder_stats
+
+        Returns:
+            删除的快照数
+        """
+        now = time.time() if now is None else now
+        with self.db.writer() as conn:
+            metas = conn.execute('''
+                SELECT snapshot_id, snapshot_time, keyframe_id FROM snapshot_meta
+                WHERE task_id = ? ORDER BY snapshot_id
+            ''', (task_id,)).fetchall()
+            keep = retention_keep([(sid, ts) for sid, ts, _ in metas], policy, now)
+            drop = {sid for sid, _, _ in metas if sid not in keep}
+            if not drop:
+                return 0
+
+            affected = {kf for sid, _, kf in metas if sid in drop}
+            first = min(affected)
+            last = max(sid for sid, _, kf in metas if kf in affected)
+            chains = {kf for sid, _, kf in metas if first <= sid <= last}
+            # 按时间重新连链；回填快照的ID与时间不同序，ID回退处另起关键帧，保证链内ID顺序与时间顺序一致
+            members = [(sid, kf) for sid, ts, kf in sorted(metas, key=lambda m: (m[1], m[0])) if kf in chains]
+            chain_end = {kf: sid for sid, kf in members}
+
+            try:
+                states, previous, chain_length, keyframe_id = {}, None, 0, None
+                encoded = []
+                for snapshot_id, original_kf in members:
+                    state = states.setdefault(original_kf, {})
+                    self._apply(state, self._load_rows(conn, snapshot_id))
+                    if snapshot_id not in drop:
+                        current = dict(state)
+                        delta = None
+                        if (previous is not None and chain_length < self.keyframe_interval
+                                and snapshot_id > encoded[-1][0]):
+                            delta = self._diff(previous, current, exact=True)
+                            if len(delta) > len(current) * KEYFRAME_DELTA_RATIO:
+                                delta = None
+                        if delta is None:
+                            keyframe_id, chain_length = snapshot_id, 1
+                            rows = [(key,) + values + (ROW_SET,) for key, values in current.items()]
+                        else:
+                            chain_length += 1
+                            rows = delta
+                        encoded.append((snapshot_id, keyframe_id, rows))
+                        previous = current
+                    if chain_end[original_kf] == snapshot_id:
+                        del states[original_kf]
+
+                member_ids = [sid for sid, _ in members]
+                for i in range(0, len(member_ids), _IN_CHUNK):
+                    chunk = member_ids[i:i + _IN_CHUNK]
+                    placeholders = ','.join('?' * len(chunk))
+                    conn.execute(f"DELETE FROM snapshot_rows WHERE snapshot_id IN ({placeholders})", chunk)
+                conn.executemany("DELETE FROM snapshot_meta WHERE snapshot_id = ?", [(sid,) for sid in drop])
+
+                ids = self._intern(conn, [row[0] for _, _, rows in encoded for row in rows])
+                for snapshot_id, new_kf, rows in encoded:
+                    conn.execute('''
+                        UPDATE snapshot_meta SET is_keyframe = ?, keyframe_id = ?, delta_rows = ?
+                        WHERE snapshot_id = ?
+                    ''', (int(new_kf == snapshot_id), new_kf, len(rows), snapshot_id))
+                    conn.executemany('''
+                        INSERT INTO snapshot_rows
+                        (snapshot_id, address_id, balance, percentage, value_usd, rank_position, change_type)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', [(snapshot_id, ids[row[0]]) + row[1:] for row in rows])
+            except Exception:
+                self._reset_caches()
+                raise
+            # 最近快照所在的链可能已重新编码
+            self._last.pop(task_id, None)
+
+        logger.info(f"🗜️ 快照降采样: {task_id} 删除 {len(drop)} 个，重新编码 {len(encoded)} 个")
+        return len(drop)
+
+    def get_storage_stats(self, task_id=None):
+        """存储统计：快照数、关键帧数、回填快照数、实际存储行数与等价全量行数"""
+        sql = '''
+            SELECT COUNT(*), COALESCE(SUM(is_keyframe), 0),
+                   COALESCE(SUM(delta_rows), 0), COALESCE(SUM(holder_count), 0), COALESCE(SUM(is_backfill), 0)
+            FROM snapshot_meta
+        '''
+        params = ()
+        if task_id is not None:
+            sql += " WHERE task_id = ?"
+            params = (task_id,)
+        with self.db.reader() as conn:
+            snapshots, keyframes, stored, full, backfilled = conn.execute(sql, params).fetchone()
+        return {
+            'snapshots': snapshots,
+            'keyframes': keyframes,
+            'backfilled': backfilled,
+            'stored_rows': stored,
+            'full_rows': full,
+            'compression_ratio': round(full / stored, 2) if stored else None
+        }
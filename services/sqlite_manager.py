@@ -0,0 +1,170 @@
+"""
+SQLite连接管理
+WAL日志模式下一个专用写连接 + 少量只读连接池：定时采集写入快照时，Flask请求线程的查询
+读取的是WAL中的一致性快照，读写互不阻塞
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteConnectionManager:
+    """单个SQLite数据库文件的连接管理器（线程安全）"""
+
+    def __init__(self, db_path, read_pool_size=None):
+        self.db_path = db_path
+        self.read_pool_size = read_pool_size or int(os.getenv('SQLITE_READ_POOL_SIZE', 4))
+        # 等待锁的超时（秒）：同库的其他进程（如独立采集进程）写入时不立即报 database is locked
+        self.busy_timeout = float(os.getenv('SQLITE_BUSY_TIMEOUT', 30))
+        self.cache_size_kb = int(os.getenv('SQLITE_CACHE_SIZE_KB', 16 * 1024))
+        self.mmap_size = int(os.getenv('SQLITE_MMAP_SIZE_MB', 128)) * 1024 * 1024
+
+        self._write_lock = threading.RLock()
+        self._writer = self._connect(read_only=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+
+        self._readers = queue.LifoQueue()
+        self._readers_created = 0
+        self._readers_lock = threading.Lock()
+
+    def _connect(self, read_only):
+        """创建连接并设置PRAGMA"""
+        if read_only:
+            uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout, check_same_thread=False)
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False)
+            # WAL模式下 NORMAL 已足够安全（断电最多丢失最后一次提交），且写入快得多
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        获取写连接（进程内串行），正常退出时提交，异常时回滚
+
+        用法:
+            with manager.writer() as conn:
+                conn.execute(...)
+        """
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """从只读连接池借出一个连接，池满时等待归还"""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            # 结束可能残留的读事务，避免长期持有旧快照阻止WAL检查点
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._readers_lock:
+            if self._readers_created < self.read_pool_size:
+                self._readers_created += 1
+                return self._connect(read_only=True)
+
+        try:
+            return self._readers.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            # 与 SQLite 忙等超时同类，调用方按 sqlite3.OperationalError 处理
+            raise sqlite3.OperationalError(
+                f"read pool exhausted ({self.read_pool_size} connections busy for {self.busy_timeout}s)"
+            ) from None
+
+    def checkpoint(self, mode='PASSIVE'):
+        """执行WAL检查点（TRUNCATE 可把WAL文件截断为0）"""
+        with self._write_lock:
+            return self._writer.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def vacuum(self):
+        """整理数据库文件回收空间（需在事务外执行，期间阻塞写入）"""
+        with self._write_lock:
+            self._writer.execute("VACUUM")
+            # WAL模式下整理结果先写入WAL，检查点后主文件才会缩小
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info(f"🧹 数据库已整理: {self.db_path}")
+
+    def incremental_vacuum(self, pages=None):
+        """
+        回收空闲页（auto_vacuum=INCREMENTAL，不像 VACUUM 那样重写整个文件）
+
+        首次调用时若数据库未启用增量整理，设置后执行一次完整 VACUUM 使其生效
+        """
+        with self._write_lock:
+            if self._writer.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                self.vacuum()
+                return
+            freelist = self._writer.execute("PRAGMA freelist_count").fetchone()[0]
+            if not freelist:
+                return
+            self._writer.execute(f"PRAGMA incremental_vacuum({int(pages or 0)})").fetchall()
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info(f"🧹 已回收 {freelist if not pages else min(pages, freelist)} 个空闲页: {self.db_path}")
+
+    def get_status(self):
+        """连接状态（供监控使用）"""
+        wal_path = f"{self.db_path}-wal"
+        return {
+            'db_path': self.db_path,
+            'db_size_mb': round(os.path.getsize(self.db_path) / 1024 / 1024, 2) if os.path.exists(self.db_path) else 0,
+            'wal_size_mb': round(os.path.getsize(wal_path) / 1024 / 1024, 2) if os.path.exists(wal_path) else 0,
+            'read_pool_size': self.read_pool_size,
+            'readers_created': self._readers_created,
+            'readers_idle': self._readers.qsize()
+        }
+
+    def close(self):
+        """关闭所有连接"""
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        logger.info(f"✅ SQLite连接已关闭: {self.db_path}")
+
+
+# 按数据库文件复用连接管理器
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_sqlite_manager(db_path):
+    """获取指定数据库文件的连接管理器（每个文件一个实例）"""
+    key = os.path.abspath(db_path)
+    manager = _managers.get(key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                manager = SQLiteConnectionManager(db_path)
+                _managers[key] = manager
+    return manager
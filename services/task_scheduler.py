@@ -0,0 +1,289 @@
+"""
+定时任务调度器
+小顶堆按到期时间排列任务，调度线程睡眠到最近一个到期时间（有新任务时被唤醒），
+到期任务交给有界线程池执行：按链限制并发，追踪同一代币/链的多个任务合并为一次执行。
+各任务的执行时刻按 task_id 确定性地错开在整个间隔内（再加少量抖动），并受全局每分钟抓取预算约束，
+避免整点时所有任务同时请求上游
+"""
+
+import os
+import json
+import math
+import zlib
+import heapq
+import time
+import itertools
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from services.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def _unit_hash(text):
+    """字符串 -> [0, 1) 的确定性哈希（跨进程稳定，不受 PYTHONHASHSEED 影响）"""
+    return zlib.crc32(text.encode('utf-8')) / 2 ** 32
+
+
+def staggered_due(task_id, interval_seconds, after, spread=None, jitter_seconds=None):
+    """
+    计算任务在 after 之后的下一个执行时刻（epoch秒）
+
+    时刻 = 偏移 + k × 间隔 + 抖动：偏移由 task_id 决定，落在间隔的前 spread 比例内；
+    抖动由 (task_id, k) 决定，范围 ±jitter_seconds（不超过间隔的1/4）
+    """
+    spread = float(os.getenv('HOLDER_SCHEDULE_SPREAD', 1.0)) if spread is None else spread
+    jitter_seconds = float(os.getenv('HOLDER_SCHEDULE_JITTER_SECONDS', 60)) if jitter_seconds is None else jitter_seconds
+    jitter_seconds = min(jitter_seconds, interval_seconds / 4)
+
+    offset = _unit_hash(task_id) * interval_seconds * min(max(spread, 0.0), 1.0)
+    k = math.floor((after - offset) / interval_seconds) + 1
+    while True:
+        jitter = (_unit_hash(f"{task_id}:{k}") * 2 - 1) * jitter_seconds
+        due = offset + k * interval_seconds + jitter
+        if due > after:
+            return due
+        k += 1
+
+
+class ScheduledTask:
+    """调度条目（由 TaskScheduler 加锁访问）"""
+
+    __slots__ = ('task_id', 'due', 'seq', 'group_key', 'chain', 'reserved')
+
+    def __init__(self, task_id, due, seq, group_key, chain, reserved=False):
+        self.task_id = task_id
+        self.due = due
+        self.seq = seq
+        self.group_key = group_key
+        self.chain = chain
+        self.reserved = reserved  # 已预约抓取预算（因预算不足被推迟的条目）
+
+
+class TaskScheduler:
+    """
+    堆调度器（线程安全）
+
+    run_func(task_ids) 在线程池中执行一组到期任务（同一 group_key 的任务只传入一次，
+    由 run_func 负责只抓取一次数据）；执行完成后由调用方重新 schedule 下一次运行
+    """
+
+    def __init__(self, run_func, max_workers=None, chain_limits=None, default_chain_limit=None,
+                 per_minute=None, burst=None, name='scheduler'):
+        self.run_func = run_func
+        self.name = name
+        self.max_workers = max_workers or int(os.getenv('HOLDER_SCHEDULER_WORKERS', 8))
+        self.default_chain_limit = default_chain_limit or int(os.getenv('HOLDER_CHAIN_CONCURRENCY_DEFAULT', 4))
+        self.chain_limits = chain_limits if chain_limits is not None else self._load_chain_limits()
+        # 全局抓取预算：每分钟最多派发的组数（同代币合并的任务只抓取一次，按一次计），0 表示不限
+        per_minute = float(os.getenv('HOLDER_SNAPSHOTS_PER_MINUTE', 30)) if per_minute is None else per_minute
+        burst = int(os.getenv('HOLDER_SNAPSHOT_BURST', 5)) if burst is None else burst
+        self.budget = TokenBucket(per_minute / 60.0, max(burst, 1)) if per_minute > 0 else None
+
+        self._heap = []
+        self._entries = {}          # task_id -> 当前有效的 ScheduledTask（堆中旧条目惰性删除）
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running_tasks = set()
+        self._chain_running = {}
+        self._chain_pending = {}    # chain -> [组任务]，链并发已满时排队
+        self._executor = None
+        self._thread = None
+        self._stopping = False
+
+        # 监控统计
+        self.total_dispatched = 0
+        self.total_groups = 0
+        self.total_skipped_running = 0
+        self.total_deferred = 0
+
+    @staticmethod
+    def _load_chain_limits():
+        """从环境变量 HOLDER_CHAIN_CONCURRENCY 读取每条链的并发上限，例如 {"501": 4, "1": 2}"""
+        raw = os.getenv('HOLDER_CHAIN_CONCURRENCY')
+        if not raw:
+            return {}
+        try:
+            return {str(chain): int(limit) for chain, limit in json.loads(raw).items()}
+        except Exception as e:
+            logger.error(f"❌ HOLDER_CHAIN_CONCURRENCY 配置解析失败，使用默认并发: {e}")
+            return {}
+
+    def chain_limit(self, chain):
+        return self.chain_limits.get(str(chain), self.default_chain_limit)
+
+    # ------------------------------------------------------------------ 调度
+
+    def schedule(self, task_id, due, group_key=None, chain=None):
+        """安排（或改期）任务在 due（epoch秒）执行"""
+        with self._cond:
+            self._push(ScheduledTask(task_id, due, next(self._seq), group_key or task_id, chain))
+            self._cond.notify()
+
+    def _push(self, entry):
+        """需持有锁"""
+        self._entries[entry.task_id] = entry
+        heapq.heappush(self._heap, (entry.due, entry.seq, entry))
+
+    def cancel(self, task_id):
+        """取消任务的下一次执行（已在执行中的不受影响）"""
+        with self._cond:
+            self._entries.pop(task_id, None)
+            self._cond.notify()
+
+    def run_now(self, task_id, group_key=None, chain=None):
+        """
+        立即执行（调度线程未启动时也会直接派发到线程池）
+
+        Returns:
+            是否已派发；任务仍在执行中时本次被跳过，返回 False
+        """
+        with self._cond:
+            if task_id in self._running_tasks:
+                self.total_skipped_running += 1
+                logger.info(f"⏭️ 任务 {task_id} 仍在执行，跳过手动执行")
+                return False
+            self._entries.pop(task_id, None)
+            # 手动执行不因预算推迟，但计入预算
+            self._dispatch([ScheduledTask(task_id, time.time(), next(self._seq), group_key or task_id, chain, reserved=True)])
+            if self.budget is not None:
+                self.budget.reserve()
+            return True
+
+    def next_due(self, task_id):
+        with self._cond:
+            entry = self._entries.get(task_id)
+            return entry.due if entry else None
+
+    def _pop_due(self, now):
+        """弹出所有已到期的有效条目（需持有锁）"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, entry = heapq.heappop(self._heap)
+            if self._entries.get(entry.task_id) is entry:
+                del self._entries[entry.task_id]
+                due.append(entry)
+        return due
+
+    def _next_wakeup(self):
+        """清理堆顶的失效条目，返回最近的到期时间（需持有锁）"""
+        while self._heap and self._entries.get(self._heap[0][2].task_id) is not self._heap[0][2]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def _loop(self):
+        logger.info(f"🔄 {self.name} 调度线程启动")
+        with self._cond:
+            while not self._stopping:
+                wakeup = self._next_wakeup()
+                now = time.time()
+                if wakeup is None or wakeup > now:
+                    self._cond.wait(timeout=None if wakeup is None else wakeup - now)
+                    continue
+                self._dispatch(self._pop_due(now))
+        logger.info(f"⏹️ {self.name} 调度线程停止")
+
+    # ------------------------------------------------------------------ 执行
+
+    def _dispatch(self, entries):
+        """按 group_key 合并到期任务，扣除抓取预算后按链并发限制提交到线程池（需持有锁）"""
+        groups = {}
+        for entry in entries:
+            if entry.task_id in self._running_tasks:
+                # 上一次执行尚未结束，本次跳过（执行结束后会重新安排）
+                self.total_skipped_running += 1
+                logger.info(f"⏭️ 任务 {entry.task_id} 仍在执行，跳过本次调度")
+                continue
+            groups.setdefault(entry.group_key, []).append(entry)
+
+        for group in groups.values():
+            if self.budget is not None and not any(entry.reserved for entry in group):
+                wait = self.budget.reserve()
+                if wait > 0:
+                    # 预算不足：已预约令牌，推迟到令牌可用时再派发
+                    # 同组条目使用同一到期时间，到期后一起弹出，不会被拆成两次抓取
+                    self.total_deferred += 1
+                    due = time.time() + wait
+                    for entry in group:
+                        self._push(ScheduledTask(entry.task_id, due, next(self._seq),
+                                                 entry.group_key, entry.chain, reserved=True))
+                    continue
+            chain = group[0].chain
+            self._running_tasks.update(entry.task_id for entry in group)
+            if self._chain_running.get(chain, 0) < self.chain_limit(chain):
+                self._submit(chain, group)
+            else:
+                self._chain_pending.setdefault(chain, []).append(group)
+
+    def _submit(self, chain, group):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self._chain_running[chain] = self._chain_running.get(chain, 0) + 1
+        self.total_dispatched += len(group)
+        self.total_groups += 1
+        task_ids = [entry.task_id for entry in group]
+        self._executor.submit(self._run_group, chain, task_ids)
+
+    def _run_group(self, chain, task_ids):
+        try:
+            self.run_func(task_ids)
+        except Exception as e:
+            logger.error(f"❌ {self.name} 执行任务 {task_ids} 失败: {e}")
+        finally:
+            with self._cond:
+                self._running_tasks.difference_update(task_ids)
+                self._chain_running[chain] -= 1
+                pending = self._chain_pending.get(chain)
+                if pending and not self._stopping:
+                    self._submit(chain, pending.pop(0))
+
+    # ------------------------------------------------------------------ 生命周期
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._cond:
+            if self.is_running:
+                return False
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name=f"{self.name}-loop", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, wait=False):
+        """停止调度线程（已派发的任务继续执行完）"""
+        with self._cond:
+            self._stopping = True
+            # 排队中的任务不再执行，重新启动时由调用方重新安排
+            for groups in self._chain_pending.values():
+                for task_ids in groups:
+                    self._running_tasks.difference_update(entry.task_id for entry in task_ids)
+            self._chain_pending.clear()
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def get_status(self):
+        with self._cond:
+            upcoming = sorted(self._entries.values(), key=lambda entry: entry.due)
+            return {
+                'running': self.is_running,
+                'max_workers': self.max_workers,
+                'scheduled': len(self._entries),
+                'next_due_in_seconds': round(upcoming[0].due - time.time(), 1) if upcoming else None,
+                'running_tasks': sorted(self._running_tasks),
+                'chain_running': {str(k): v for k, v in self._chain_running.items() if v},
+                'chain_pending': {str(k): len(v) for k, v in self._chain_pending.items() if v},
+                'total_dispatched': self.total_dispatched,
+                'total_groups': self.total_groups,
+                'total_skipped_running': self.total_skipped_running,
+                'total_deferred': self.total_deferred,
+                'budget': self.budget.get_status() if self.budget is not None else None
+            }
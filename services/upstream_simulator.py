@@ -0,0 +1,272 @@
+"""
+上游API离线模拟器（录制/回放）
+- 录制：设置 UPSTREAM_RECORD_DIR 后，所有经共享HTTP客户端发出的请求（fetch_data_robust、
+  fetch_okx_data、各模块的 get_http_client().get）都会把响应写入夹具目录
+- 回放：设置 UPSTREAM_REPLAY_URL 后，请求改发到本地回放服务器，由其按夹具返回响应，
+  并可注入延迟分布、随机错误和429突发，用于在本地可重复地压测各抓取模块
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl, quote
+
+from services.response_cache import normalize_params
+
+logger = logging.getLogger(__name__)
+
+
+def fixture_key(host, path, params):
+    """夹具键：主机 + 路径 + 归一化参数（忽略 t）"""
+    raw = json.dumps([host.lower(), path, normalize_params(params)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:24]
+
+
+class FixtureStore:
+    """夹具目录：<dir>/<host>/<key>.json"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, host, key):
+        return os.path.join(self.directory, host.lower(), f"{key}.json")
+
+    def save(self, url, params, status, body, content_type, elapsed_ms):
+        """保存一条响应"""
+        parsed = urlparse(url)
+        key = fixture_key(parsed.netloc, parsed.path, params)
+        path = self._path(parsed.netloc, key)
+        fixture = {
+            'url': f"{parsed.scheme}://{parsed.netloc}{parsed.path}",
+            'params': normalize_params(params),
+            'status': status,
+            'content_type': content_type,
+            'elapsed_ms': round(elapsed_ms, 1),
+            'recorded_at': int(time.time()),
+            'body': body
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(fixture, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def load(self, host, path, params):
+        """查找夹具，不存在返回 None"""
+        fixture_path = self._path(host, fixture_key(host, path, params))
+        if not os.path.exists(fixture_path):
+            return None
+        with open(fixture_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def summary(self):
+        """按接口统计夹具数量"""
+        counts = {}
+        if not os.path.isdir(self.directory):
+            return counts
+        for host in sorted(os.listdir(self.directory)):
+            host_dir = os.path.join(self.directory, host)
+            if not os.path.isdir(host_dir):
+                continue
+            for name in os.listdir(host_dir):
+                if not name.endswith('.json'):
+                    continue
+                with open(os.path.join(host_dir, name), 'r', encoding='utf-8') as f:
+                    endpoint = urlparse(json.load(f)['url'])
+                key = f"{endpoint.netloc}{endpoint.path}"
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+
+class UpstreamSimulator:
+    """客户端侧钩子：录制响应 / 把请求改写到回放服务器（由 HttpClientRegistry.get 调用）"""
+
+    def __init__(self, record_dir=None, replay_url=None):
+        record_dir = record_dir or os.getenv('UPSTREAM_RECORD_DIR')
+        self.recorder = FixtureStore(record_dir) if record_dir else None
+        self.replay_url = (replay_url or os.getenv('UPSTREAM_REPLAY_URL') or '').rstrip('/') or None
+
+        if self.recorder:
+            logger.info(f"📼 上游响应录制已开启: {record_dir}")
+        if self.replay_url:
+            logger.info(f"🎭 上游请求回放模式: {self.replay_url}")
+
+    @property
+    def active(self):
+        return self.recorder is not None or self.replay_url is not None
+
+    def route(self, url):
+        """回放模式下把 https://host/path 改写为 <replay_url>/host/path"""
+        if not self.replay_url:
+            return url
+        parsed = urlparse(url)
+        return f"{self.replay_url}/{parsed.netloc}{quote(parsed.path)}"
+
+    def record(self, url, params, response, elapsed_ms):
+        """录制一条真实响应"""
+        if not self.recorder or self.replay_url:
+            return
+        try:
+            self.recorder.save(
+                url, params, response.status_code, response.text,
+                response.headers.get('Content-Type', 'application/json'), elapsed_ms
+            )
+        except Exception as e:
+            logger.error(f"❌ 录制响应失败 {url[:50]}...: {e}")
+
+
+# 全局实例
+_upstream_simulator = None
+_upstream_simulator_lock = threading.Lock()
+
+
+def get_upstream_simulator():
+    """获取全局模拟器钩子（单例模式）"""
+    global _upstream_simulator
+    if _upstream_simulator is None:
+        with _upstream_simulator_lock:
+            if _upstream_simulator is None:
+                _upstream_simulator = UpstreamSimulator()
+    return _upstream_simulator
+
+
+def parse_latency(spec):
+    """
+    解析延迟分布，返回 fixture -> 秒 的函数
+
+    支持: recorded（使用录制时的耗时）、fixed:50、uniform:20:200、lognormal:120:0.5（中位数ms:sigma）
+    """
+    parts = (spec or 'recorded').split(':')
+    kind = parts[0]
+    if kind == 'recorded':
+        return lambda fixture: (fixture or {}).get('elapsed_ms', 0) / 1000
+    if kind == 'fixed':
+        ms = float(parts[1])
+        return lambda fixture: ms / 1000
+    if kind == 'uniform':
+        low, high = float(parts[1]), float(parts[2])
+        return lambda fixture: random.uniform(low, high) / 1000
+    if kind == 'lognormal':
+        median, sigma = float(parts[1]), float(parts[2])
+        return lambda fixture: random.lognormvariate(0, sigma) * median / 1000
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+class ReplayServer:
+    """本地回放HTTP服务器"""
+
+    def __init__(self, fixtures_dir, host='127.0.0.1', port=18900, latency='recorded',
+                 error_rate=0.0, burst_429=None, missing='404', seed=None):
+        """
+        Args:
+            fixtures_dir: 夹具目录
+            latency: 延迟分布（见 parse_latency）
+            error_rate: 随机返回502的概率
+            burst_429: "周期秒:持续秒"，每个周期开头的若干秒内所有请求返回429
+            missing: 夹具缺失时的行为，'404' 或 'empty'（返回 {"code":0,"data":{}}）
+        """
+        self.store = FixtureStore(fixtures_dir)
+        self.host = host
+        self.port = port
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.missing = missing
+        self.burst_period, self.burst_duration = (
+            [float(x) for x in burst_429.split(':')] if burst_429 else (0.0, 0.0)
+        )
+        if seed is not None:
+            random.seed(seed)
+
+        self.started_at = time.monotonic()
+        self.stats = {'requests': 0, 'served': 0, 'missing': 0, 'errors_5xx': 0, 'rate_limited_429': 0}
+        self._stats_lock = threading.Lock()
+        self._httpd = None
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def in_429_burst(self):
+        """当前是否处于429突发窗口"""
+        if self.burst_period <= 0:
+            return False
+        return (time.monotonic() - self.started_at) % self.burst_period < self.burst_duration
+
+    def handle(self, raw_path):
+        """处理一次请求，返回 (status, content_type, body)"""
+        parsed = urlparse(raw_path)
+        if parsed.path == '/__stats':
+            with self._stats_lock:
+                return 200, 'application/json', json.dumps(self.stats)
+
+        self._count('requests')
+        host, _, path = parsed.path.lstrip('/').partition('/')
+        path = '/' + path
+        params = dict(parse_qsl(parsed.query, keep_blank_values=True))
+
+        if self.in_429_burst():
+            self._count('rate_limited_429')
+            return 429, 'application/json', json.dumps({'code': 429, 'msg': 'Too Many Requests'})
+
+        fixture = self.store.load(host, path, params)
+        time.sleep(self.latency(fixture))
+
+        if self.error_rate and random.random() < self.error_rate:
+            self._count('errors_5xx')
+            return 502, 'text/plain', 'Bad Gateway'
+
+        if fixture is None:
+            self._count('missing')
+            if self.missing == 'empty':
+                return 200, 'application/json', json.dumps({'code': 0, 'data': {}})
+            return 404, 'application/json', json.dumps({'code': 404, 'msg': f'no fixture for {host}{path}'})
+
+        self._count('served')
+        return fixture['status'], fixture['content_type'], fixture['body']
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, content_type, body = server.handle(self.path)
+                payload = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # 压测时不打印访问日志
+
+        return Handler
+
+    def serve_forever(self):
+        """阻塞运行服务器"""
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        self._httpd.daemon_threads = True
+        logger.info(f"🎭 回放服务器已启动: http://{self.host}:{self.port} (夹具目录 {self.store.directory})")
+        self._httpd.serve_forever()
+
+    def start_background(self):
+        """在后台线程运行服务器，返回线程"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True, name="replay_server")
+        thread.start()
+        while self._httpd is None:
+            time.sleep(0.01)
+        return thread
+
+    def shutdown(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
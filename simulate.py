@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+上游API模拟器命令行工具
+录制真实响应、启动本地回放服务器，并在回放数据上压测抓取模块
+
+示例:
+    # 录制：正常运行一次目标函数，响应写入 fixtures/
+    python simulate.py bench --target holders --chain-id 501 --token <CA> --record-dir fixtures
+
+    # 回放压测：内置回放服务器，lognormal延迟 + 2%错误 + 每30秒5秒的429突发
+    python simulate.py bench --target holders --chain-id 501 --token <CA> --fixtures fixtures \\
+        --latency lognormal:150:0.5 --error-rate 0.02 --burst-429 30:5 --no-cache --repeat 3
+
+    # 单独启动回放服务器（供 app.py 使用: UPSTREAM_REPLAY_URL=http://127.0.0.1:18900）
+    python simulate.py serve --fixtures fixtures --port 18900
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+import logging
+
+from services.upstream_simulator import ReplayServer, FixtureStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def resolve_target(args):
+    """返回压测目标函数（无参调用，返回结果条数）；导入放在计时之外"""
+    if args.target == 'holders':
+        from modules.holder import get_all_holders
+        return lambda: len(get_all_holders(args.chain_id, args.token, top_n=args.top_n))
+
+    if args.target == 'smart_accounts':
+        from modules.smart_accounts import find_smart_accounts
+
+        def run():
+            result = find_smart_accounts(args.token, args.chain_id, max_tokens=args.max_tokens, page_limit=args.page_limit)
+            return len(result) if result is not None else 0
+        return run
+
+    if args.target == 'wallet_tags':
+        from modules.wallet_tag_engine import WalletTagEngine
+        wallets = [w.strip() for w in (args.wallets or '').split(',') if w.strip()]
+        engine = WalletTagEngine()
+        return lambda: len(engine.batch_analyze(wallets, args.chain_id))
+
+    raise ValueError(f"未知压测目标: {args.target}")
+
+
+def fetch_server_stats(replay_url):
+    try:
+        return requests.get(f"{replay_url}/__stats", timeout=5).json()
+    except Exception:
+        return {}
+
+
+def bench(args):
+    """在录制或回放模式下运行目标函数并统计吞吐"""
+    if args.target == 'wallet_tags' and not args.wallets:
+        logger.error("❌ wallet_tags 目标需要 --wallets addr1,addr2,...")
+        return False
+    if args.target != 'wallet_tags' and not args.token:
+        logger.error("❌ 请指定代币地址: --token <CA>")
+        return False
+
+    server = None
+    if args.fixtures:
+        server = ReplayServer(
+            args.fixtures, port=args.port, latency=args.latency, error_rate=args.error_rate,
+            burst_429=args.burst_429, missing=args.missing, seed=args.seed
+        )
+        server.start_background()
+        args.replay_url = f"http://127.0.0.1:{args.port}"
+
+    # 模拟器和缓存均在首次使用时读取环境变量，必须在导入业务模块前设置
+    if args.replay_url:
+        os.environ['UPSTREAM_REPLAY_URL'] = args.replay_url
+    if args.record_dir:
+        os.environ['UPSTREAM_RECORD_DIR'] = args.record_dir
+    if args.no_cache:
+        os.environ['ENABLE_RESPONSE_CACHE'] = 'False'
+
+    from services.rate_limiter import get_rate_limiter
+    from services.metrics import get_metrics
+    run_target = resolve_target(args)
+
+    runs = []
+    try:
+        for i in range(args.repeat):
+            before = fetch_server_stats(args.replay_url) if args.replay_url else {}
+            start = time.time()
+            count = run_target()
+            elapsed = time.time() - start
+            after = fetch_server_stats(args.replay_url) if args.replay_url else {}
+
+            upstream = after.get('requests', 0) - before.get('requests', 0)
+            runs.append({
+                'run': i + 1,
+                'elapsed_seconds': round(elapsed, 3),
+                'results': count,
+                'upstream_requests': upstream,
+                'requests_per_second': round(upstream / elapsed, 2) if elapsed > 0 and upstream else None,
+                'rate_limited_429': after.get('rate_limited_429', 0) - before.get('rate_limited_429', 0),
+                'errors_5xx': after.get('errors_5xx', 0) - before.get('errors_5xx', 0),
+                'missing_fixtures': after.get('missing', 0) - before.get('missing', 0)
+            })
+            logger.info(f"⏱️ 第 {i + 1} 轮: {elapsed:.2f}s, 结果 {count} 条, 上游请求 {upstream} 次")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        'target': args.target,
+        'mode': 'replay' if args.replay_url else ('record' if args.record_dir else 'live'),
+        'runs': runs,
+        'rate_limits': get_rate_limiter().get_status(),
+        'upstream_metrics': get_metrics().snapshot()['endpoints']
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return True
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='上游API模拟器（录制/回放/压测）')
+    parser.add_argument('command', choices=['serve', 'list', 'bench'], help='执行的命令')
+    parser.add_argument('--fixtures', help='夹具目录（serve/list必填；bench指定时内置回放服务器）')
+    parser.add_argument('--port', type=int, default=18900, help='回放服务器端口')
+    parser.add_argument('--latency', default='recorded',
+                        help='延迟分布: recorded | fixed:50 | uniform:20:200 | lognormal:120:0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机502错误概率')
+    parser.add_argument('--burst-429', help='429突发 "周期秒:持续秒"，例如 30:5')
+    parser.add_argument('--missing', choices=['404', 'empty'], default='404', help='夹具缺失时的响应')
+    parser.add_argument('--seed', type=int, help='随机种子（保证可重复）')
+
+    parser.add_argument('--target', choices=['holders', 'smart_accounts', 'wallet_tags'], help='压测目标')
+    parser.add_argument('--chain-id', default='501', help='链ID')
+    parser.add_argument('--token', help='代币地址（holders/smart_accounts）')
+    parser.add_argument('--wallets', help='钱包地址列表，逗号分隔（wallet_tags）')
+    parser.add_argument('--top-n', type=int, default=100, help='holders: 获取前N大持仓')
+    parser.add_argument('--max-tokens', type=int, default=50, help='smart_accounts: 最多扫描代币数')
+    parser.add_argument('--page-limit', type=int, default=5, help='smart_accounts: 每个代币的交易页数')
+    parser.add_argument('--replay-url', help='使用已启动的回放服务器')
+    parser.add_argument('--record-dir', help='录制真实响应到该目录')
+    parser.add_argument('--no-cache', action='store_true', help='禁用响应缓存（测量真实上游负载）')
+    parser.add_argument('--repeat', type=int, default=1, help='重复次数')
+
+    args = parser.parse_args()
+
+    if args.command in ('serve', 'list') and not args.fixtures:
+        logger.error("❌ 请指定夹具目录: --fixtures <dir>")
+        return False
+
+    if args.command == 'serve':
+        server = ReplayServer(
+            args.fixtures, port=args.port, latency=args.latency, error_rate=args.error_rate,
+            burst_429=args.burst_429, missing=args.missing, seed=args.seed
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return True
+
+    elif args.command == 'list':
+        summary = FixtureStore(args.fixtures).summary()
+        for endpoint, count in sorted(summary.items()):
+            print(f"{count:6d}  {endpoint}")
+        print(f"共 {sum(summary.values())} 个夹具")
+        return True
+
+    elif args.command == 'bench':
+        if not args.target:
+            logger.error("❌ 请指定压测目标: --target <holders|smart_accounts|wallet_tags>")
+            return False
+        return bench(args)
+
+    return False
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,198 @@
+"""
+增量快照存储测试：写入 -> 降采样 -> 还原，与写入时的完整持仓逐行比对；
+以及 NaN 占比、空地址、重复地址等脏数据的写入与统计
+
+运行: python -m pytest -q test_snapshot_store.py（或 python test_snapshot_store.py）
+"""
+
+import os
+import random
+import shutil
+import tempfile
+
+import pandas as pd
+
+from services.sqlite_manager import SQLiteConnectionManager
+from services.snapshot_store import (
+    SnapshotStore, STATS_COLUMNS, matrix_stats, parse_retention_policy, to_epoch
+)
+
+TASK_ID = 'TEST_holder'
+TOKEN = 'TokenAddress111'
+HOUR = 3600
+SUPPLY = 10 ** 8
+# 整点起算，时间桶边界与快照时间对齐
+START = to_epoch('2025-01-06 00:00:00')
+
+
+def open_store(tmpdir, keyframe_interval=4, stats_tiers=(10, 100)):
+    db = SQLiteConnectionManager(os.path.join(tmpdir, 'snapshots.db'))
+    with db.writer() as conn:
+        SnapshotStore.create_tables(conn.cursor())
+    store = SnapshotStore(db)
+    store.keyframe_interval = keyframe_interval
+    store.stats_tiers = tuple(stats_tiers)
+    return db, store
+
+
+def holder(address, balance, percentage, value_usd=None):
+    return {'address': address, 'balance': balance, 'percentage': percentage,
+            'value_usd': balance * 0.5 if value_usd is None else value_usd}
+
+
+def expected_rows(holders):
+    """写入的持仓（占比互不相同、按占比降序）还原后应得到的行"""
+    return [
+        {'holder_address': h['address'], 'balance': float(h['balance']), 'percentage': float(h['percentage']),
+         'rank_position': rank, 'value_usd': float(h['value_usd'])}
+        for rank, h in enumerate(holders, 1)
+    ]
+
+
+def random_walk(snapshots, size=40, pool=80, seed=7):
+    """生成逐小时的持仓序列：每次有少量地址进出、余额变化（保证触发增量编码）"""
+    rng = random.Random(seed)
+    addresses = [f"Addr{i:03d}" for i in range(pool)]
+    current = {a: rng.randint(1, 10 ** 6) for a in rng.sample(addresses, size)}
+    series = []
+    for i in range(snapshots):
+        for address in rng.sample(sorted(current), 3):
+            current[address] = rng.randint(1, 10 ** 6)
+        if rng.random() < 0.5:
+            current.pop(rng.choice(sorted(current)))
+            current[rng.choice([a for a in addresses if a not in current])] = rng.randint(1, 10 ** 6)
+        ordered = sorted(current.items(), key=lambda item: (-item[1], item[0]))
+        series.append((START + i * HOUR, [holder(a, b, b / SUPPLY * 100) for a, b in ordered]))
+    return series
+
+
+def snapshot_map(store):
+    return {meta['snapshot_ts']: rows for meta, rows in store.iter_snapshots(TASK_ID)}
+
+
+def stats_frame(store, top_n):
+    stats = store.get_holder_stats(TASK_ID, top_n)
+    return stats.sort_values('address').reset_index(drop=True)
+
+
+def assert_stats_match_history(store):
+    """增量维护的 holder_stats 与从完整历史重新计算的结果一致"""
+    matrix = store.load_matrix(TASK_ID)
+    for top_n in store.stats_tiers:
+        expected = matrix_stats(matrix, top_n)[['address'] + STATS_COLUMNS]
+        expected = expected.sort_values('address').reset_index(drop=True)
+        actual = stats_frame(store, top_n)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_exact=False)
+
+
+def test_round_trip_with_compaction():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db, store = open_store(tmpdir)
+        series = random_walk(snapshots=10 * 24)
+        for ts, holders in series:
+            store.save_snapshot(TASK_ID, TOKEN, holders, ts)
+
+        written = {ts: expected_rows(holders) for ts, holders in series}
+        with db.reader() as conn:
+            keyframes, deltas = conn.execute(
+                "SELECT SUM(is_keyframe), SUM(1 - is_keyframe) FROM snapshot_meta WHERE task_id = ?",
+                (TASK_ID,)).fetchone()
+        assert keyframes and deltas, '应同时写出关键帧和增量'
+
+        restored = snapshot_map(store)
+        assert restored.keys() == written.keys()
+        for ts, rows in written.items():
+            assert restored[ts] == rows, f"还原结果不一致: {ts}"
+        assert_stats_match_history(store)
+
+        # 最近2天逐小时保留，更早的每天只保留收盘快照
+        now = series[-1][0] + HOUR
+        deleted = store.compact(TASK_ID, parse_retention_policy('2d=1h,*=1d'), now=now)
+        assert deleted > 0
+
+        restored = snapshot_map(store)
+        assert len(restored) == len(written) - deleted
+        for ts, rows in restored.items():
+            assert rows == written[ts], f"降采样后还原结果不一致: {ts}"
+        assert all(ts in restored for ts in written if now - ts < 2 * 86400)
+
+        # 降采样后接着写入，链状态从数据库重新读取
+        ts, holders = random_walk(snapshots=1, seed=11)[0]
+        store.save_snapshot(TASK_ID, TOKEN, holders, now)
+        assert store.get_snapshot(TASK_ID, now)[1] == expected_rows(holders)
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def test_nan_and_duplicate_addresses():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db, store = open_store(tmpdir)
+        clean = [holder('AddrA', 300, 30.0), holder('AddrB', 200, 20.0), holder('AddrC', 100, 10.0)]
+        dirty = [
+            holder('AddrA', 300, 30.0),
+            holder('AddrB', 200, 20.0),
+            holder('AddrB', 999, 5.0),          # 重复地址：保留排名靠前的一行
+            holder('', 50, 4.0),                # 空地址：丢弃
+            holder('AddrC', 100, float('nan')),  # NaN 占比：存为 NULL，排在最后
+            holder('AddrD', float('nan'), 1.0, value_usd=float('nan')),
+        ]
+        store.save_snapshot(TASK_ID, TOKEN, clean, START)
+        store.save_snapshot(TASK_ID, TOKEN, dirty, START + HOUR)
+        # 相同的脏数据再写一次，NaN 不应让每个增量都重复存储该行
+        store.save_snapshot(TASK_ID, TOKEN, dirty, START + 2 * HOUR)
+
+        with db.reader() as conn:
+            addresses = {row[0] for row in conn.execute("SELECT address FROM addresses")}
+            last_delta = conn.execute(
+                "SELECT delta_rows FROM snapshot_meta WHERE task_id = ? ORDER BY snapshot_id DESC LIMIT 1",
+                (TASK_ID,)).fetchone()[0]
+        assert addresses == {TOKEN, 'AddrA', 'AddrB', 'AddrC', 'AddrD'}
+        assert last_delta == 0
+
+        meta, rows = store.get_snapshot(TASK_ID, START + 2 * HOUR)
+        assert meta['holder_count'] == 4
+        assert [r['holder_address'] for r in rows] == ['AddrA', 'AddrB', 'AddrD', 'AddrC']
+        assert rows[1]['balance'] == 200.0
+        assert rows[2]['balance'] is None and rows[2]['value_usd'] == 0.0
+        assert rows[3]['percentage'] is None
+
+        diff = store.diff_snapshots(TASK_ID, START, START + HOUR)
+        assert [e['address'] for e in diff['entrants']] == ['AddrD']
+        assert diff['exits'] == []
+        assert store.diff_snapshots(TASK_ID)['summary']['entrants'] == 0
+
+        assert_stats_match_history(store)
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def test_backfill_interleaves_with_live_chain():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db, store = open_store(tmpdir)
+        series = random_walk(snapshots=24, seed=3)
+        live, backfill = series[12:], series[:12]
+        for ts, holders in live:
+            store.save_snapshot(TASK_ID, TOKEN, holders, ts)
+        # 已存在的时间点跳过
+        assert store.save_backfill(TASK_ID, TOKEN, backfill + live[:2]) == len(backfill)
+
+        restored = snapshot_map(store)
+        assert list(restored) == [ts for ts, _ in series]
+        for ts, holders in series:
+            assert restored[ts] == expected_rows(holders)
+        assert_stats_match_history(store)
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
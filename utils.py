@@ -1,66 +1,90 @@
 import requests
 import time
-import ssl
 import urllib3
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import json
 import pandas as pd
 from io import BytesIO
 from collections import defaultdict
-import certifi
 # 添加Flask导入
 from flask import send_file
+from config.http_client import get_http_client
+from services.response_cache import get_response_cache, make_cache_key
+from services.single_flight import get_single_flight
+from services.circuit_breaker import get_circuit_breakers
+from services.metrics import get_metrics
 
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def create_robust_session():
-    """创建一个更健壮的requests session"""
-    session = requests.Session()
-    
-    # 配置重试策略
-    retry_strategy = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS"]
+def fetch_data_robust(url, params=None, max_retries=3, timeout=15, headers=None, use_cache=True):
+    """更健壮的数据获取函数，复用按主机共享的连接池，并经过缓存/熔断/单飞保护层"""
+    return fetch_guarded(
+        url, params,
+        lambda: _fetch_with_retries(url, params, max_retries, timeout, headers),
+        use_cache=use_cache
     )
+
+def fetch_guarded(url, params, fetch_func, use_cache=True):
+    """
+    上游请求的公共保护层，依次为：
+    1. 响应缓存（配置了TTL的接口；“无数据”响应做短期负缓存）
+    2. 按 (接口, 链) 的熔断器：连续失败后快速失败，不再占用线程等待超时
+    3. 单飞合并：相同URL+参数（忽略 t）的并发请求只发出一次
+
+    fetch_func() 实际发出请求，失败返回 None
+    """
+    cache = get_response_cache() if use_cache else None
     
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
+    metrics = get_metrics()
+    if cache is not None:
+        cached = cache.get(url, params)
+        if cached is not None:
+            print(f"💾 缓存命中 {url[:50]}...")
+            metrics.increment(url, 'cache_hits')
+            return cached
+        if cache.get_ttl(url) > 0:
+            metrics.increment(url, 'cache_misses')
     
-    # 使用最新的 certifi 证书
-    session.verify = certifi.where()
+    breakers = get_circuit_breakers()
+    if not breakers.allow(url, params):
+        print(f"⚡ 熔断中，跳过请求 {breakers.breaker_name(url, params)}")
+        metrics.increment(url, 'circuit_rejected')
+        return None
     
-    # 设置请求头
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'application/json, text/plain, */*',
-        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Sec-Fetch-Dest': 'empty',
-        'Sec-Fetch-Mode': 'cors',
-        'Sec-Fetch-Site': 'same-site'
-    })
+    def run():
+        try:
+            data = fetch_func()
+        except Exception:
+            if breakers.enabled:
+                breakers.get_breaker(url, params).record_failure()
+            raise
+        if breakers.enabled:
+            breaker = breakers.get_breaker(url, params)
+            if data is None:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        if data is not None and cache is not None:
+            cache.set(url, params, data)
+        return data
     
-    return session
+    return get_single_flight().do(make_cache_key(url, params), run)
 
-def fetch_data_robust(url, params=None, max_retries=3, timeout=15):
-    """更健壮的数据获取函数，使用最新 certifi 证书"""
-    session = create_robust_session()
+def _fetch_with_retries(url, params, max_retries, timeout, headers):
+    """实际发出请求（带重试），全部失败返回 None"""
+    client = get_http_client()
     
     for attempt in range(max_retries):
         try:
             print(f"🔄 请求 {url[:50]}... (尝试 {attempt + 1}/{max_retries})")
+            if attempt > 0:
+                get_metrics().increment(url, 'app_retries')
             
-            response = session.get(
+            response = client.get(
                 url, 
                 params=params, 
+                headers=headers,
                 timeout=timeout,
-                verify=certifi.where(),  # 使用最新的 certifi 证书包
                 allow_redirects=True
             )
             
@@ -81,21 +105,18 @@ def fetch_data_robust(url, params=None, max_retries=3, timeout=15):
                 time.sleep(2 ** attempt)  # 指数退避
                 continue
             else:
-                print("🔄 尝试更新 certifi 证书并重试...")
-                # 最后一次尝试：确保使用最新证书
+                print("🔄 重建连接池并使用最新 certifi 证书重试...")
+                # 最后一次尝试：丢弃可能损坏的连接池，重新建立TLS连接
                 try:
-                    # 创建新的SSL上下文，使用最新证书
-                    ssl_context = ssl.create_default_context(cafile=certifi.where())
-                    
-                    with requests.Session() as fallback_session:
-                        fallback_session.verify = certifi.where()
-                        fallback_response = fallback_session.get(
-                            url, 
-                            params=params, 
-                            timeout=timeout
-                        )
-                        fallback_response.raise_for_status()
-                        return fallback_response.json()
+                    client.reset_host(url)
+                    fallback_response = client.get(
+                        url, 
+                        params=params, 
+                        headers=headers,
+                        timeout=timeout
+                    )
+                    fallback_response.raise_for_status()
+                    return fallback_response.json()
                         
                 except Exception as fallback_error:
                     print(f"❌ 使用最新证书的备用方案也失败: {fallback_error}")